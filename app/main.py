@@ -1,17 +1,37 @@
 import os
 from datetime import datetime
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query, Response
-from app.internal import settings, laborMagic
+from app.internal import settings
+from app.internal.laborRunner import labor_runner, warm_start
+from app.internal.workers import labor_workers
 import app.internal.logging
 # Scheduler
 import app.internal.ACTFastScheduler as ACTFastScheduler
 scheduler = ACTFastScheduler.scheduler  # Scheduler must be created before the routers are imported.
-scheduler.add_job(
-    laborMagic.process_live_labor,
-    "interval",
-    seconds=settings.LABOR_REFRESH_INTERVAL,
-    id="labor_magic",
-    max_instances=1)
+
+
+def schedule_labor_job():
+    scheduler.add_job(
+        labor_runner.run,  # goes through the runner so it merges with forced updates instead of racing them.
+        "interval",
+        seconds=settings.LABOR_REFRESH_INTERVAL,
+        id="labor_magic",
+        name="process_live_labor",
+        max_instances=1,
+        replace_existing=True)
+
+
+def on_elected():
+    # multi-worker mode, this worker just took the scheduler role (see workers.WorkerCoordinator).
+    schedule_labor_job()
+    if settings.LABOR_WARM_START:
+        warm_start()
+
+
+# with more than one worker only the elected one schedules the job, see lifespan.
+if not labor_workers.enabled:
+    schedule_labor_job()
 
 # /Scheduler
 from app.internal.stats import StatsManager
@@ -22,17 +42,25 @@ settings.VERSION = "0.1.8"
 stats_manager = StatsManager(os.path.join(settings.STATS_PATH, settings.STATS_FILENAME))
 
 
-# TODO: Run the scheduled job on startup to populate the cache.
 # TODO: Add script to compare current data and query existing deployed api to make sure they are the same.
-# TODO: Execute/Update endpoint should exit and run job in background, instead of hanging the user.
 # TODO: https://www.uvicorn.org/deployment/ - generate ssl keys for uvicorn to use.
-# TODO: Expand csv export so users can link their excel to the api.
 # http://actfast:8080/Epicor/Labor/ActiveLaborEfficiency?OprSeq=440
 
 
 
+@asynccontextmanager
+async def lifespan(app):
+    if labor_workers.enabled:
+        labor_workers.start(on_elected)
+    elif settings.LABOR_WARM_START:
+        warm_start()
+    yield
+    labor_workers.stop()
+
+
 # Create the FastAPI instance
 ACTFast = FastAPI(
+    lifespan=lifespan,
     title="ACTFast API",
     description="""
     Custom built API for ACTI. Used to do complex data retrieval and evaluation tasks for ACTI.
@@ -74,8 +102,9 @@ tags_metadata = [
 
 ]
 
-from app.routers import LaborRouter, StatsRouter, MiscRouter
+from app.routers import LaborRouter, StatsRouter, MiscRouter, ExportRouter
 ACTFast.include_router(LaborRouter.LaborRouter)
+ACTFast.include_router(ExportRouter.ExportRouter)
 ACTFast.include_router(MiscRouter.MiscRouter)
 ACTFast.include_router(StatsRouter.StatsRouter)
 
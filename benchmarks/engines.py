@@ -0,0 +1,96 @@
+import sys
+import time
+import argparse
+import statistics
+from datetime import date
+from app.internal import settings
+from app.benchmarks.synthetic import SyntheticEpicor
+
+# Compares the labor engines on a closed synthetic day (see synthetic.py): how long each takes, and how far each
+# one's job totals are from the exact engine's. The slot engines count a whole slot when its start falls inside a
+# record, so their totals move with where the records land against the grid.
+#
+#   python -m app.benchmarks.engines [--emps 200] [--slots 60 300 900] [--repeat 5] [--legacy]
+
+DATE = date(2024, 1, 2)
+
+
+def run_engine(engine, rows, shiftdata, slot_seconds=None):
+    """
+    Job totals for the day with every record counted.
+    :return: Series of hours per JobNum
+    """
+    from app.internal import laborMagic
+
+    saved = settings.LABOR_SLOT_SECONDS
+    if slot_seconds:
+        settings.LABOR_SLOT_SECONDS = slot_seconds
+    try:
+        totals = laborMagic.GetLaborDtlData(date=DATE.strftime('%Y-%m-%d'), engine=engine, incremental=False,
+                                            shiftdata=shiftdata, prefetched=(None, rows), active_only=False)
+    finally:
+        settings.LABOR_SLOT_SECONDS = saved
+    return totals.set_index('JobNum')['Total'].astype(float)
+
+
+def bench(engine, rows, shiftdata, slot_seconds=None, repeat=5):
+    """
+    :return: (median seconds, job totals)
+    """
+    timings = []
+    totals = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        totals = run_engine(engine, [dict(row) for row in rows], shiftdata, slot_seconds)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), totals
+
+
+def compare(totals, exact):
+    """
+    :return: dict of mean and max absolute error per job (hours), and the error in the day's total hours (%)
+    """
+    totals, exact = totals.align(exact, fill_value=0.0)
+    error = (totals - exact).abs()
+    day = exact.sum()
+    return {
+        'mean_abs_err': error.mean(),
+        'max_abs_err': error.max(),
+        'total_err_pct': (totals.sum() - day) / day * 100 if day else 0.0,
+    }
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Compare the labor engines for speed and accuracy.')
+    parser.add_argument('--emps', type=int, default=200, help='employees in the synthetic day')
+    parser.add_argument('--slots', type=int, nargs='+', default=[60, 300, 900], help='slot sizes to try, seconds')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per engine, the median is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy', action='store_true', help='include the legacy engine (slow)')
+    args = parser.parse_args(argv)
+
+    day = SyntheticEpicor(args.emps, hour=23.99, date=DATE, seed=args.seed)
+    rows = day.rows('LaborDtl', (DATE,))
+    shiftdata = pd.DataFrame(day.rows('ShiftData'))
+    print(f'{args.emps} emps, {len(rows)} LaborDtl rows, median of {args.repeat} runs')
+
+    exact_time, exact = bench('exact', rows, shiftdata, repeat=args.repeat)
+    results = [('exact', exact_time, compare(exact, exact))]
+    for slot_seconds in args.slots:
+        elapsed, totals = bench('vectorized', rows, shiftdata, slot_seconds, args.repeat)
+        results.append((f'vectorized {slot_seconds}s', elapsed, compare(totals, exact)))
+    if args.legacy:
+        elapsed, totals = bench('legacy', rows, shiftdata, repeat=1)
+        results.append((f'legacy {settings.LABOR_SLOT_SECONDS}s', elapsed, compare(totals, exact)))
+
+    print(f"{'engine':<18}{'seconds':>10}{'mean err h':>12}{'max err h':>12}{'day err %':>11}")
+    for name, elapsed, error in results:
+        print(f"{name:<18}{elapsed:>10.4f}{error['mean_abs_err']:>12.4f}{error['max_abs_err']:>12.4f}"
+              f"{error['total_err_pct']:>11.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+from datetime import datetime
+from app.internal import settings
+
+# Benchmarks the labor pipeline on synthetic Epicor data (see synthetic.py) at a few shop sizes: the slot engine,
+# a full and an incremental labor run, and the HTTP endpoints the shop screens hit. Timings are the median of
+# --repeat runs, peak memory is traced on one extra run (tracemalloc, Python and numpy allocations). Results are
+# JSON, on stdout or in --out, with a summary table on stderr.
+#
+#   python -m app.benchmarks.pipeline [--emps 50 500 5000] [--repeat 5] [--hour 10] [--out results.json]
+
+
+def isolate(path):
+    """
+    Point everything the pipeline writes (labor snapshot, emps not clocked, stats, history) at a scratch dir, so a
+    benchmark never touches the real data. Has to run before the labor modules are imported.
+    """
+    settings.DATA_PATH = path
+    settings.STATS_PATH = path
+    settings.HISTORY_PATH = os.path.join(path, 'history')
+
+
+def measure(run, repeat, setup=None):
+    """
+    :param run: callable, one run of the stage
+    :param setup: callable run (untimed) before each run
+    :return: dict of timings (seconds) and traced peak memory (MB)
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'median_s': round(statistics.median(timings), 6),
+        'min_s': round(min(timings), 6),
+        'max_s': round(max(timings), 6),
+        'peak_mb': round(peak / 1024 / 1024, 3),
+    }
+
+
+def http_client():
+    """
+    TestClient over the labor routers, without the scheduler or the warm start in app.main.
+    """
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.routers.LaborRouter import LaborRouter
+    from app.routers.ExportRouter import ExportRouter
+
+    app = FastAPI()
+    app.include_router(LaborRouter)
+    app.include_router(ExportRouter)
+    return TestClient(app)
+
+
+def stages(day, client):
+    """
+    The stages to run against a synthetic day, in order. Each is (name, callable, setup callable or None).
+    """
+    import pandas as pd
+    from app.internal import laborMagic
+    from app.internal.snapshot import labor_snapshots
+
+    date = day.date.strftime('%Y-%m-%d')
+    shiftdata = pd.DataFrame(day.rows('ShiftData'))
+    oprseqs = list(settings.DEPT_TRANSLATE)
+
+    def get_labordtl_data():
+        rows = day.rows('LaborDtl', (date,))
+        laborMagic.GetLaborDtlData(incremental=False, shiftdata=shiftdata, prefetched=(None, rows))
+
+    def labormagic_full():
+        laborMagic.labormagic(full=True)
+
+    def five_minutes_later():
+        day.advance(5)
+
+    def http_get(path, **params):
+        def get():
+            response = client.get(path, params=params)
+            response.raise_for_status()
+        return get
+
+    def http_efficiency():
+        for oprseq in oprseqs:
+            http_get('/Epicor/Labor/ActiveLaborEfficiency', OprSeq=oprseq)()
+
+    def http_delta():
+        since = max(labor_snapshots.current().version - 1, 0)
+        for oprseq in oprseqs:
+            http_get('/Epicor/Labor/ActiveLaborEfficiency/Delta', OprSeq=oprseq, since=since)()
+
+    return [
+        ('GetLaborDtlData', get_labordtl_data, None),
+        ('labormagic.full', labormagic_full, None),
+        # the scheduled job: five minutes later, an incremental run, published.
+        ('process_live_labor', laborMagic.process_live_labor, five_minutes_later),
+        ('http.ActiveLaborEfficiency', http_efficiency, None),
+        ('http.ActiveLaborEfficiency.Delta', http_delta, None),
+        ('http.Export.Efficiency', http_get('/Epicor/Labor/Export/Efficiency', Format='csv'), None),
+        ('http.Export.LaborDtl', http_get('/Epicor/Labor/Export/LaborDtl', Date=date, Format='ndjson'), None),
+    ]
+
+
+def run_scale(emps, args, client):
+    from app.benchmarks.synthetic import SyntheticEpicor
+
+    day = SyntheticEpicor(emps, jobs=args.jobs, concurrency=args.concurrency, hour=args.hour, seed=args.seed)
+    uninstall = day.install()
+    try:
+        result = {
+            'emps': emps,
+            'jobs': day.jobs,
+            'labordtl_rows': len(day.labordtl),
+            'active_rows': sum(row['ActiveTrans'] for row in day.labordtl),
+            'stages': {},
+        }
+        for name, run, setup in stages(day, client):
+            if args.stages and name not in args.stages:
+                continue
+            result['stages'][name] = measure(run, args.repeat, setup)
+        result['max_rss_mb'] = _max_rss_mb()
+        return result
+    finally:
+        uninstall()
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _summary(results):
+    lines = [f"{'emps':>6}  {'stage':<34}{'median s':>10}{'peak MB':>10}"]
+    for scale in results['scales']:
+        for name, stage in scale['stages'].items():
+            lines.append(f"{scale['emps']:>6}  {name:<34}{stage['median_s']:>10.4f}{stage['peak_mb']:>10.2f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the labor pipeline on synthetic Epicor data.')
+    parser.add_argument('--emps', type=int, nargs='+', default=[50, 500, 5000], help='shop sizes to run')
+    parser.add_argument('--jobs', type=int, default=None, help='open jobs, defaults to one per three emps')
+    parser.add_argument('--concurrency', type=float, default=0.2, help='chance a record runs alongside another job')
+    parser.add_argument('--hour', type=float, default=10.0, help='time of day, decimal hours')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per stage, the median is reported')
+    parser.add_argument('--engine', default=None, help="labor engine, defaults to settings.LABOR_ENGINE")
+    parser.add_argument('--stages', nargs='+', default=None, help='only run these stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp(prefix='actfast-bench-')
+    isolate(scratch)
+    if args.engine:
+        settings.LABOR_ENGINE = args.engine
+
+    import numpy as np
+    import pandas as pd
+
+    client = http_client()
+    results = {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'engine': settings.LABOR_ENGINE,
+        'slot_seconds': settings.LABOR_SLOT_SECONDS,
+        'incremental': settings.LABOR_INCREMENTAL,
+        'hour': args.hour,
+        'concurrency': args.concurrency,
+        'repeat': args.repeat,
+        'scales': [],
+    }
+    for emps in args.emps:
+        results['scales'].append(run_scale(emps, args, client))
+        print(f'{emps} emps done', file=sys.stderr, flush=True)
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    print(_summary(results), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
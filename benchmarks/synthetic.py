@@ -0,0 +1,409 @@
+import sys
+import time
+import random
+import logging
+import argparse
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pytz import timezone
+from app.internal import settings
+
+# Synthetic Epicor data for the benchmarks. Builds the tables the labor queries read (EmpBasic, JCShift, ShiftBrk,
+# LaborHed, LaborDtl, JobHead, JobOper) and answers the registered queries (queries.py) from them by name, so the
+# labor pipeline can run end to end without Epicor. Either in process (install) or through a SQLite file for
+# settings.DATA_SOURCE = 'sqlite' (to_sqlite, or from the command line, see main):
+#
+#   python -m app.benchmarks.synthetic --sqlite data/epicor.sqlite [--emps 500] [--follow]
+
+logger = logging.getLogger(__name__)
+
+COMPANY = 'SYNTH'
+
+# table -> (rows attribute, columns), the order to_sqlite writes them in.
+TABLES = {
+    'EmpBasic': ('empbasic', ('Empid', 'Name', 'FirstName', 'LastName', 'JCDept', 'Shift', 'EmpStatus')),
+    'JCShift': ('jcshift', ('Shift', 'StartTime', 'EndTime', 'LunchStart', 'LunchEnd')),
+    'ShiftBrk': ('shiftbrk', ('Shift', 'BreakStart', 'BreakEnd')),
+    'JobHead': ('jobhead', ('JobNum', 'PartNum')),
+    'JobOper': ('joboper', ('JobNum', 'OprSeq', 'EstProdHours', 'ActProdHours')),
+    'LaborHed': ('laborhed', ('LaborHedSeq', 'EmployeeNum', 'ActiveTrans')),
+    'LaborDtl': ('labordtl', ('LaborDtlSeq', 'LaborHedSeq', 'EmployeeNum', 'JobNum', 'OprSeq', 'ClockInDate',
+                              'ClockInTime', 'ClockOutTime', 'LaborHrs', 'ActiveTrans', 'SysRevID')),
+}
+LABOR_TABLES = ('LaborHed', 'LaborDtl')
+
+SHIFTS = {
+    # Shift: (StartTime, EndTime, LunchStart, LunchEnd, [(BreakStart, BreakEnd), ...])
+    '1': (6.0, 14.5, 11.5, 12.0, [(9.0, 9.25), (13.0, 13.1667)]),
+    '2': (14.5, 23.0, 19.0, 19.5, [(17.0, 17.25), (21.0, 21.1667)]),
+    '3': (6.0, 14.5, None, None, []),
+}
+SHIFT_WEIGHTS = {'1': 6, '2': 3, '3': 1}
+
+
+def _dec(hours, places=2):
+    return Decimal(str(round(hours, places))) if hours is not None else None
+
+
+class SyntheticEpicor:
+    """
+    One synthetic shop day.
+
+    Employees clock in at their shift start (a few minutes either side) and work a string of jobs at their
+    department's OprSeq until now or the end of their shift. Some records run alongside another job (group work).
+    Labor that's still open at hour is active (ActiveTrans = 1, ClockOutTime 24, or 0 for group work), like Epicor.
+
+    :param emps: employees
+    :param jobs: open jobs, defaults to one per three employees (at least 10)
+    :param concurrency: chance a record has a second job running alongside it
+    :param hour: time of day, decimal hours. Only labor up to here exists yet.
+    :param not_clocked: share of clocked in employees with no labor on a job
+    :param date: labor date (datetime.date), defaults to today (US/Pacific)
+    :param seed: random seed, the same knobs and seed give the same day
+    """
+
+    def __init__(self, emps=500, jobs=None, concurrency=0.2, hour=10.0, not_clocked=0.05, date=None, seed=0):
+        self.emps = emps
+        self.jobs = jobs or max(10, emps // 3)
+        self.concurrency = concurrency
+        self.hour = hour
+        self.not_clocked = not_clocked
+        self.date = date or datetime.now(timezone('US/Pacific')).date()
+        self.random = random.Random(seed)
+        self.sysrev = 0
+
+        self.empbasic = []
+        self.jcshift = []
+        self.shiftbrk = []
+        self.laborhed = []
+        self.labordtl = []
+        self.jobhead = []
+        self.joboper = []
+        self._clock_out = {}  # EmployeeNum -> clock out, for emps clocked in
+        self._pending = []  # (clock in, EmployeeNum, OprSeq, shift end), emps yet to clock in
+        self._build()
+
+    @property
+    def now(self):
+        """
+        The synthetic clock, for laborMagic.pacific_now.
+        """
+        midnight = timezone('US/Pacific').localize(datetime(self.date.year, self.date.month, self.date.day))
+        return midnight + timedelta(hours=min(self.hour, 23.9997))
+
+    def _build(self):
+        rnd = self.random
+        depts = [(oprseq, codes[0]) for oprseq, codes in settings.DEPT_TRANSLATE.items()]
+
+        for shift, (start, end, lunch_start, lunch_end, breaks) in SHIFTS.items():
+            self.jcshift.append(dict(Shift=shift, StartTime=_dec(start), EndTime=_dec(end),
+                                     LunchStart=_dec(lunch_start, 4), LunchEnd=_dec(lunch_end, 4)))
+            for break_start, break_end in breaks:
+                self.shiftbrk.append(dict(Shift=shift, BreakStart=_dec(break_start, 4), BreakEnd=_dec(break_end, 4)))
+
+        for j in range(self.jobs):
+            jobnum = f'{100000 + j}'
+            partnum = f'{rnd.randrange(100, 999)}A{rnd.randrange(1000, 9999)}-{rnd.randrange(100, 999)}'
+            self.jobhead.append(dict(JobNum=jobnum, PartNum=partnum))
+            for oprseq, _ in depts:
+                self.joboper.append(dict(JobNum=jobnum, OprSeq=oprseq, EstProdHours=_dec(rnd.uniform(1, 40)),
+                                         ActProdHours=_dec(rnd.uniform(0, 30))))
+
+        shifts = list(SHIFT_WEIGHTS)
+        weights = [SHIFT_WEIGHTS[shift] for shift in shifts]
+        for e in range(self.emps):
+            empid = f'{1000 + e}'
+            shift = rnd.choices(shifts, weights)[0]
+            oprseq, dept = depts[e % len(depts)]
+            self.empbasic.append(dict(Empid=empid, Name=f'Emp{e} Last{e}', FirstName=f'Emp{e}', LastName=f'Last{e}',
+                                      JCDept=dept, Shift=shift, EmpStatus='A'))
+
+            start, end = SHIFTS[shift][0], SHIFTS[shift][1]
+            clock = start + rnd.uniform(-0.2, 0.1)
+            if clock >= self.hour:
+                self._pending.append((clock, empid, oprseq, end))  # hasn't clocked in yet.
+                continue
+            clocked_in = self.hour < end
+            hed = dict(LaborHedSeq=len(self.laborhed) + 1, EmployeeNum=empid, ActiveTrans=1 if clocked_in else 0)
+            self.laborhed.append(hed)
+            if clocked_in and rnd.random() < self.not_clocked:
+                self._clock_out[empid] = end
+                continue
+
+            clock_out = end + rnd.uniform(-0.1, 0.2)
+            if clocked_in:
+                self._clock_out[empid] = clock_out
+            while clock < min(self.hour, clock_out):
+                length = rnd.uniform(0.2, 2.5)
+                jobs = 2 if rnd.random() < self.concurrency else 1
+                for _ in range(jobs):
+                    begin = clock + (rnd.uniform(0, 0.1) if jobs > 1 else 0.0)
+                    if begin >= min(self.hour, clock_out):
+                        continue
+                    finish = min(clock + length, clock_out)
+                    self._add_labor(hed, empid, rnd.randrange(self.jobs), oprseq, begin,
+                                    None if finish >= self.hour else finish, group=jobs > 1)
+                clock += length + rnd.uniform(0, 0.1)
+
+    def _add_labor(self, hed, empid, job, oprseq, begin, finish, group=False):
+        """
+        :param finish: clock out, decimal hours. None for labor that's still open.
+        """
+        self.sysrev += 1
+        active = finish is None
+        if active:
+            out = Decimal(0) if group else Decimal(24)
+        else:
+            out = _dec(finish)
+        self.labordtl.append(dict(
+            LaborDtlSeq=len(self.labordtl) + 1, LaborHedSeq=hed['LaborHedSeq'], EmployeeNum=empid,
+            JobNum=self.jobhead[job]['JobNum'], OprSeq=oprseq, ClockInDate=self.date, ClockInTime=_dec(begin),
+            ClockOutTime=out, LaborHrs=Decimal(0) if active else _dec(finish - begin), ActiveTrans=1 if active else 0,
+            SysRevID=self.sysrev))
+
+    def advance(self, minutes=5.0, switch_rate=0.5):
+        """
+        Move the clock forward. Some active labor ends in the new window (switch_rate per hour per record), and
+        the employee moves on to another job. Employees whose shift starts in the window clock in, and the ones
+        whose shift ends clock out. Changed and new rows get new SysRevIDs, like Epicor.
+        """
+        rnd = self.random
+        old, self.hour = self.hour, self.hour + minutes / 60
+        chance = switch_rate * minutes / 60
+        heds = {hed['EmployeeNum']: hed for hed in self.laborhed}
+        for row in [row for row in self.labordtl if row['ActiveTrans'] == 1]:
+            clock_out = self._clock_out.get(row['EmployeeNum'], 24.0)
+            if clock_out < self.hour:
+                finish, switch = max(clock_out, float(row['ClockInTime'])), False
+            elif rnd.random() < chance:
+                finish, switch = rnd.uniform(old, self.hour), True
+            else:
+                continue
+            self.sysrev += 1
+            row.update(ClockOutTime=_dec(finish), LaborHrs=_dec(finish - float(row['ClockInTime'])), ActiveTrans=0,
+                       SysRevID=self.sysrev)
+            if switch:
+                self._add_labor(heds[row['EmployeeNum']], row['EmployeeNum'], rnd.randrange(self.jobs),
+                                row['OprSeq'], finish, None)
+
+        for empid, clock_out in list(self._clock_out.items()):
+            if clock_out < self.hour:
+                heds[empid]['ActiveTrans'] = 0
+                del self._clock_out[empid]
+
+        pending = []
+        for clock, empid, oprseq, end in self._pending:
+            if clock >= self.hour:
+                pending.append((clock, empid, oprseq, end))
+                continue
+            hed = dict(LaborHedSeq=len(self.laborhed) + 1, EmployeeNum=empid, ActiveTrans=1)
+            self.laborhed.append(hed)
+            self._clock_out[empid] = end + rnd.uniform(-0.1, 0.2)
+            if rnd.random() >= self.not_clocked:
+                self._add_labor(hed, empid, rnd.randrange(self.jobs), oprseq, clock, None)
+        self._pending = pending
+
+    # --- the registered queries, answered from the tables ---
+
+    def rows(self, name, params=None):
+        """
+        Rows for a registered query, the same columns the SQL returns.
+        :param name: query name, see queries.py
+        :param params: the query's parameter values
+        :return: list of dicts, fresh copies (callers change them)
+        """
+        params = params or ()
+        handler = getattr(self, f'_q_{name}', None)
+        if handler is None:
+            raise KeyError(f'No synthetic data for query {name}')
+        return handler(*params)
+
+    def _day(self, date):
+        date = str(date)
+        return [row for row in self.labordtl if str(row['ClockInDate']) == date]
+
+    @staticmethod
+    def _labor_row(row):
+        return {key: row[key] for key in ('LaborDtlSeq', 'EmployeeNum', 'JobNum', 'OprSeq', 'ClockInDate',
+                                           'ClockInTime', 'ClockOutTime', 'ActiveTrans', 'SysRevID')}
+
+    def _q_ShiftData(self):
+        shifts = {row['Shift']: row for row in self.jcshift}
+        breaks = {}
+        for row in self.shiftbrk:
+            breaks.setdefault(row['Shift'], []).append(row)
+        out = []
+        for emp in self.empbasic:
+            if emp['EmpStatus'] != 'A':
+                continue
+            shift = shifts[emp['Shift']]
+            for brk in breaks.get(emp['Shift']) or [dict(BreakStart=None, BreakEnd=None)]:
+                out.append(dict(Empid=emp['Empid'], Name=emp['Name'], FirstName=emp['FirstName'],
+                                LastName=emp['LastName'], JCDept=emp['JCDept'], Shift=shift['Shift'],
+                                StartTime=shift['StartTime'], EndTime=shift['EndTime'], LunchStart=shift['LunchStart'],
+                                LunchEnd=shift['LunchEnd'], BreakStart=brk['BreakStart'], BreakEnd=brk['BreakEnd']))
+        return out
+
+    def _q_LaborDtl(self, date):
+        return [self._labor_row(row) for row in self._day(date)]
+
+    def _q_LaborDtlDelta(self, date, watermark):
+        return [self._labor_row(row) for row in self._day(date)
+                if row['SysRevID'] > watermark or row['ActiveTrans'] == 1]
+
+    def _q_LaborDtlExport(self, date):
+        return [{key: row[key] for key in ('LaborDtlSeq', 'EmployeeNum', 'JobNum', 'OprSeq', 'ClockInDate',
+                                           'ClockInTime', 'ClockOutTime', 'LaborHrs', 'ActiveTrans')}
+                for row in self._day(date)]
+
+    def _q_EmpsNotClocked(self):
+        labor = {row['LaborHedSeq'] for row in self.labordtl}
+        emps = {emp['Empid']: emp for emp in self.empbasic}
+        return [dict(employeenum=hed['EmployeeNum'], FirstName=emps[hed['EmployeeNum']]['FirstName'],
+                     LastName=emps[hed['EmployeeNum']]['LastName'], jcdept=emps[hed['EmployeeNum']]['JCDept'],
+                     Laborcount=0)
+                for hed in self.laborhed if hed['ActiveTrans'] == 1 and hed['LaborHedSeq'] not in labor]
+
+    def _joboper(self):
+        parts = {job['JobNum']: job['PartNum'] for job in self.jobhead}
+        return parts, {(oper['JobNum'], oper['OprSeq']): oper for oper in self.joboper}
+
+    def _q_ActiveLabor(self):
+        parts, opers = self._joboper()
+        out = {}
+        for row in self.labordtl:
+            key = (row['JobNum'], row['OprSeq'])
+            if row['ActiveTrans'] == 1 and key not in out:
+                out[key] = dict(OprSeq=row['OprSeq'], JobNum=row['JobNum'], PartNum=parts[row['JobNum']],
+                                Standard=opers[key]['EstProdHours'], ActProdHours=opers[key]['ActProdHours'])
+        return list(out.values())
+
+    def _q_ActiveEmps(self):
+        return [dict(EmployeeNum=row['EmployeeNum'], Jobnum=row['JobNum'])
+                for row in self.labordtl if row['ActiveTrans'] == 1]
+
+    def _q_LaborHistoryJobs(self, date):
+        parts, opers = self._joboper()
+        keys = dict.fromkeys((row['JobNum'], row['OprSeq']) for row in self._day(date))
+        return [dict(OprSeq=oprseq, JobNum=jobnum, PartNum=parts[jobnum],
+                     Standard=opers[(jobnum, oprseq)]['EstProdHours'], PrevHrs=opers[(jobnum, oprseq)]['ActProdHours'])
+                for jobnum, oprseq in keys]
+
+    def _q_LaborHistoryEmps(self, date):
+        pairs = dict.fromkeys((row['EmployeeNum'], row['JobNum']) for row in self._day(date))
+        return [dict(EmployeeNum=emp, Jobnum=job) for emp, job in pairs]
+
+    # --- SQLite ---
+
+    def to_sqlite(self, path, tables=None):
+        """
+        Write the day to a SQLite file for dataSource.SQLiteSource, replacing what the tables held. One transaction,
+        so the app never reads a half written day.
+        :param path: SQLite file, created if missing
+        :param tables: table names to write, default all of TABLES
+        """
+        from app.internal.dataSource import SQLiteSource
+
+        conn = SQLiteSource.create(path)
+        try:
+            with conn:
+                for table in tables or TABLES:
+                    attr, columns = TABLES[table]
+                    conn.execute(f'DELETE FROM {table}')
+                    conn.executemany(
+                        f'INSERT INTO {table} (Company, {", ".join(columns)}) '
+                        f'VALUES (?, {", ".join("?" * len(columns))})',
+                        [(COMPANY,) + tuple(row[column] for column in columns) for row in getattr(self, attr)])
+        finally:
+            conn.close()
+
+    # --- stubbing ---
+
+    def install(self):
+        """
+        Answer InsightUtils.QueryWrapper / QueryStream from this day instead of Epicor, and run the labor code on
+        this day's clock. Drops anything the query cache and labor accumulator kept from before.
+        :return: callable that puts everything back
+        """
+        from app.internal import laborMagic
+        from app.internal.utils import InsightUtils
+        from app.internal.queryCache import query_cache
+        from app.internal.laborIncremental import labor_accumulator
+
+        saved = (InsightUtils.QueryWrapper, InsightUtils.QueryStream, laborMagic.pacific_now)
+
+        def query_wrapper(query, name='', cacheOn=False, longCache=False, params=None):
+            return self.rows(name, params)
+
+        def query_stream(query, name='', params=None, batch_size=None):
+            rows = self.rows(name, params)
+            batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size]
+
+        InsightUtils.QueryWrapper = staticmethod(query_wrapper)
+        InsightUtils.QueryStream = staticmethod(query_stream)
+        laborMagic.pacific_now = lambda: self.now
+        query_cache.invalidate()
+        labor_accumulator.reset()
+
+        def uninstall():
+            InsightUtils.QueryWrapper = staticmethod(saved[0])
+            InsightUtils.QueryStream = staticmethod(saved[1])
+            laborMagic.pacific_now = saved[2]
+            query_cache.invalidate()
+            labor_accumulator.reset()
+
+        return uninstall
+
+
+def follow(day, path, interval=60.0, switch_rate=0.5):
+    """
+    Keep a SQLite file live: every interval seconds move the day to the real time of day (US/Pacific) and write
+    the labor tables again. A new date starts a new day. Runs until interrupted.
+    """
+    while True:
+        time.sleep(interval)
+        now = datetime.now(timezone('US/Pacific'))
+        hour = now.hour + now.minute / 60 + now.second / 3600
+        if now.date() != day.date:
+            day = SyntheticEpicor(day.emps, day.jobs, day.concurrency, hour, day.not_clocked, now.date(),
+                                  day.random.randrange(1 << 30))
+            day.to_sqlite(path)
+            logger.info(f'New day {day.date}, {len(day.labordtl)} LaborDtl rows')
+        elif hour > day.hour:
+            day.advance((hour - day.hour) * 60, switch_rate)
+            day.to_sqlite(path, LABOR_TABLES)
+            logger.debug(f'Advanced to {hour:.2f}, {len(day.labordtl)} LaborDtl rows')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic Epicor day to SQLite, for DATA_SOURCE = sqlite.')
+    parser.add_argument('--sqlite', default=None, help='SQLite file, defaults to settings.SQLITE_PATH')
+    parser.add_argument('--emps', type=int, default=500)
+    parser.add_argument('--jobs', type=int, default=None, help='open jobs, defaults to one per three emps')
+    parser.add_argument('--concurrency', type=float, default=0.2, help='chance a record runs alongside another job')
+    parser.add_argument('--hour', type=float, default=None, help='time of day, decimal hours, defaults to now')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--follow', action='store_true', help='keep the labor moving with the real clock')
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between --follow updates')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    path = args.sqlite or settings.SQLITE_PATH
+    now = datetime.now(timezone('US/Pacific'))
+    hour = args.hour if args.hour is not None else now.hour + now.minute / 60 + now.second / 3600
+    day = SyntheticEpicor(args.emps, jobs=args.jobs, concurrency=args.concurrency, hour=hour, seed=args.seed)
+    day.to_sqlite(path)
+    logger.info(f'{path}: {day.emps} emps, {day.jobs} jobs, {len(day.labordtl)} LaborDtl rows for {day.date} '
+                f'up to {hour:.2f}')
+    if args.follow:
+        try:
+            follow(day, path, args.interval)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import os
+import re
+import sqlite3
+import logging
+from decimal import Decimal
+from app.internal import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DataSource:
+    """
+    Where InsightUtils.QueryWrapper / QueryStream run their queries. A source makes connections for the pool, hands
+    out cursors that return dict rows, and turns the SQL the app writes (T-SQL, see queries.NamedQuery) into
+    something it can run.
+    """
+
+    name = None
+
+    def connect(self):
+        """
+        :return: a new DB-API connection
+        """
+        raise NotImplementedError
+
+    def cursor(self, conn):
+        """
+        :return: a cursor on conn whose rows are dicts keyed by column name
+        """
+        raise NotImplementedError
+
+    def prepare(self, query, params):
+        """
+        :return: (query, params) ready for cursor.execute
+        """
+        return query, params
+
+
+class EpicorSource(DataSource):
+    """
+    Epicor's SQL Server, with the settings.EPICORSQL_* credentials.
+    """
+
+    name = 'epicor'
+
+    def connect(self):
+        # pymssql needs FreeTDS, only load it when Epicor is actually the source.
+        import pymssql
+        return pymssql.connect(
+            settings.EPICORSQL_SERVER,
+            user=settings.EPICORSQL_USER,
+            password=settings.EPICORSQL_PW,
+            database=settings.EPICORSQL_DB
+        )
+
+    def cursor(self, conn):
+        return conn.cursor(as_dict=True)
+
+
+# EXEC sp_executesql N'<sql>', N'@Date DATE, ...', @Date = %s, ... as built by queries.NamedQuery.
+SP_EXECUTESQL = re.compile(r"^\s*EXEC sp_executesql N'(?P<sql>.*)', N'(?P<declare>[^']*)', .*$", re.DOTALL)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS EmpBasic (Company TEXT, Empid TEXT PRIMARY KEY, Name TEXT, FirstName TEXT, LastName TEXT,
+    JCDept TEXT, Shift TEXT, EmpStatus TEXT);
+CREATE TABLE IF NOT EXISTS JCShift (Company TEXT, Shift TEXT PRIMARY KEY, StartTime DECIMAL, EndTime DECIMAL,
+    LunchStart DECIMAL, LunchEnd DECIMAL);
+CREATE TABLE IF NOT EXISTS ShiftBrk (Company TEXT, Shift TEXT, BreakStart DECIMAL, BreakEnd DECIMAL);
+CREATE TABLE IF NOT EXISTS LaborHed (Company TEXT, LaborHedSeq INTEGER PRIMARY KEY, EmployeeNum TEXT,
+    ActiveTrans INTEGER);
+CREATE TABLE IF NOT EXISTS LaborDtl (Company TEXT, LaborDtlSeq INTEGER PRIMARY KEY, LaborHedSeq INTEGER,
+    EmployeeNum TEXT, JobNum TEXT, OprSeq INTEGER, ClockInDate DATE, ClockInTime DECIMAL, ClockOutTime DECIMAL,
+    LaborHrs DECIMAL, ActiveTrans INTEGER, SysRevID INTEGER);
+CREATE INDEX IF NOT EXISTS LaborDtl_ClockInDate ON LaborDtl (ClockInDate);
+CREATE INDEX IF NOT EXISTS LaborDtl_ActiveTrans ON LaborDtl (ActiveTrans);
+CREATE INDEX IF NOT EXISTS LaborDtl_JobOper ON LaborDtl (JobNum, OprSeq, ClockInDate);
+CREATE TABLE IF NOT EXISTS JobHead (Company TEXT, JobNum TEXT PRIMARY KEY, PartNum TEXT);
+CREATE TABLE IF NOT EXISTS JobOper (Company TEXT, JobNum TEXT, OprSeq INTEGER, EstProdHours DECIMAL,
+    ActProdHours DECIMAL, PRIMARY KEY (JobNum, OprSeq));
+"""
+
+# DECIMAL columns come back as Decimal, like pymssql.
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()))
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _top_level(sql, start=0):
+    """
+    Yield (index, char, depth) for sql from start, depth being the paren depth.
+    """
+    depth = 0
+    for i in range(start, len(sql)):
+        char = sql[i]
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        yield i, char, depth
+
+
+def alias_columns(sql):
+    """
+    Give the bare column references in the outer SELECT list an alias in the case they're written in
+    (empbasic.jcdept -> empbasic.jcdept AS jcdept). SQL Server names result columns as written, SQLite uses the
+    case from the table definition.
+    """
+    select = re.search(r'\bSELECT\s+(DISTINCT\s+)?', sql, re.IGNORECASE)
+    if select is None:
+        return sql
+    start = select.end()
+    end = None
+    items = []
+    item_start = start
+    for i, char, depth in _top_level(sql, start):
+        if depth == 0 and char == ',':
+            items.append((item_start, i))
+            item_start = i + 1
+        elif depth == 0 and re.match(r'\bFROM\b', sql[i:i + 5], re.IGNORECASE) and not sql[i - 1].isalnum():
+            end = i
+            break
+    if end is None:
+        return sql
+    items.append((item_start, end))
+
+    out = [sql[:start]]
+    for item_start, item_end in items:
+        item = sql[item_start:item_end]
+        column = re.fullmatch(r'\s*(?:\w+\.)?(\w+)\s*', item)
+        out.append(f'{item.rstrip()} AS {column.group(1)} ' if column else item)
+        out.append(',')
+    out[-1] = sql[end:]
+    return ''.join(out)
+
+
+class SQLiteSource(DataSource):
+    """
+    A local SQLite file standing in for Epicor, for running the app without SQL Server (a laptop, CI, load tests).
+
+    The file holds the erp tables the labor queries read (SQLITE_SCHEMA, same names and columns) and is attached as
+    the erp schema, so erp.LaborDtl etc. resolve as is. The T-SQL the app writes is translated: sp_executesql
+    batches are unwrapped into named parameters, ISNULL becomes IFNULL, and result columns keep the case they're
+    written in. Rows are dicts with Decimal for decimal columns and dates for DATE columns, like pymssql.
+
+    Fill it with python -m app.benchmarks.synthetic --sqlite <path>.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f'No SQLite data at {self.path}, create it with '
+                                    f'python -m app.benchmarks.synthetic --sqlite {self.path}')
+        conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, uri=True)
+        conn.execute('ATTACH DATABASE ? AS erp', (f'file:{self.path}?mode=ro',))
+        conn.execute('PRAGMA erp.query_only = 1')
+        conn.row_factory = _dict_row
+        return conn
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def prepare(self, query, params):
+        batch = SP_EXECUTESQL.match(query)
+        if batch is None:
+            sql = re.sub(r'%[sd]', '?', query)
+        else:
+            sql = batch.group('sql').replace("''", "'")
+            names = re.findall(r'@(\w+)\s+\w+', batch.group('declare'))
+            sql = re.sub(r'@(\w+)', r':\1', sql)
+            params = dict(zip(names, params or ()))
+        # ISNULL is an operator in SQLite (x ISNULL), IFNULL is its two argument function.
+        sql = re.sub(r'\bISNULL\s*\(', 'IFNULL(', sql, flags=re.IGNORECASE)
+        return alias_columns(sql), params
+
+    @staticmethod
+    def create(path):
+        """
+        Create (or open) a SQLite file with the erp tables, for loading data into.
+        :return: connection to the file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = WAL')  # readers don't block the loader and vice versa.
+        conn.executescript(SQLITE_SCHEMA)
+        return conn
+
+
+def get_data_source():
+    """
+    The data source settings.DATA_SOURCE selects.
+    """
+    if settings.DATA_SOURCE == 'sqlite':
+        return SQLiteSource(settings.SQLITE_PATH)
+    if settings.DATA_SOURCE != 'epicor':
+        logger.error(f'Unknown DATA_SOURCE {settings.DATA_SOURCE!r}, using Epicor.')
+    return EpicorSource()
@@ -0,0 +1,145 @@
+import io
+import csv
+import json
+import threading
+from collections.abc import Mapping
+from datetime import date, datetime, time
+from decimal import Decimal
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from app.internal import settings
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+
+def encode_batches(batches, fmt, columns=None):
+    """
+    Encode row batches as CSV or NDJSON, one chunk per batch. Only one batch is ever held at a time.
+    :param batches: iterable of row batches (lists of dicts)
+    :param fmt: 'csv' or 'ndjson'
+    :param columns: CSV columns, defaults to the keys of the first row. Ignored for NDJSON.
+    :return: generator of bytes
+    """
+    if fmt == 'ndjson':
+        for batch in batches:
+            yield ''.join(json.dumps(row, default=_json_default) + '\n' for row in batch).encode()
+        return
+
+    header = list(columns) if columns else None
+    wrote_header = False
+    for batch in batches:
+        if not batch:
+            continue
+        if header is None:
+            header = list(batch[0].keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not wrote_header:
+            writer.writerow(header)
+            wrote_header = True
+        for row in batch:
+            writer.writerow([_csv_value(row.get(column)) for column in header])
+        yield buffer.getvalue().encode()
+
+    if not wrote_header and header is not None:
+        # no rows at all, still send the header so Excel gets the columns.
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(header)
+        yield buffer.getvalue().encode()
+
+
+def batched(rows, size):
+    """
+    Split an iterable of rows into lists of size rows.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_export_slots = None
+_export_slots_lock = threading.Lock()
+
+
+def limited(batches):
+    """
+    Hold one of settings.EXPORT_MAX_CONCURRENT export slots while the batches are read, so slow clients can't tie up
+    every pooled Epicor connection (the labor run needs them too). Wrap the batches before prime, the slot is taken
+    when the first batch is pulled and given back when the stream ends or is dropped.
+    Raises a 503 when every slot is taken.
+    :param batches: iterable of row batches
+    :return: generator of the same batches
+    """
+    global _export_slots
+    with _export_slots_lock:
+        if _export_slots is None:
+            _export_slots = threading.BoundedSemaphore(settings.EXPORT_MAX_CONCURRENT)
+    if not _export_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Too many exports running, try again shortly.",
+                            headers={'Retry-After': '30'})
+    try:
+        yield from batches
+    finally:
+        _export_slots.release()
+
+
+def prime(batches):
+    """
+    Pull the first batch now, so a query that fails does it before the response has started (and can still be
+    a proper error) instead of cutting the stream off.
+    :return: iterator over the same batches. Closing it closes batches, which gives back its connection/export slot.
+    """
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        return iter(())
+    return _chain_first(first, batches)
+
+
+def _chain_first(first, batches):
+    try:
+        yield first
+        yield from batches
+    finally:
+        close = getattr(batches, 'close', None)
+        if close is not None:
+            close()
+
+
+def export_response(batches, fmt, filename, columns=None):
+    """
+    StreamingResponse for row batches. Sync iterables are run in the threadpool by Starlette, so blocking
+    fetchmany calls don't hold up the event loop.
+    :param batches: iterable of row batches
+    :param fmt: 'csv' or 'ndjson'
+    :param filename: download name, without the extension
+    :param columns: CSV columns
+    """
+    return StreamingResponse(encode_batches(batches, fmt, columns), media_type=MEDIA_TYPES[fmt],
+                             headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'})
@@ -0,0 +1,207 @@
+import sys
+import time
+import uuid
+import argparse
+import threading
+import logging
+import multiprocessing
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from app.internal import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Backfill:
+    """
+    Fills the labor history cache for a range of closed days.
+
+    The range is split by day. Each day's Epicor rows are fetched on a small thread pool
+    (settings.BACKFILL_FETCH_WORKERS, so Epicor only ever sees that many backfill queries at once), then the slot
+    computation runs in a process pool (settings.BACKFILL_PROCESSES) and the parent writes the day to the cache.
+    Only a few days are in flight at a time, so fetched rows don't pile up in memory.
+
+    Days already in the cache are skipped, so rerunning a range resumes where a stopped or failed backfill left off.
+    """
+
+    def __init__(self, start, end, fetch_workers=None, processes=None):
+        from app.internal.laborHistory import labor_today
+        self.id = uuid.uuid4().hex[:12]
+        self.start = start
+        self.end = min(end, labor_today() - timedelta(days=1))  # only closed days are cached.
+        self.fetch_workers = fetch_workers or settings.BACKFILL_FETCH_WORKERS
+        self.processes = processes or settings.BACKFILL_PROCESSES
+        self.state = 'queued'
+        self.total = 0
+        self.skipped = 0
+        self.done = 0
+        self.failed = {}  # date -> error
+        self.fetching = set()
+        self.computing = set()
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        from app.internal import laborMagic
+        from app.internal.laborHistory import labor_history, fetch_day
+
+        self.state = 'running'
+        self.started = time.time()
+        if self.end < self.start:
+            # nothing closed in the range yet.
+            self.state = 'done'
+            self.finished = time.time()
+            return self
+
+        dates = []
+        date = self.start
+        while date <= self.end:
+            dates.append(date)
+            date += timedelta(days=1)
+        cached = set(labor_history.cached_dates())
+        todo = [date for date in dates if date not in cached]
+        self.total = len(dates)
+        self.skipped = len(dates) - len(todo)
+        logger.info(f'Backfill {self.id}: {len(todo)} days to compute, {self.skipped} already cached.')
+
+        try:
+            if todo and not labor_history.cacheable:
+                raise RuntimeError('pyarrow is not installed, there is nowhere to backfill to.')
+            if todo:
+                shiftdata = laborMagic.GetShiftData()
+                self._run(todo, shiftdata, labor_history, fetch_day)
+            self.state = 'done' if not self.failed else 'done_with_errors'
+        except Exception as e:
+            logger.exception(f'Backfill {self.id} failed.')
+            self.state = 'error'
+            self.failed['backfill'] = str(e)
+        finally:
+            self.finished = time.time()
+        return self
+
+    def _run(self, todo, shiftdata, labor_history, fetch_day):
+        from app.internal.laborHistory import compute_day
+
+        pending = list(reversed(todo))  # pop() from the front of the range
+        max_inflight = self.fetch_workers + self.processes
+        futures = {}  # future -> (stage, date)
+        context = multiprocessing.get_context(settings.BACKFILL_START_METHOD)
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='backfill-fetch') as fetcher, \
+                ProcessPoolExecutor(max_workers=self.processes, mp_context=context) as computer:
+            while pending or futures:
+                while pending and len(futures) < max_inflight:
+                    date = pending.pop()
+                    self.fetching.add(date)
+                    futures[fetcher.submit(fetch_day, date)] = ('fetch', date)
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, date = futures.pop(future)
+                    if stage == 'fetch':
+                        self.fetching.discard(date)
+                    else:
+                        self.computing.discard(date)
+
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f'Backfill {self.id}: {date} failed to {stage}: {e}')
+                        self.failed[date.strftime('%Y-%m-%d')] = f'{stage}: {e}'
+                        continue
+
+                    if stage == 'fetch':
+                        self.computing.add(date)
+                        futures[computer.submit(compute_day, date.strftime('%Y-%m-%d'), result, shiftdata)] = ('compute', date)
+                    else:
+                        labor_history.write(date, result)
+                        self.done += 1
+
+    def describe(self):
+        elapsed = (self.finished or time.time()) - self.started if self.started else None
+        remaining = self.total - self.skipped - self.done - len(self.failed)
+        rate = self.done / elapsed if elapsed and self.done else None
+        return {
+            'backfill_id': self.id,
+            'state': self.state,
+            'start': self.start.strftime('%Y-%m-%d'),
+            'end': self.end.strftime('%Y-%m-%d'),
+            'total': self.total,
+            'skipped': self.skipped,
+            'done': self.done,
+            'failed': dict(self.failed),
+            'fetching': sorted(date.strftime('%Y-%m-%d') for date in list(self.fetching)),
+            'computing': sorted(date.strftime('%Y-%m-%d') for date in list(self.computing)),
+            'elapsed': elapsed,
+            'eta': remaining / rate if rate and self.state == 'running' else None,
+        }
+
+
+class BackfillManager:
+    """
+    Runs one backfill at a time in the background for the API. Asking for another while one is running returns
+    the running one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+        self._backfills = {}
+
+    def start(self, start, end):
+        """
+        :return: (backfill, started). started is False if a backfill was already running.
+        """
+        with self._lock:
+            if self._current is not None and self._current.state in ('queued', 'running'):
+                return self._current, False
+            backfill = self._current = Backfill(start, end)
+            self._backfills[backfill.id] = backfill
+
+        threading.Thread(target=backfill.run, name=f'backfill-{backfill.id}', daemon=True).start()
+        return backfill, True
+
+    def status(self, backfill_id=None):
+        """
+        :param backfill_id: backfill to look up, None for the latest
+        :return: status dict, or None
+        """
+        backfill = self._current if backfill_id is None else self._backfills.get(backfill_id)
+        return backfill.describe() if backfill is not None else None
+
+
+backfills = BackfillManager()
+
+
+def main(argv=None):
+    """
+    python -m app.internal.laborBackfill 2024-05-01 2024-05-31 [--fetch-workers 2] [--processes 4]
+    """
+    from app.internal.laborHistory import parse_date
+
+    parser = argparse.ArgumentParser(description='Fill the labor history cache for a range of closed days.')
+    parser.add_argument('start', type=parse_date, help='first day, YYYY-MM-DD')
+    parser.add_argument('end', type=parse_date, help='last day, YYYY-MM-DD')
+    parser.add_argument('--fetch-workers', type=int, default=None, help='concurrent Epicor fetches')
+    parser.add_argument('--processes', type=int, default=None, help='processes computing days')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    backfill = Backfill(args.start, args.end, fetch_workers=args.fetch_workers, processes=args.processes)
+
+    thread = threading.Thread(target=backfill.run, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(timeout=5)
+        status = backfill.describe()
+        print(f"{status['state']}: {status['done'] + status['skipped']}/{status['total']} days "
+              f"({status['skipped']} cached, {len(status['failed'])} failed)", flush=True)
+
+    status = backfill.describe()
+    for date, error in status['failed'].items():
+        print(f'  {date}: {error}')
+    return 0 if status['state'] == 'done' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+from datetime import time
+from app.internal import settings
+from app.internal.shiftCalendar import shift_calendar
+from app.internal.metrics import pipeline_metrics
+from app.internal.memoryBudget import memory_budget
+
+
+def dectime_to_secs(tm):
+    """
+    Convert a decimal time to whole seconds past midnight.
+    Same truncation as laborMagic.frmt, so the slot grid lines up with the legacy engine.
+    :param tm: decimal time (Decimal or float)
+    :return: seconds past midnight
+    """
+    return int(dectimes_to_secs(np.array([float(tm)]))[0])
+
+
+def dectimes_to_secs(values):
+    """
+    dectime_to_secs for a whole column at once.
+    The nudge keeps a time like 8.25 that's a hair under in floating point (29699.9999 seconds) on its second,
+    Epicor's decimal times are nowhere near that fine.
+    :param values: decimal times, array or Series
+    :return: int64 array of seconds past midnight
+    """
+    return np.floor(np.asarray(values, dtype=np.float64) * 3600 + 1e-6).astype(np.int64)
+
+
+# LaborDtl columns the engines use, and how compact_labor stores them.
+CATEGORY_COLUMNS = ('JobNum', 'EmployeeNum', 'ClockInDate')
+INTEGER_COLUMNS = ('OprSeq', 'ActiveTrans', 'LaborDtlSeq', 'SysRevID')
+TIME_COLUMNS = ('ClockInTime', 'ClockOutTime')
+
+# job side of a (JobNum, Emp) pair. ('JobNum', 'OprSeq') splits a job's hours by operation, see laborHistory.
+JOB_KEYS = ('JobNum',)
+
+
+def compact_labor(rows):
+    """
+    Store LaborDtl rows compactly: JobNum and emp codes as categoricals (a small int per row instead of a string
+    object), the integer columns downcast to the smallest int that fits, and the decimal times as float64 instead of
+    Decimal objects. Safe to call again on rows that are already compact, e.g. after a concat (which falls back to
+    object when the categories differ).
+    :param rows: DataFrame of LaborDtl rows
+    :return: the same frame, converted in place
+    """
+    for column in CATEGORY_COLUMNS:
+        if column in rows and not isinstance(rows[column].dtype, pd.CategoricalDtype):
+            rows[column] = rows[column].astype('category')
+    for column in INTEGER_COLUMNS:
+        if column in rows and rows[column].notna().all():
+            rows[column] = pd.to_numeric(rows[column], downcast='integer')
+    for column in TIME_COLUMNS:
+        if column in rows:
+            # float64, float32 is only good to a few seconds this late in the day.
+            rows[column] = rows[column].astype(np.float64)
+    return rows
+
+
+def build_slot_grid(min_secs, max_secs, slot_seconds=None):
+    """
+    Build the slot grid for the day, same as pd.date_range(minTime, maxTime, freq='5min') for 5 minute slots.
+    :param min_secs: start of the grid, seconds past midnight
+    :param max_secs: end of the grid (inclusive), seconds past midnight
+    :param slot_seconds: slot size in seconds, defaults to settings.LABOR_SLOT_SECONDS
+    :return: numpy array of slot start times, seconds past midnight
+    """
+    slot_seconds = slot_seconds or settings.LABOR_SLOT_SECONDS
+    return np.arange(min_secs, max_secs + 1, slot_seconds, dtype=np.int64)
+
+
+def slot_times(grid):
+    """
+    Slot grid as datetime.time objects. These are the column labels the legacy engine uses.
+    """
+    return [time(int(s) // 3600, int(s) % 3600 // 60, int(s) % 60) for s in grid]
+
+
+def close_active_labor(deptdata, nowdectime):
+    """
+    Active labor transactions have a ClockOutTime of 24 (or 0 for groupwork), set those to now. In place.
+    :param deptdata: labor data
+    :param nowdectime: current time, decimal hours
+    """
+    deptdata.loc[deptdata['ClockOutTime'] == 24, 'ClockOutTime'] = nowdectime
+    deptdata.loc[deptdata['ClockOutTime'] == 0, 'ClockOutTime'] = nowdectime
+
+
+def active_pairs(df, keys=JOB_KEYS):
+    """
+    Get the (JobNum, EmployeeNum) pairs that have an active labor transaction.
+    :param df: dataframe of labor data
+    :param keys: job columns of a pair, see JOB_KEYS
+    :return: MultiIndex of active (JobNum, EmployeeNum) pairs
+    """
+    active = df.loc[df['ActiveTrans'] == 1, [*keys, 'EmployeeNum']].drop_duplicates()
+    return pd.MultiIndex.from_frame(active)
+
+
+def slot_shares(deptdata, grid, shiftdata, slot_seconds=None, keys=JOB_KEYS):
+    """
+    Each (JobNum, Emp) pair's share of every slot, already divided by the number of jobs the emp was on during
+    that slot.
+
+    Only (JobNum, Emp) pairs that show up in the labor data get a row. Like the legacy engine, when an emp has more
+    than one LaborDtl record on a job, the last record (in JobNum, EmployeeNum order) decides the occupancy for that
+    pair.
+
+    Sized for a small container: slot indices are int16, occupancy is bool, job counts uint8 and the shares
+    float32, and the budget (memoryBudget) is checked before the pairs x slots arrays are allocated.
+
+    :param deptdata: labor data sorted by JobNum, EmployeeNum, with active ClockOutTimes already set to now
+    :param grid: slot grid, see build_slot_grid
+    :param shiftdata: dataframe of shiftdata, used to zero out breaks and lunch
+    :param slot_seconds: slot size the grid was built with, defaults to settings.LABOR_SLOT_SECONDS
+    :param keys: job columns of a pair, see JOB_KEYS
+    :return: (pairs, share). pairs is the labor record of each pair, share a float32 pairs x slots array.
+    """
+    pairs = deptdata.drop_duplicates(subset=[*keys, 'EmployeeNum'], keep='last')
+    n, slots = len(pairs), len(grid)
+    # bool occupancy, the float32 shares and a few temporaries of the same shape.
+    memory_budget.check('labordtl.slot_matrix', planned=n * slots * 8)
+
+    start = dectimes_to_secs(pairs['ClockInTime'])
+    end = dectimes_to_secs(pairs['ClockOutTime'])
+
+    # first and last slot each record covers. Slots are inclusive on both ends.
+    step = slot_seconds or settings.LABOR_SLOT_SECONDS
+    index_type = np.int16 if slots < np.iinfo(np.int16).max else np.int32
+    lowest, highest = np.iinfo(index_type).min, np.iinfo(index_type).max
+    first_bin = np.clip(-((grid[0] - start) // step), lowest, highest).astype(index_type)
+    last_bin = np.clip((end - grid[0]) // step, lowest, highest).astype(index_type)
+    bins = np.arange(slots, dtype=index_type)
+    occupied = (bins[None, :] >= first_bin[:, None]) & (bins[None, :] <= last_bin[:, None])
+
+    # break exclusion is one AND against each emp's shift mask. Factorized as plain values, codes of a categorical
+    # would follow its categories rather than the order the emps show up in.
+    emp_codes, emps = pd.factorize(np.asarray(pairs['EmployeeNum']))
+    with pipeline_metrics.span('labordtl.breaks', rows=len(emps)):
+        occupied &= shift_calendar.working_mask(shiftdata, emps, grid)[emp_codes]
+
+    # number of jobs each emp is on, per slot. An emp is never on 255 jobs at once, but it's cheap to make sure.
+    count_type = np.uint8 if n == 0 or np.bincount(emp_codes).max() <= np.iinfo(np.uint8).max else np.uint16
+    job_counts = np.zeros((len(emps), slots), dtype=count_type)
+    np.add.at(job_counts, emp_codes, occupied)
+
+    share = np.zeros(occupied.shape, dtype=np.float32)
+    np.divide(occupied, job_counts[emp_codes], out=share, where=occupied)
+    return pairs, share
+
+
+def build_slot_matrix(deptdata, grid, shiftdata, slot_seconds=None, keys=JOB_KEYS):
+    """
+    Build the job x employee labor matrix in one pass, see slot_shares.
+    :return: DataFrame indexed by (JobNum, Emp), one column per slot
+    """
+    pairs, share = slot_shares(deptdata, grid, shiftdata, slot_seconds, keys)
+    return pd.DataFrame(share, index=_pair_index(pairs, keys), columns=slot_times(grid))
+
+
+def _pair_index(pairs, keys=JOB_KEYS):
+    return pd.MultiIndex.from_arrays([np.asarray(pairs[key]) for key in (*keys, 'EmployeeNum')],
+                                     names=[*keys, 'Emp'])
+
+
+def exact_pair_hours(deptdata, shiftdata, keys=JOB_KEYS):
+    """
+    Hours per (JobNum, Emp), split exactly instead of sampled on a slot grid.
+
+    Sweeps each emp's clock in/out and break/lunch events in time order. Between two events the emp is on k jobs
+    and either working or on a break, so every open job gets 1/k of that stretch (nothing on a break). The running
+    total of those shares is a step function per emp, a record's hours are its value at clock out minus its value
+    at clock in. One sort over every emp's events, so O(n log n).
+
+    Same records count as in build_slot_matrix: the last record per (JobNum, Emp) pair.
+
+    :param deptdata: labor data sorted by JobNum, EmployeeNum, with active ClockOutTimes already set to now
+    :param shiftdata: dataframe of shiftdata, for breaks and lunch
+    :param keys: job columns of a pair, see JOB_KEYS
+    :return: Series of hours indexed by (JobNum, Emp)
+    """
+    pairs = deptdata.drop_duplicates(subset=[*keys, 'EmployeeNum'], keep='last')
+    n = len(pairs)
+    index = _pair_index(pairs, keys)
+    if n == 0:
+        return pd.Series(dtype=float, index=index)
+
+    emp_codes, emps = pd.factorize(np.asarray(pairs['EmployeeNum']))
+    start = pairs['ClockInTime'].to_numpy(dtype=np.float64) * 3600
+    end = np.maximum(pairs['ClockOutTime'].to_numpy(dtype=np.float64) * 3600, start)
+
+    with pipeline_metrics.span('labordtl.breaks', rows=len(emps)):
+        break_emps, break_starts, break_ends = shift_calendar.break_windows(shiftdata, emps)
+    break_starts = break_starts * 3600
+    break_ends = np.maximum(break_ends * 3600, break_starts)
+    b = len(break_emps)
+
+    # events: emp, time, change in open jobs, change in open breaks.
+    ev_emp = np.concatenate([emp_codes, emp_codes, break_emps, break_emps])
+    ev_time = np.concatenate([start, end, break_starts, break_ends])
+    ev_jobs = np.concatenate([np.ones(n), -np.ones(n), np.zeros(2 * b)])
+    ev_breaks = np.concatenate([np.zeros(2 * n), np.ones(b), -np.ones(b)])
+
+    order = np.lexsort((ev_time, ev_emp))
+    ev_emp, ev_time = ev_emp[order], ev_time[order]
+    # every emp's events net out to zero, so running sums over all of them are per emp.
+    open_jobs = np.cumsum(ev_jobs[order])
+    open_breaks = np.cumsum(ev_breaks[order])
+
+    # stretch from each event to the next one (of the same emp), and each open job's share of it.
+    length = np.zeros(len(ev_time))
+    length[:-1] = np.where(ev_emp[1:] == ev_emp[:-1], ev_time[1:] - ev_time[:-1], 0.0)
+    working = (open_jobs > 0.5) & (open_breaks < 0.5)
+    rate = np.divide(1.0, open_jobs, out=np.zeros(len(ev_time)), where=working)
+    share = np.concatenate([[0.0], np.cumsum(length * rate)[:-1]])  # running total as of each event
+
+    # where each record's clock in and clock out landed after sorting.
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    hours = (share[position[n:2 * n]] - share[position[:n]]) / 3600
+    return pd.Series(hours, index=index)
+
+
+def pair_hours(deptdata, shiftdata, engine=None, grid_start=None, keys=JOB_KEYS):
+    """
+    Hours per (JobNum, Emp) with the slot engine or the exact engine.
+    :param deptdata: labor data sorted by JobNum, EmployeeNum, with active ClockOutTimes already set to now
+    :param shiftdata: dataframe of shiftdata, for breaks and lunch
+    :param engine: 'vectorized' (slots of settings.LABOR_SLOT_SECONDS) or 'exact'. Defaults to settings.LABOR_ENGINE
+    :param grid_start: start of the slot grid, seconds past midnight. Defaults to the first clock in.
+    :param keys: job columns of a pair, see JOB_KEYS. ('JobNum', 'OprSeq') indexes by (JobNum, OprSeq, Emp).
+    :return: Series of hours indexed by (JobNum, Emp)
+    """
+    engine = engine or settings.LABOR_ENGINE
+    if engine == 'exact':
+        return exact_pair_hours(deptdata, shiftdata, keys)
+
+    slot_seconds = settings.LABOR_SLOT_SECONDS
+    if grid_start is None:
+        grid_start = dectime_to_secs(deptdata['ClockInTime'].min())
+    grid = build_slot_grid(grid_start, dectime_to_secs(deptdata['ClockOutTime'].max()), slot_seconds)
+    # summed straight off the shares, in float64, without building the labelled matrix.
+    pairs, share = slot_shares(deptdata, grid, shiftdata, slot_seconds, keys)
+    return pd.Series(share.sum(axis=1, dtype=np.float64) * slot_seconds / 3600, index=_pair_index(pairs, keys))
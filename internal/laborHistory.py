@@ -0,0 +1,241 @@
+import os
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pandas as pd
+from pytz import timezone
+from app.internal import settings, laborMagic
+from app.internal.queries import queries
+
+try:
+    import fcntl
+except ImportError:  # Windows, no flock. Only one worker runs there anyway.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def parse_date(value):
+    """
+    :param value: 'YYYY-MM-DD'
+    :return: datetime.date, ValueError if it isn't a date
+    """
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def labor_today():
+    return datetime.now(timezone('US/Pacific')).date()
+
+
+class LaborHistory:
+    """
+    Job labor totals and efficiency for past days.
+
+    A day is computed the same way as live labor (same slot engine, breaks, and efficiency math), except nothing is
+    pruned to active labor: the day's hours are all the labor clocked on the job that day. PrevHrs is the labor
+    booked on the job/operation before that day, so Efficiency is where the job stood at the end of the day.
+
+    Closed days (before today) don't change, so once computed they're kept in a Parquet file per day under
+    settings.HISTORY_PATH and read back from there. Today is always computed fresh and never cached.
+    """
+
+    COLUMNS = ['Date', 'OprSeq', 'JobNum', 'PartNum', 'Standard', 'PrevHrs', 'DayLabor', 'Efficiency', 'Emps']
+
+    def __init__(self, path):
+        self.path = path
+        self._locks = {}  # date -> lock, so a day is only computed once at a time, see _day_lock
+        self._locks_lock = threading.Lock()
+        self._parquet = None
+
+    def day(self, date):
+        """
+        Labor for one day.
+        :param date: datetime.date
+        :return: (records, cached). cached is True when the day was read from the columnar cache.
+        """
+        closed = date < labor_today()
+        if not closed:
+            return self.compute(date), False
+
+        with self._day_lock(date):
+            records = self.read(date)
+            if records is not None:
+                return records, True
+
+            records = self.compute(date)
+            self.write(date, records)
+            return records, False
+
+    def days(self, start, end):
+        """
+        Labor for every day in a range, inclusive.
+        :return: list of (date, records, cached)
+        """
+        out = []
+        date = start
+        while date <= end:
+            records, cached = self.day(date)
+            out.append((date, records, cached))
+            date += timedelta(days=1)
+        return out
+
+    def compute(self, date):
+        """
+        Compute a day from Epicor.
+        :param date: datetime.date
+        :return: list of records, see COLUMNS
+        """
+        return compute_day(date.strftime('%Y-%m-%d'), fetch_day(date), laborMagic.GetShiftData())
+
+    def read(self, date):
+        """
+        :return: the cached records for a day, or None if it isn't cached.
+        """
+        filepath = self._file(date)
+        if not os.path.exists(filepath) or not self.cacheable:
+            return None
+        try:
+            df = pd.read_parquet(filepath)
+        except Exception as e:
+            logger.error(f'Error reading labor history for {date}: {e}')
+            return None
+        return df.to_dict(orient='records')
+
+    def write(self, date, records):
+        """
+        Cache a closed day. Temp file + rename, so a reader never sees a partial file. The temp file's name is unique,
+        so two writers (workers, a backfill) never write over each other's.
+        """
+        if not self.cacheable:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        filepath = self._file(date)
+        fd, tmppath = tempfile.mkstemp(dir=self.path, prefix='.' + os.path.basename(filepath) + '.', suffix='.tmp')
+        os.close(fd)
+        try:
+            pd.DataFrame(records, columns=self.COLUMNS).to_parquet(tmppath, index=False)
+            os.replace(tmppath, filepath)
+        except Exception as e:
+            logger.error(f'Error caching labor history for {date}: {e}')
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+
+    def cached_dates(self):
+        """
+        :return: sorted list of the days in the cache
+        """
+        if not os.path.isdir(self.path):
+            return []
+        dates = []
+        for filename in os.listdir(self.path):
+            if filename.startswith('labor_') and filename.endswith('.parquet'):
+                try:
+                    dates.append(parse_date(filename[len('labor_'):-len('.parquet')]))
+                except ValueError:
+                    pass
+        return sorted(dates)
+
+    def _file(self, date):
+        return os.path.join(self.path, f'labor_{date.strftime("%Y-%m-%d")}.parquet')
+
+    @contextmanager
+    def _day_lock(self, date):
+        """
+        So a closed day is only computed once at a time: a thread lock in this process and, in multi-worker mode
+        (settings.WORKERS > 1), an flock on a lock file per day for the other workers. A worker that waits on it reads
+        the day the other one cached.
+        """
+        with self._locks_lock:
+            lock = self._locks.setdefault(date, threading.Lock())
+        with lock:
+            if fcntl is None or settings.WORKERS <= 1 or not self.cacheable:
+                yield
+                return
+            os.makedirs(self.path, exist_ok=True)
+            fd = os.open(os.path.join(self.path, f'.labor_{date.strftime("%Y-%m-%d")}.lock'), os.O_RDWR | os.O_CREAT,
+                         0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)  # drops the flock
+
+    @property
+    def cacheable(self):
+        """
+        True if closed days can be cached (pyarrow is installed).
+        """
+        if self._parquet is None:
+            try:
+                import pyarrow  # noqa: F401
+                self._parquet = True
+            except ImportError:
+                logger.warning('pyarrow is not installed, labor history will not be cached.')
+                self._parquet = False
+        return self._parquet
+
+
+def fetch_day(date):
+    """
+    Everything a day's computation needs from Epicor, as plain rows (so it can be sent to another process).
+    :param date: datetime.date
+    :return: dict of labordtl, jobs, emps rows
+    """
+    datestr = date.strftime('%Y-%m-%d')
+    return {
+        'labordtl': laborMagic._fetch_labordtl(datestr),
+        'jobs': queries.run('LaborHistoryJobs', datestr),
+        'emps': queries.run('LaborHistoryEmps', datestr),
+    }
+
+
+def compute_day(datestr, rows, shiftdata):
+    """
+    Compute a day's records from its fetched rows, no DB access.
+    :param datestr: labor date, 'YYYY-MM-DD'
+    :param rows: see fetch_day
+    :param shiftdata: shift data, dataframe or rows
+    :return: list of records, see LaborHistory.COLUMNS
+    """
+    shiftdata = pd.DataFrame(shiftdata)
+    # per operation, the jobs rows are one per (JobNum, OprSeq) worked that day.
+    totals = laborMagic.GetLaborDtlData(date=datestr, incremental=False, shiftdata=shiftdata, active_only=False,
+                                        prefetched=(None, rows['labordtl']), by_oprseq=True)
+    if not isinstance(totals, pd.DataFrame):
+        # no labor that day.
+        return []
+
+    jobs = pd.DataFrame(rows['jobs'])
+    emps = pd.DataFrame(rows['emps'])
+    if jobs.empty:
+        return []
+
+    jobs = jobs.rename(columns={'PrevHrs': 'ActProdHours'})
+    records = laborMagic.assembleActiveLabor(jobs, totals, emps, shiftdata)
+    for record in records:
+        record['Date'] = datestr
+        record['DayLabor'] = record.pop('ActiveLabor')
+    return records
+
+
+def job_totals(records):
+    """
+    Roll day records up to one row per job/operation for a range report.
+    :param records: day records, see LaborHistory.COLUMNS
+    :return: list of dicts (OprSeq, JobNum, PartNum, Standard, DayLabor, Days, Efficiency as of the last day)
+    """
+    if not records:
+        return []
+    df = pd.DataFrame(records).sort_values(by='Date')
+    grouped = df.groupby(['OprSeq', 'JobNum'], sort=False)
+    totals = grouped.agg(PartNum=('PartNum', 'last'), Standard=('Standard', 'last'), DayLabor=('DayLabor', 'sum'),
+                         Days=('Date', 'nunique'), Efficiency=('Efficiency', 'last')).reset_index()
+    totals['DayLabor'] = totals['DayLabor'].round(2)
+    return totals.sort_values(by=['PartNum', 'JobNum']).to_dict(orient='records')
+
+
+labor_history = LaborHistory(settings.HISTORY_PATH)
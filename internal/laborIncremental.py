@@ -0,0 +1,137 @@
+import threading
+import time
+import logging
+import pandas as pd
+from app.internal import laborEngine, settings
+from app.internal.shiftCalendar import ShiftCalendar
+
+logger = logging.getLogger(__name__)
+
+
+class LaborAccumulator:
+    """
+    Keeps today's LaborDtl rows (compacted, see laborEngine.compact_labor) and the per (JobNum, Emp) labor hours
+    between labor runs.
+
+    Each run only fetches LaborDtl rows that changed since the SysRevID watermark, plus anything still active,
+    and recomputes the emps those rows belong to. An emp's share of their time only depends on their own labor, so
+    everyone else's totals carry over as is.
+
+    A full recompute runs on the first run of the day, when the shift data changes, when a new record moves
+    the start of the slot grid, every settings.LABOR_FULL_RECOMPUTE_INTERVAL, and on demand. That also picks
+    up anything the watermark can't see, like deleted LaborDtl rows.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.engine = None
+        self.reset()
+
+    def reset(self):
+        self.date = None
+        self.watermark = None
+        self.grid_start = None
+        self.shift_fingerprint = None
+        self.last_full = 0.0
+        self.rows = None
+        self.pair_totals = None
+
+    def update(self, date, fetch, shiftdata, nowdectime, full=False, engine=None):
+        """
+        Bring the accumulators up to date and return the job totals.
+        :param date: labor date, 'YYYY-MM-DD'
+        :param fetch: callable(watermark) returning the LaborDtl rows for the date. watermark None = all rows.
+        :param shiftdata: dataframe of shiftdata, for breaks and lunch
+        :param nowdectime: current time, decimal hours. Active labor runs until now.
+        :param full: force a full recompute
+        :param engine: 'vectorized' or 'exact', see laborEngine.pair_hours. Defaults to settings.LABOR_ENGINE
+        :return: job totals (JobNum, Total hours), or None if there's no labor for the day
+        """
+        engine = engine or settings.LABOR_ENGINE
+        with self._lock:
+            if engine != self.engine:
+                # totals from another engine don't mix.
+                full = True
+                self.engine = engine
+            if full or self._needs_full(date, shiftdata):
+                self._full(date, fetch, shiftdata, nowdectime)
+            else:
+                self._incremental(date, fetch, shiftdata, nowdectime)
+
+            if self.rows is None:
+                return None
+
+            totals = self.pair_totals[self.pair_totals.index.isin(laborEngine.active_pairs(self.rows))]
+            dftotals = totals.groupby(level='JobNum').sum().reset_index()
+            dftotals.columns = ['JobNum', 'Total']
+            return dftotals
+
+    def next_watermark(self, date, full=False):
+        """
+        The watermark the next update will fetch from, so the LaborDtl query can run ahead of it.
+        None means the next update fetches the whole day. A shift data change can still force a full refetch.
+        """
+        if full or self.rows is None or date != self.date:
+            return None
+        if time.time() - self.last_full >= settings.LABOR_FULL_RECOMPUTE_INTERVAL:
+            return None
+        return self.watermark
+
+    def _needs_full(self, date, shiftdata):
+        if self.next_watermark(date) is None:
+            return True
+        return ShiftCalendar.fingerprint(shiftdata) != self.shift_fingerprint
+
+    def _full(self, date, fetch, shiftdata, nowdectime):
+        rows = pd.DataFrame(fetch(None))
+        self.reset()
+        if rows.empty:
+            return
+
+        self.rows = _by_seq(laborEngine.compact_labor(rows))
+        self.date = date
+        self.grid_start = laborEngine.dectime_to_secs(rows['ClockInTime'].min())
+        self.shift_fingerprint = ShiftCalendar.fingerprint(shiftdata)
+        self.last_full = time.time()
+        self.watermark = rows['SysRevID'].max()
+        self.pair_totals = self._pair_hours(self.rows, shiftdata, nowdectime)
+        logger.debug(f'Labor accumulator: full recompute for {date}, {len(rows)} rows.')
+
+    def _incremental(self, date, fetch, shiftdata, nowdectime):
+        delta = pd.DataFrame(fetch(self.watermark))
+        if delta.empty:
+            return
+
+        if laborEngine.dectime_to_secs(delta['ClockInTime'].min()) < self.grid_start:
+            # an earlier clock in moves the slot grid for everyone, start over.
+            self._full(date, fetch, shiftdata, nowdectime)
+            return
+
+        delta = _by_seq(delta)
+        # the categories rarely match, so the concat comes back as objects. Compact it again.
+        self.rows = laborEngine.compact_labor(pd.concat([self.rows.drop(delta.index, errors='ignore'), delta]))
+        self.watermark = max(self.watermark, delta['SysRevID'].max())
+
+        touched = delta['EmployeeNum'].unique()
+        totals = self._pair_hours(self.rows[self.rows['EmployeeNum'].isin(touched)], shiftdata, nowdectime)
+        keep = ~self.pair_totals.index.get_level_values('Emp').isin(touched)
+        self.pair_totals = pd.concat([self.pair_totals[keep], totals])
+        logger.debug(f'Labor accumulator: {len(delta)} changed rows, {len(touched)} emps recomputed.')
+
+    def _pair_hours(self, rows, shiftdata, nowdectime):
+        """
+        Hours per (JobNum, Emp) for a set of rows, on the day's slot grid (or exact).
+        Rows are ordered by LaborDtlSeq within a job/emp, so the newest record is the one that counts.
+        """
+        deptdata = rows.sort_values(by=['JobNum', 'EmployeeNum', 'LaborDtlSeq'])
+        laborEngine.close_active_labor(deptdata, nowdectime)
+        return laborEngine.pair_hours(deptdata, shiftdata, self.engine, grid_start=self.grid_start)
+
+
+def _by_seq(rows):
+    # index on LaborDtlSeq, but keep the column (and leave the index unnamed so sorting on the column isn't ambiguous)
+    rows.index = pd.Index(rows['LaborDtlSeq'].to_numpy())
+    return rows
+
+
+labor_accumulator = LaborAccumulator()
@@ -7,7 +7,13 @@ import pickle
 import json
 import time as t
 from app.internal.utils import InsightUtils
-from app.internal import settings
+from app.internal import settings, laborEngine
+from app.internal.laborIncremental import labor_accumulator
+from app.internal.snapshot import labor_snapshots, atomic_pickle, emps_not_clocked_file, get_emps_not_clocked, \
+    ActiveLaborRecord
+from app.internal.shiftCalendar import shift_calendar
+from app.internal.metrics import pipeline_metrics
+from app.internal.queries import queries
 import time
 import logging
 from app.internal.stats import StatsManager
@@ -16,36 +22,31 @@ import app.internal.settings as settings
 stats_manager = StatsManager(os.path.join(settings.STATS_PATH, settings.STATS_FILENAME))
 logger = logging.getLogger(__name__)
 
-labor_data_file = os.path.join(settings.DATA_PATH, 'labordata.pkl')
-emps_not_clocked_file = os.path.join(settings.DATA_PATH, 'empsnotclocked.pkl')
+labor_data_file = labor_snapshots.path
 
 
 @stats_manager.track_stats("Process_Live_Labor")
-def process_live_labor():
+def process_live_labor(full=False):
     # for testing purposes, we're going to just pickle the json data to a file and retrieve it.
+    # full: recompute the whole day instead of just what changed since the last run.
     starttime = time.time()
 
     # get the data
-    data = labormagic()
-
-    # pickle the data
-    # TODO: Add a check to see if the data is the same as the last data, if it is, don't pickle it.
-    # TODO: Add a check to make sure we dont cross paths with another instance here.
-
+    with pipeline_metrics.run('process_live_labor'):
+        data = labormagic(full=full)
 
     resulttime = time.time() - starttime
 
     #data_datetime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     # DATEFIX: Convert to US/Pacific timezone
-    data_datetime = datetime.now().astimezone(timezone('US/Pacific')).strftime('%Y-%m-%d %H:%M:%S')
+    data_datetime = pacific_now().strftime('%Y-%m-%d %H:%M:%S')
 
     if data is None:
         # create a dummy with timestamp and executiontime
         data = dict()
         data['timestamp'] = data_datetime
         data['executiontime'] = resulttime
-        with open(labor_data_file, 'wb') as f:
-            pickle.dump(data, f)
+        labor_snapshots.publish(data)
 
         return "No Data Found."
 
@@ -53,90 +54,120 @@ def process_live_labor():
     data['timestamp'] = data_datetime
     data['executiontime'] = resulttime
 
-    with open(labor_data_file, 'wb') as f:
-        pickle.dump(data, f)
+    # readers pick up the new snapshot right away. It's persisted for restarts, unless no OprSeq changed.
+    labor_snapshots.publish(data)
 
     return "Data Processed."
 
 
 
 def retrieve_pickles():
-    # check if there's pickled data first.
-    try:
-        with open(labor_data_file, 'rb') as f:
-            data = pickle.load(f)
-        return data
-    except:
+    # the current labor data. Served from memory, see snapshot.SnapshotStore.
+    snapshot = labor_snapshots.current()
+    if snapshot is None:
         return None
+    return snapshot.data
 
 
 
+def warm_caches():
+    """
+    Prime the long lived caches the labor run leans on, so the first run after a restart doesn't pay for them.
+    """
+    shiftdata = GetShiftData()
+    shift_calendar.load(shiftdata)
+
+
 def GetShiftData():
     """
     Get all active employee shift data.
     :return: pandas shift data
     """
 
-    query = """
-        SELECT
-            EmpBasic.Empid,
-            EmpBasic.Name,
-            EmpBasic.FirstName,
-            EmpBasic.LastName,
-            EmpBasic.JCDept,
-            JCShift.Shift,
-            JCShift.StartTime,
-            JCShift.EndTime,
-            JCShift.LunchStart,
-            JCShift.LunchEnd,
-            ShiftBrk.BreakStart,
-            ShiftBrk.BreakEnd
-        FROM Erp.Empbasic
-            INNER JOIN Erp.JCShift ON Empbasic.Shift = JCShift.Shift
-            LEFT OUTER JOIN Erp.Shiftbrk ON JCShift.Shift = ShiftBrk.Shift
-        WHERE EmpBasic.EmpStatus = 'A'
-    """
-    shiftdata = InsightUtils.QueryWrapper(query, longCache=True)
+    shiftdata = queries.run('ShiftData')
     shiftdata = pd.DataFrame(shiftdata)
     return shiftdata
 
 
 
 
-def GetLaborDtlData(date=None, oprseq=None, empdata=False):
+def GetLaborDtlData(date=None, oprseq=None, empdata=False, engine=None, incremental=None, full=False,
+                    shiftdata=None, prefetched=None, active_only=True, by_oprseq=False):
     """
     Get labor data for a given date and oprseq.
     :param date: labor date, default to None/Today
     :param oprseq: operation seq.
     :param empdata: if true, return the shift data as well. else just labor data. I know this is weird.
-    :return: if empdata=False: labor totals; if empdata=True: [labor totals, shift data]
+    :param engine: labor engine, 'vectorized', 'exact' or 'legacy'. Defaults to settings.LABOR_ENGINE
+    :param incremental: only refetch today's labor that changed since the last run. Defaults to settings.LABOR_INCREMENTAL
+    :param full: force a full recompute of today's labor when running incrementally.
+    :param shiftdata: shift data if it's already been fetched, see GetShiftData
+    :param prefetched: (watermark, rows) of LaborDtl rows that have already been fetched, see _fetch_labordtl
+    :param active_only: only count labor for emps still active on the job (completed labor is already in JobOper).
+                        False counts all the day's labor, see laborHistory.
+    :param by_oprseq: total per (JobNum, OprSeq) instead of per JobNum, see laborHistory. Not incremental, and the
+                      legacy engine only keys by JobNum so the vectorized engine stands in for it.
+    :return: if empdata=False: labor totals (JobNum[, OprSeq], Total hours); if empdata=True: [labor totals, shift data]
     """
 
 
-    df_empbreak = GetShiftData() # this is cached for 1 hr
+    if engine is None:
+        engine = settings.LABOR_ENGINE
+    if incremental is None:
+        incremental = settings.LABOR_INCREMENTAL
+    keys = laborEngine.JOB_KEYS
+    if by_oprseq:
+        keys = ('JobNum', 'OprSeq')
+        incremental = False
+        if engine == 'legacy':
+            engine = 'vectorized'
 
-    if date is None:
-        date = datetime.now().strftime('%Y-%m-%d')
+    df_empbreak = shiftdata if shiftdata is not None else GetShiftData() # this is cached for 1 hr
 
-    # make sure date is a date.
-    try:
-        if not isinstance(date, datetime):
-            date = datetime.strptime(date, '%Y-%m-%d')
-    except:
-        logger.error(f'Invalid date: {date}')
+    live = date is None
+    date = _labor_date(date)
 
-    # DATEFIX: Convert date to US/Pacific timezone
-    date = date.astimezone(timezone('US/Pacific')).strftime('%Y-%m-%d')
+    def fetch(watermark=None):
+        # use the prefetched rows if they're what we'd have asked for anyway.
+        if prefetched is not None and prefetched[0] == watermark:
+            return prefetched[1]
+        return _fetch_labordtl(date, watermark)
 
-    # TODO: this gets all labor data, should we filter by oprseq? would be 'wrong' if emp worked on mult oprs.
-    query = f"""
-        SELECT EmployeeNum, JobNum, OprSeq, ClockInDate, ClockInTime, ClockOutTime, ActiveTrans FROM erp.LaborDtl 
-        WHERE ClockInDate = \'{date}\'
-    """
+    # if there's a 24 in ClockOutTime, replace it with the current time, these are active labor transactions.
+    #curtime = datetime.now().time()
 
-    df_sql = InsightUtils.QueryWrapper(query)
+    # DATEFIX: Convert to US/Pacific timezone
+    curtime = pacific_now().time()
+
+
+    nowdectime = curtime.hour + curtime.minute / 60 + curtime.second / 3600
+    if date < _labor_date():
+        nowdectime = 23 + 59 / 60 + 59 / 3600  # labor still open on a past day runs to the end of it.
+
+    # today's labor is kept between runs, only what changed since the last run is refetched.
+    if live and incremental and engine != 'legacy':
+        with pipeline_metrics.span('labordtl.accumulate') as span:
+            dftotals = labor_accumulator.update(date, fetch, df_empbreak, nowdectime, full=full, engine=engine)
+            span.rows = len(labor_accumulator.rows) if labor_accumulator.rows is not None else 0
+        if dftotals is None:
+            return None, None
+
+        if empdata:
+            return dftotals, df_empbreak
+        else:
+            return dftotals
+
+    # TODO: this gets all labor data, should we filter by oprseq? would be 'wrong' if emp worked on mult oprs.
+    df_sql = fetch()
     df_sql = pd.DataFrame(df_sql)
 
+    # if there's no data....
+    if df_sql.empty:
+        return None, None
+
+    if engine != 'legacy':
+        # categoricals and floats instead of strings and Decimals, see laborEngine.compact_labor.
+        df_sql = laborEngine.compact_labor(df_sql)
 
     # Move data to pandas and filter for oprseq
     #deptdata = df_sql[df_sql['OprSeq'] == oprseq].sort_values(by=['JobNum', 'EmployeeNum'])
@@ -149,31 +180,53 @@ def GetLaborDtlData(date=None, oprseq=None, empdata=False):
     # Remove zero value clockintimes, these are adjustments. NEVERMIND. We need to keep these, only groupwork sets clockout to 24 on activetrans.
     # deptdata = deptdata[deptdata['ClockInTime'] != 0]
 
-    # if there's a 24 in ClockOutTime, replace it with the current time, these are active labor transactions.
-    #curtime = datetime.now().time()
-
-    # DATEFIX: Convert to US/Pacific timezone
-    curtime = datetime.now().astimezone(timezone('US/Pacific')).time()
-
-
-    nowdectime = curtime.hour + curtime.minute / 60 + curtime.second / 3600
-    deptdata.loc[deptdata['ClockOutTime'] == 24, 'ClockOutTime'] = nowdectime
-    deptdata.loc[deptdata['ClockOutTime'] == 0, 'ClockOutTime'] = nowdectime
+    laborEngine.close_active_labor(deptdata, nowdectime)
 
     #print(f'NowDecTime: {nowdectime}')
 
-    # if there's no data....
-    if deptdata.empty:
-        return None, None
-
     # This has to be after we remove 0s. Used to set the beginning of the time range.
     minTime = frmt(deptdata['ClockInTime'].min())
     maxTime = frmt(deptdata['ClockOutTime'].max()) # Used to set the end of the time range.
 
 
+    # hours per (JobNum, Emp).
+    with pipeline_metrics.span('labordtl.slot_matrix', rows=len(deptdata)):
+        if engine == 'legacy':
+            df = _legacy_slot_matrix(deptdata, df_empbreak, minTime, maxTime)
+            df = df.sum(axis=1) * settings.LABOR_SLOT_SECONDS / 3600
+        else:
+            df = laborEngine.pair_hours(deptdata, df_empbreak, engine, keys=keys)
+
+    # remove labor for emps that have ended labor on the job, as epicor does that already and we can grab it from joboper.
+    if active_only:
+        with pipeline_metrics.span('labordtl.prune', rows=len(df)):
+            df = df[df.index.isin(laborEngine.active_pairs(df_sql, keys))]
+
+    # df is our raw data, lets get grouped by jobnum....
+
+    with pipeline_metrics.span('labordtl.totals', rows=len(df)):
+        dftotals = df.groupby(level=list(keys)).sum()
+
+        dftotals = dftotals.reset_index()
+        dftotals.columns = [*keys, 'Total']
+
+    # this just prevents us from having to grab this data twice. lazy.
+    if empdata:
+        return dftotals, df_empbreak
+    else:
+        return dftotals
+
+
+def _legacy_slot_matrix(deptdata, df_empbreak, minTime, maxTime):
+    """
+    Original slot engine. Fills a dense job x emp frame one record and one slot at a time.
+    Kept so we can compare against laborEngine, select it with settings.LABOR_ENGINE = 'legacy'.
+    :return: job x emp frame, divided by the number of jobs each emp is on per slot.
+    """
+
     #print(f'Min Time: {minTime} Max Time: {maxTime}')
-    # Create Pandas time range using 5 minute intervals
-    timeRange = pd.date_range(start=minTime, end=maxTime, freq='5min').time
+    # Create Pandas time range using slot intervals (5 minutes by default)
+    timeRange = pd.date_range(start=minTime, end=maxTime, freq=f'{settings.LABOR_SLOT_SECONDS}s').time
 
     # Fill with job data
     index = pd.MultiIndex.from_product([deptdata['JobNum'].unique(), deptdata['EmployeeNum'].unique()], names=['JobNum', 'Emp'])
@@ -233,24 +286,50 @@ def GetLaborDtlData(date=None, oprseq=None, empdata=False):
     df = df.div(jobCounts, axis=0) # dividing the labor for emps by the number of jobs they're working on.
     df.fillna(0.0, inplace=True)
 
-    # remove labor for emps that have ended labor on the job, as epicor does that already and we can grab it from joboper.
-    for index, row in df.iterrows():
-        # check if the emp is active on the job. if not remove the row.
-        if not isEmpActiveOnJob(df_sql, index[0], index[1]):
-            df.drop(index, inplace=True)
+    return df
 
-    # df is our raw data, lets get grouped by jobnum....
 
-    dftotals = df.groupby(level='JobNum').sum().sum(axis=1)
+def _labor_date(date=None):
+    """
+    Normalize a labor date to a 'YYYY-MM-DD' string.
+    :param date: date string, datetime, or None for today
+    :return: date string
+    """
+    # DATEFIX: today is today in US/Pacific. A date that's asked for is taken as is, converting it would shift it
+    # back a day on a UTC server.
+    if date is None:
+        date = pacific_now()
 
-    dftotals = dftotals.reset_index()
-    dftotals.columns = ['JobNum', 'Total']
+    # make sure date is a date.
+    try:
+        if not isinstance(date, datetime):
+            date = datetime.strptime(date, '%Y-%m-%d')
+    except:
+        logger.error(f'Invalid date: {date}')
 
-    # this just prevents us from having to grab this data twice. lazy.
-    if empdata:
-        return dftotals, df_empbreak
-    else:
-        return dftotals
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone('US/Pacific'))
+    return date.strftime('%Y-%m-%d')
+
+
+def _fetch_labordtl(date, watermark=None):
+    """
+    Get the LaborDtl rows for a date.
+    :param date: labor date, 'YYYY-MM-DD'
+    :param watermark: if set, only rows changed since this SysRevID, plus anything still active.
+    :return: list of labor rows
+    """
+    if watermark is None:
+        return queries.run('LaborDtl', date)
+    return queries.run('LaborDtlDelta', date, int(watermark))
+
+
+def pacific_now():
+    """
+    The shop's current time (US/Pacific). The labor code gets 'now' from here, the benchmarks swap it for a
+    synthetic clock.
+    """
+    return datetime.now(timezone('US/Pacific'))
 
 
 # Helper time func
@@ -300,7 +379,7 @@ def isEmpOnBreak(shiftdata, empnum, chktime):
 
 
 
-def labormagic(oprseq=220):
+def labormagic(oprseq=220, full=False):
     # Convert oprseq to int, or return 0 if it's not a number.
     # Lord almighty, this is a hack. Fix it later.
     # TODO: OprSeq param isn't being used for anything, it is legacy from the old system. This function and it's children
@@ -313,34 +392,29 @@ def labormagic(oprseq=220):
     except:
         logger.error(f'Invalid oprseq: {oprseq}')
         oprseq = 0
-    depts = []
-    totals_data, empdata = GetLaborDtlData(oprseq=oprseq, empdata=True)  # defaults to today's date
-
-    # get the depts for this oprseq
-    empdepts = dept_translate[oprseq]
-    empdepts = [f"'{str(dept)}'" for dept in empdepts]
-
-    deptwhere = '(' + ', '.join(empdepts) + ')'
-
-    # check if any emps are not clocked in.
-    query = f"""
-        select 
-         laborhed.employeenum,
-         empbasic.FirstName,
-         empbasic.LastName,
-         empbasic.jcdept,
-         count(labordtl.labordtlseq) as Laborcount
-
-        from erp.laborhed
-         left outer join erp.labordtl on labordtl.laborhedseq = laborhed.laborhedseq
-         inner join erp.empbasic on laborhed.EmployeeNum = empbasic.empid
-
-         where
-         laborhed.activetrans = 1 --and empbasic.jcdept in {deptwhere}
-          group by laborhed.employeenum, empbasic.FirstName, empbasic.LastName, empbasic.jcdept
-         having count(labordtl.labordtlseq) = 0
-    """
-    empsnotclocked = InsightUtils.QueryWrapper(query)
+    # The queries are in queries.py. The dept/oprseq filters they used to carry were commented out, see the TODO above.
+
+    # None of these queries need each other, so run them all at once. Wall time is the slowest query, not the sum.
+    date = _labor_date()
+    watermark = labor_accumulator.next_watermark(date, full) if settings.LABOR_INCREMENTAL else None
+    with pipeline_metrics.span('labormagic.queries'):
+        results, timings = InsightUtils.FanOut({
+            'ShiftData': GetShiftData,
+            'LaborDtl': lambda: _fetch_labordtl(date, watermark),
+            'EmpsNotClocked': lambda: queries.run('EmpsNotClocked'),
+            'ActiveLabor': lambda: queries.run('ActiveLabor'),
+            'ActiveEmps': lambda: queries.run('ActiveEmps'),
+        }, timeout=settings.QUERY_TIMEOUT)
+
+    for name, querytime in timings.items():
+        stats_manager.update_stats(f'Query_{name}', querytime)
+
+    with pipeline_metrics.span('labormagic.labordtl'):
+        totals_data, empdata = GetLaborDtlData(oprseq=oprseq, empdata=True, full=full, shiftdata=results['ShiftData'],
+                                               prefetched=(watermark, results['LaborDtl']))  # defaults to today's date
+
+    # QUERY FOR EMPS NOT CLOCKED IN
+    empsnotclocked = results['EmpsNotClocked']
 
     # Build the empsnotclocked list with F. LastName and depttranslate column
 
@@ -355,41 +429,20 @@ def labormagic(oprseq=220):
     # if there's no emps working, return empty list.
     # pickle the emps_notclocked data for later use.
 
-    with open(emps_not_clocked_file, 'wb') as f:
-        pickle.dump(empsnotclocked, f)
+    atomic_pickle(emps_not_clocked_file, empsnotclocked)
 
     if totals_data is None:
         return None
 
-    # get all active labor data for oprseq
-    query = f"""
-    SELECT DISTINCT
-	LaborDtl.OprSeq,
-	LaborDtl.JobNum,
-	Jobhead.PartNum,
-	JobOper.EstProdHours as Standard,
-	JobOper.ActProdHours
-FROM Erp.LaborDtl 
-	INNER JOIN Erp.JobHead ON LaborDtl.Company = JobHead.Company AND LaborDtl.JobNum = JobHead.JobNum
-	INNER JOIN Erp.JobOper ON LaborDtl.JobNum = JobOper.JobNum AND LaborDtl.OprSeq = JobOper.OprSeq
-WHERE LaborDtl.ActiveTrans = 1 --AND LaborDtl.OprSeq = {oprseq}
-    """
-
     # QUERY FOR ACTIVE LABOR DATA
-    active_labor = InsightUtils.QueryWrapper(query)
+    active_labor = results['ActiveLabor']
     #active_labor = pickledata(active_labor, 'active_labor.pkl')
 
     # convert to pandas dataframe
     active_labor = pd.DataFrame(active_labor)
 
-    # get emps for oprseq and what they're working on.
-    query = f"""
-    SELECT EmployeeNum, Jobnum
-    FROM Erp.LaborDtl WHERE ActiveTrans = 1 -- AND OprSeq = {oprseq}
-    """
-
     # QUERY FOR EMPLOYEES WORKING ON JOBNUMS, to get ACTIVE transactions.
-    emps = InsightUtils.QueryWrapper(query)
+    emps = results['ActiveEmps']
 
     # pickle the data for later use. if flagged to do so.
     #emps = pickledata(emps, 'emps.pkl')
@@ -403,96 +456,77 @@ WHERE LaborDtl.ActiveTrans = 1 --AND LaborDtl.OprSeq = {oprseq}
     # convert to pandas dataframe
     emps = pd.DataFrame(emps)
 
-    # For each jobnum in active_labor, append the totals_data for that jobnum to the active_labor dataframe.
-    for index, row in active_labor.iterrows():
-        jobnum = row['JobNum']
-        # calc this job labor
-        labor = totals_data[totals_data['JobNum'] == jobnum]['Total'].sum()
-        labor = labor * 5 / 60  # mins worked total
-
-        # get Standard and Actual
-        std = row['Standard']
-        prevhrs = row['ActProdHours']
+    with pipeline_metrics.span('labormagic.assemble', rows=len(active_labor)):
+        active_labor = assembleActiveLabor(active_labor, totals_data, emps, empdata)
 
-        # convert everything to dec
-        std = Decimal(std)
-        prevhrs = Decimal(prevhrs)
-        labor = Decimal(labor)
+    # build the return object. The snapshot keeps the active labor as slotted records, a dict per row costs ~3x.
+    data = dict()
+    data['active_labor'] = [ActiveLaborRecord(**record) for record in active_labor]
+    data['empsnotclocked'] = empsnotclocked
 
-        # calc eff
-        eff = 0
-        if std > 0:
-            # print(f'{jobnum} - Std: {std} - Prv: {prevhrs} - Act: {labor}')
-            eff = (prevhrs + labor) / std
+    # pickle empsnotclocked for retrieval later.
+    atomic_pickle(emps_not_clocked_file, empsnotclocked)
 
-        # round everything to 2 decimal places
-        std = round(std, 2)
-        prevhrs = round(prevhrs, 2)
-        labor = round(labor, 2)
-        eff = round(eff, 2)
+    return data
 
-        active_labor.at[index, 'PrevHrs'] = prevhrs
-        active_labor.at[index, 'Standard'] = std
-        active_labor.at[index, 'Efficiency'] = eff
 
-        active_labor.at[index, 'ActiveLabor'] = labor  # totals_data[totals_data['JobNum'] == jobnum]['Total'].sum()
+def assembleActiveLabor(active_labor, totals_data, emps, empdata):
+    """
+    Join the job labor totals onto the active labor rows, calc efficiency and list the emps on each job.
+    :param active_labor: dataframe of active labor (OprSeq, JobNum, PartNum, Standard, ActProdHours)
+    :param totals_data: job labor totals from GetLaborDtlData, joined on OprSeq as well when it has one (by_oprseq)
+    :param emps: dataframe of emps with active labor (EmployeeNum, Jobnum)
+    :param empdata: shift data, used for the emp names
+    :return: list of active labor records
+    """
 
-    # drop actprodhours column now.
-    # active_labor.drop(columns=['ActProdHours'], inplace=True)
+    # job totals, joined once. Total is in hours.
+    if 'OprSeq' in totals_data:
+        keys = ['JobNum', 'OprSeq']
+        job_labor = totals_data.groupby(keys)['Total'].sum()
+        labor = pd.Series(job_labor.reindex(pd.MultiIndex.from_frame(active_labor[keys])).to_numpy(),
+                          index=active_labor.index)
+    else:
+        job_labor = totals_data.groupby('JobNum')['Total'].sum()
+        labor = active_labor['JobNum'].map(job_labor)
+    labor = labor.fillna(0.0)  # hours worked total
+
+    # convert everything to dec, same rounding as we've always done.
+    std = active_labor['Standard'].map(Decimal)
+    prevhrs = active_labor['ActProdHours'].map(Decimal)
+    labor = labor.map(Decimal)
+
+    # calc eff
+    eff = pd.Series(Decimal(0), index=active_labor.index, dtype=object)
+    has_std = std > 0
+    eff[has_std] = (prevhrs[has_std] + labor[has_std]) / std[has_std]
+
+    # round everything to 2 decimal places, then to float for json
+    active_labor['Standard'] = std.map(_round2)
+    active_labor['PrevHrs'] = prevhrs.map(_round2)
+    active_labor['ActiveLabor'] = labor.map(_round2)
+    active_labor['Efficiency'] = eff.map(_round2)
 
     # ReOrder columns: OprSeq, JobNum, PartNum, Standard, PrevHrs, ActiveLabor, Efficiency
     active_labor = active_labor[['OprSeq', 'JobNum', 'PartNum', 'Standard', 'PrevHrs', 'ActiveLabor', 'Efficiency']]
 
-    # under each jobnum, list the employees working on it.
-    # for each jobnum in active_labor, get the emps working on it.
+    # under each jobnum, list the employees working on it. Names are 'F. LastName'.
+    names = empdata.drop_duplicates(subset=['Empid']).set_index('Empid')
+    names = names['FirstName'].str[0] + '. ' + names['LastName']
 
-    for index, row in active_labor.iterrows():
-        jobnum = row['JobNum']
-        empsworking = emps[emps['Jobnum'] == jobnum]['EmployeeNum'].unique()
-        # print("EMPS WORKING")
-        # print(empsworking)
-
-        # translate empsworking to names using empdata["Firstname"] and empdata["LastName"], but trim lastname to 1 char.
-        for i, emp in enumerate(empsworking):
-            emp = empdata[empdata['Empid'] == emp]
-            # empsworking[i] = emp['FirstName'].values[0] + '' + emp['LastName'].values[0][0]
-            empsworking[i] = emp['FirstName'].values[0][0] + '. ' + emp['LastName'].values[0]
-
-        #        empsworking = [empdata[empdata['Empid'] == emp]['FirstName'].values[0] + ' ' + empdata[empdata['Empid'] == emp]['LastName'].values[0][0] for emp in empsworking]
-
-        empsworking = ' - '.join(empsworking)
-        active_labor.at[index, 'Emps'] = empsworking
+    working = emps.drop_duplicates(subset=['Jobnum', 'EmployeeNum'])
+    empnames = working['EmployeeNum'].map(names).fillna(working['EmployeeNum'])
+    job_emps = empnames.groupby(working['Jobnum'], sort=False).agg(' - '.join)
+    active_labor = active_labor.assign(Emps=active_labor['JobNum'].map(job_emps).fillna(''))
 
     # order by partnum, jobnum for consistency.
     active_labor = active_labor.sort_values(by=['PartNum', 'JobNum'])
 
-    active_labor = active_labor.to_dict(orient='records')
+    return active_labor.to_dict(orient='records')
 
-    # convert dec values to float for json
-    for record in active_labor:
-        record['Standard'] = float(record['Standard'])
-        record['PrevHrs'] = float(record['PrevHrs'])
-        record['ActiveLabor'] = float(record['ActiveLabor'])
-        record['Efficiency'] = float(record['Efficiency'])
 
+def _round2(value):
+    return float(round(value, 2))
 
-    # build the return object
-    data = dict()
-    data['active_labor'] = active_labor
-    data['empsnotclocked'] = empsnotclocked
-
-    # pickle empsnotclocked for retrieval later.
-    with open(emps_not_clocked_file, 'wb') as f:
-        pickle.dump(empsnotclocked, f)
 
-    return data
-
-
-def get_emps_not_clocked():
-    try:
-        with open(emps_not_clocked_file, 'rb') as f:
-            data = pickle.load(f)
-        return data
-    except:
-        return None
 
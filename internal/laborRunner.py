@@ -0,0 +1,175 @@
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.internal import settings
+from app.internal.metrics import pipeline_metrics
+from app.internal.snapshot import labor_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+class LaborRun:
+    """
+    One labor update, and every trigger that was merged into it.
+    """
+
+    def __init__(self, full, source):
+        self.id = uuid.uuid4().hex[:12]
+        self.full = full
+        self.sources = [source]
+        self.state = 'queued'
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.message = None
+        self.done = threading.Event()
+
+    def describe(self):
+        status = {
+            'run_id': self.id,
+            'state': self.state,
+            'full': self.full,
+            'triggers': len(self.sources),
+            'sources': sorted(set(self.sources)),
+            'queued': self.queued,
+            'started': self.started,
+            'finished': self.finished,
+            'duration': self.finished - self.started if self.finished and self.started else None,
+            'message': self.message,
+        }
+        if self.state == 'running':
+            # stages done so far, from the pipeline metrics.
+            current = pipeline_metrics.current_run()
+            status['stages'] = [span['name'] for span in current['spans']] if current else []
+        return status
+
+
+class LaborRunner:
+    """
+    Runs labor updates one at a time on a background thread.
+
+    Triggers from the API and from the scheduler job go through here. A trigger while a run is queued or in
+    flight joins that run instead of starting another, so two runs never race each other. The exception is a
+    full recompute asked for while an incremental run is in flight, that queues one full run to follow it
+    (and later triggers join that one).
+    """
+
+    def __init__(self, target, keep=None):
+        self._target = target
+        self._keep = keep
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='labor-run')
+        self._active = None  # queued or running
+        self._next = None  # full run queued behind an incremental one
+        self._runs = OrderedDict()  # run id -> LaborRun, oldest first
+
+    def trigger(self, full=False, source='api'):
+        """
+        Ask for a labor update, without waiting for it.
+        :param full: recompute the whole day
+        :param source: who asked, 'api' or 'scheduler'
+        :return: (run, merged). merged is True when the trigger joined a run that was already queued or running.
+        """
+        with self._lock:
+            active = self._active
+            if active is not None and active.state == 'queued' and full:
+                active.full = True  # hasn't started yet, just make it a full run.
+            if active is not None and (active.full or not full):
+                active.sources.append(source)
+                return active, True
+
+            if active is not None:
+                if self._next is not None:
+                    self._next.sources.append(source)
+                    return self._next, True
+                run = self._next = LaborRun(full, source)
+            else:
+                run = self._active = LaborRun(full, source)
+            self._remember(run)
+
+        self._executor.submit(self._execute, run)
+        return run, False
+
+    def run(self, full=False, source='scheduler'):
+        """
+        Trigger an update and wait for it to finish. This is what the scheduler job calls.
+        :return: the run's message
+        """
+        run, merged = self.trigger(full=full, source=source)
+        if merged:
+            logger.info(f'Labor update from {source} merged into run {run.id}.')
+        run.done.wait()
+        return run.message
+
+    def status(self, run_id=None):
+        """
+        :param run_id: run to look up, None for the latest run
+        :return: status dict, or None if the run isn't known (or has aged out)
+        """
+        with self._lock:
+            if run_id is None:
+                run = next(reversed(self._runs.values()), None)
+            else:
+                run = self._runs.get(run_id)
+        return run.describe() if run is not None else None
+
+    def _execute(self, run):
+        with self._lock:
+            run.state = 'running'
+            run.started = time.time()
+
+        try:
+            run.message = self._target(full=run.full)
+            run.state = 'done'
+        except Exception as e:
+            logger.exception(f'Labor run {run.id} failed.')
+            run.message = str(e)
+            run.state = 'error'
+        finally:
+            with self._lock:
+                run.finished = time.time()
+                # a queued full run takes over, so triggers keep joining it.
+                self._active, self._next = self._next, None
+            run.done.set()
+
+    def _remember(self, run):
+        self._runs[run.id] = run
+        while len(self._runs) > (self._keep or settings.METRICS_KEEP_RUNS):
+            self._runs.popitem(last=False)
+
+
+def _process_live_labor(full=False):
+    # laborMagic pulls in pandas/numpy, keep that off the startup path. The warm start imports it in the background.
+    from app.internal import laborMagic
+    return laborMagic.process_live_labor(full=full)
+
+
+labor_runner = LaborRunner(_process_live_labor)
+
+
+def warm_start(runner=labor_runner):
+    """
+    Startup phase. Puts the last persisted snapshot in memory right away so the screens have data from the first
+    request, then imports the labor code, warms the shift cache and runs a refresh, all in the background.
+    :return: the background thread
+    """
+    snapshot = labor_snapshots.current()
+    if snapshot is not None:
+        logger.info(f'Warm start: restored labor snapshot {snapshot.version}.')
+
+    def warm():
+        try:
+            from app.internal import laborMagic
+            laborMagic.warm_caches()
+        except Exception as e:
+            # the refresh runs the same query, it'll surface anything real.
+            logger.error(f'Warm start: error warming caches: {e}')
+        run, _ = runner.trigger(source='startup')
+        logger.info(f'Warm start: labor refresh {run.id} started.')
+
+    thread = threading.Thread(target=warm, name='labor-warm-start', daemon=True)
+    thread.start()
+    return thread
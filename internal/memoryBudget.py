@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import logging
+from app.internal import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes():
+    """
+    The process's resident memory right now, from /proc (Linux). Elsewhere the peak so far, or None if there's no
+    way to tell.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, KB elsewhere
+
+
+class MemoryBudget:
+    """
+    Memory budget for the labor run, settings.LABOR_MEMORY_BUDGET_MB of resident memory (the container's limit is
+    200m, the rest is headroom for the API).
+
+    The pipeline checks it after every stage (see metrics.PipelineMetrics) and before allocating its big arrays,
+    with the bytes it's about to allocate. Going over only logs, once per stage per run, naming the stage, the
+    resident memory and the budget, so the run that pushed the container towards its limit shows up in the logs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._warned = set()
+        self._stats = {'checks': 0, 'exceeded': 0, 'peak_bytes': 0, 'last_bytes': None}
+
+    @property
+    def limit(self):
+        """
+        :return: the budget in bytes, or None when it's turned off (0)
+        """
+        return settings.LABOR_MEMORY_BUDGET_MB * 1024 * 1024 if settings.LABOR_MEMORY_BUDGET_MB else None
+
+    def new_run(self):
+        """
+        Start of a labor run, every stage gets to warn once again.
+        """
+        with self._lock:
+            self._warned.clear()
+
+    def check(self, stage, planned=0, rss=None):
+        """
+        :param stage: stage name, for the log
+        :param planned: bytes the stage is about to allocate on top of what's resident
+        :param rss: resident bytes if the caller just measured them, see rss_bytes
+        :return: True if within the budget (or there's no budget, or no way to measure)
+        """
+        rss = rss if rss is not None else rss_bytes()
+        limit = self.limit
+        with self._lock:
+            self._stats['checks'] += 1
+            if rss is not None:
+                self._stats['last_bytes'] = rss
+                self._stats['peak_bytes'] = max(self._stats['peak_bytes'], rss)
+            if rss is None or limit is None or rss + planned <= limit:
+                return True
+            self._stats['exceeded'] += 1
+            if stage in self._warned:
+                return False
+            self._warned.add(stage)
+
+        mb = 1024 * 1024
+        planned_text = f' + {planned / mb:.1f} MB about to be allocated' if planned else ''
+        logger.warning(f'Labor run over its memory budget at {stage}: {rss / mb:.1f} MB resident{planned_text}, '
+                       f'budget {limit / mb:.0f} MB (settings.LABOR_MEMORY_BUDGET_MB).')
+        return False
+
+    def stats(self):
+        """
+        :return: dict of checks made, checks over the budget, resident bytes now, at the last check and at the highest
+            check, and the budget in bytes (None when it's off)
+        """
+        with self._lock:
+            return dict(self._stats, budget_bytes=self.limit, resident_bytes=rss_bytes())
+
+
+memory_budget = MemoryBudget()
@@ -0,0 +1,204 @@
+import time
+import threading
+import logging
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from app.internal import settings
+from app.internal.stats import LatencyHistogram
+from app.internal.memoryBudget import memory_budget, rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    One timed stage of a labor run. Set rows to record how many rows the stage handled. rss is the resident memory
+    when a stage of a run ended.
+    """
+    __slots__ = ('name', 'start', 'duration', 'rows', 'rss')
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.rows = rows
+        self.rss = None
+
+
+class PipelineMetrics:
+    """
+    Per stage timings for the labor pipeline.
+
+    Every span feeds a duration histogram and a row counter per stage name, rendered in Prometheus text format
+    for /metrics. Spans opened inside a run, on the run's own thread or in the tasks it fans out (InsightUtils.FanOut
+    carries the run's context over to its threads), are also kept with that run. Spans from anything else running
+    at the same time, requests or history/backfill threads, aren't. The last settings.METRICS_KEEP_RUNS runs are
+    kept for drill down.
+    """
+
+    def __init__(self, keep_runs=None):
+        self._lock = threading.Lock()
+        self._histograms = {}  # stage -> LatencyHistogram
+        self._sums = {}  # stage -> total seconds
+        self._rows = {}  # stage -> total rows
+        self._last_rows = {}  # stage -> rows on the last span
+        self._current = None  # the run in flight, for current_run()
+        self._active = contextvars.ContextVar('pipeline_run', default=None)  # the run spans here belong to
+        self._keep_runs = keep_runs
+        self._runs = None  # made on first use, settings may not be loaded yet when this module is imported.
+        self._run_count = 0
+
+    @contextmanager
+    def span(self, name, rows=None):
+        """
+        Time a stage.
+        with pipeline_metrics.span('labordtl.totals') as span:
+            ...
+            span.rows = len(df)
+        """
+        span = Span(name, rows)
+        run = self._active.get()
+        try:
+            yield span
+        finally:
+            span.duration = time.time() - span.start
+            if run is not None:
+                # every stage of a run is checked against the memory budget.
+                span.rss = rss_bytes()
+                memory_budget.check(name, rss=span.rss)
+            self._record(span, run)
+
+    @contextmanager
+    def run(self, name):
+        """
+        Group the spans of one pipeline run. Runs don't nest, a run started inside another (on its thread or in its
+        fan out) just adds a span to it.
+        """
+        run = self._active.get()
+        if run is not None:
+            with self.span(name):
+                yield run
+            return
+
+        with self._lock:
+            self._run_count += 1
+            run = self._current = {'run': self._run_count, 'name': name, 'started': time.time(),
+                                   'duration': None, 'status': 'running', 'spans': []}
+        token = self._active.set(run)
+
+        memory_budget.new_run()
+        status = 'error'
+        try:
+            with self.span(name):
+                yield run
+            status = 'ok'
+        finally:
+            self._active.reset(token)
+            with self._lock:
+                run['duration'] = time.time() - run['started']
+                run['status'] = status
+                if self._runs is None:
+                    self._runs = deque(maxlen=self._keep_runs or settings.METRICS_KEEP_RUNS)
+                self._runs.append(run)
+                if self._current is run:
+                    self._current = None
+
+    def runs(self):
+        """
+        :return: the last runs, newest first, with their span breakdowns
+        """
+        with self._lock:
+            runs = list(self._runs or [])
+        return [self._describe(run) for run in reversed(runs)]
+
+    def current_run(self):
+        """
+        :return: the run in flight, or None
+        """
+        run = self._current
+        return self._describe(run) if run is not None else None
+
+    def render_prometheus(self):
+        """
+        :return: the stage metrics in Prometheus text exposition format
+        """
+        lines = [
+            '# HELP actfast_stage_duration_seconds Duration of labor pipeline stages.',
+            '# TYPE actfast_stage_duration_seconds histogram',
+        ]
+        with self._lock:
+            for stage in sorted(self._histograms):
+                histogram = self._histograms[stage]
+                label = _escape(stage)
+                cumulative = 0
+                for bound, count in zip(histogram.BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'actfast_stage_duration_seconds_bucket{{stage="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'actfast_stage_duration_seconds_sum{{stage="{label}"}} {self._sums[stage]}')
+                lines.append(f'actfast_stage_duration_seconds_count{{stage="{label}"}} {histogram.total}')
+
+            lines.append('# HELP actfast_stage_rows_total Rows handled by labor pipeline stages.')
+            lines.append('# TYPE actfast_stage_rows_total counter')
+            for stage in sorted(self._rows):
+                lines.append(f'actfast_stage_rows_total{{stage="{_escape(stage)}"}} {self._rows[stage]}')
+
+            lines.append('# HELP actfast_stage_last_rows Rows handled by the last run of a labor pipeline stage.')
+            lines.append('# TYPE actfast_stage_last_rows gauge')
+            for stage in sorted(self._last_rows):
+                lines.append(f'actfast_stage_last_rows{{stage="{_escape(stage)}"}} {self._last_rows[stage]}')
+
+            lines.append('# HELP actfast_pipeline_runs_total Labor pipeline runs started.')
+            lines.append('# TYPE actfast_pipeline_runs_total counter')
+            lines.append(f'actfast_pipeline_runs_total {self._run_count}')
+
+        memory = memory_budget.stats()
+        lines.append('# HELP actfast_resident_bytes Resident memory at the last labor pipeline stage.')
+        lines.append('# TYPE actfast_resident_bytes gauge')
+        lines.append(f'actfast_resident_bytes {memory["last_bytes"] or 0}')
+        lines.append('# HELP actfast_memory_budget_bytes Labor run memory budget (settings.LABOR_MEMORY_BUDGET_MB).')
+        lines.append('# TYPE actfast_memory_budget_bytes gauge')
+        lines.append(f'actfast_memory_budget_bytes {memory["budget_bytes"] or 0}')
+        lines.append('# HELP actfast_memory_budget_exceeded_total Labor pipeline checks over the memory budget.')
+        lines.append('# TYPE actfast_memory_budget_exceeded_total counter')
+        lines.append(f'actfast_memory_budget_exceeded_total {memory["exceeded"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _record(self, span, run):
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = LatencyHistogram()
+                self._sums[span.name] = 0.0
+            histogram.observe(span.duration)
+            self._sums[span.name] += span.duration
+            if span.rows is not None:
+                self._rows[span.name] = self._rows.get(span.name, 0) + span.rows
+                self._last_rows[span.name] = span.rows
+            if run is not None and run['duration'] is None:
+                run['spans'].append(span)
+
+    @staticmethod
+    def _describe(run):
+        return {
+            'run': run['run'],
+            'name': run['name'],
+            'started': run['started'],
+            'duration': run['duration'],
+            'status': run['status'],
+            'spans': [{'name': span.name,
+                       'offset': round(span.start - run['started'], 4),
+                       'duration': round(span.duration, 4),
+                       'rows': span.rows,
+                       'rss_mb': round(span.rss / 1024 / 1024, 1) if span.rss else None}
+                      for span in list(run['spans'])],
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+pipeline_metrics = PipelineMetrics()
@@ -0,0 +1,96 @@
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+
+class EmployeeNotClocked(BaseModel):
+    employeenum: str = Field(description="The employee's number")
+    FirstName: str = Field(description="First name of the employee")
+    LastName: str = Field(description="Last name of the employee")
+    jcdept: str = Field(description="Department code")
+    Laborcount: int = Field(default=0, description="Count of labor entries")
+    #OprSeq: int = Field(description="Operation sequence number")
+    Name: str = Field(description="Formatted name of the employee")
+
+class LaborData(BaseModel):
+    OprSeq: int = Field(description="Operation sequence number")
+    JobNum: str = Field(description="Job number")
+    PartNum: str = Field(description="Part number")
+    Standard: float = Field(description="Standard number of hours expected")
+    PrevHrs: float = Field(default=0, description="Previous hours worked")
+    ActiveLabor: float = Field(description="Hours of active labor")
+    Efficiency: float = Field(description="Efficiency rating")
+    Emps: str = Field(description="Employee names involved")
+
+class ActiveLaborData(BaseModel):
+    active_labor: List[LaborData] = Field(default=[], description="List of active labor entries")
+    empsnotclocked: List[EmployeeNotClocked] = Field(default_factory=list, description="List of employees who are not clocked")
+    oprseq: int = Field(description="Operation sequence")
+    timestamp: datetime = Field(description="Timestamp of the labor run that last changed this oprseq's data. Runs "
+                                            "that change nothing leave it as is, the latest retrieval is in the "
+                                            "X-Labor-Retrieved header")
+    executiontime: float = Field(description="Time taken for the scheduled task to run (NOT this query)")
+
+class LaborHistoryRecord(BaseModel):
+    Date: str = Field(description="Labor date, YYYY-MM-DD")
+    OprSeq: int = Field(description="Operation sequence number")
+    JobNum: str = Field(description="Job number")
+    PartNum: str = Field(description="Part number")
+    Standard: float = Field(description="Standard number of hours expected")
+    PrevHrs: float = Field(default=0, description="Hours booked on the job/operation before this day")
+    DayLabor: float = Field(description="Hours of labor on the job this day")
+    Efficiency: float = Field(description="Efficiency rating at the end of the day")
+    Emps: str = Field(description="Employee names involved")
+
+class LaborHistoryDay(BaseModel):
+    date: str = Field(description="Labor date, YYYY-MM-DD")
+    cached: bool = Field(description="True if the day was read from the history cache instead of computed")
+    jobs: List[LaborHistoryRecord] = Field(default_factory=list, description="Labor per job/operation")
+
+class LaborHistoryTotal(BaseModel):
+    OprSeq: int = Field(description="Operation sequence number")
+    JobNum: str = Field(description="Job number")
+    PartNum: str = Field(description="Part number")
+    Standard: float = Field(description="Standard number of hours expected")
+    DayLabor: float = Field(description="Hours of labor on the job over the range")
+    Days: int = Field(description="Days in the range with labor on the job")
+    Efficiency: float = Field(description="Efficiency rating at the end of the last day with labor")
+
+class LaborHistoryData(BaseModel):
+    start: str = Field(description="First day, YYYY-MM-DD")
+    end: str = Field(description="Last day, YYYY-MM-DD")
+    days: List[LaborHistoryDay] = Field(default_factory=list, description="Labor per day")
+    totals: List[LaborHistoryTotal] = Field(default_factory=list, description="Labor per job/operation over the range")
+
+class LaborKey(BaseModel):
+    OprSeq: int = Field(description="Operation sequence number")
+    JobNum: str = Field(description="Job number")
+
+class LaborChange(LaborKey):
+    fields: Dict[str, Any] = Field(default_factory=dict, description="Fields that changed, with their new values")
+
+class EmployeeKey(BaseModel):
+    employeenum: str = Field(description="The employee's number")
+
+class EmployeeChange(EmployeeKey):
+    fields: Dict[str, Any] = Field(default_factory=dict, description="Fields that changed, with their new values")
+
+class LaborDelta(BaseModel):
+    added: List[LaborData] = Field(default_factory=list, description="Jobs that are new")
+    removed: List[LaborKey] = Field(default_factory=list, description="Jobs that are gone")
+    changed: List[LaborChange] = Field(default_factory=list, description="Jobs that changed")
+
+class EmployeeNotClockedDelta(BaseModel):
+    added: List[EmployeeNotClocked] = Field(default_factory=list, description="Employees that are new")
+    removed: List[EmployeeKey] = Field(default_factory=list, description="Employees that are gone")
+    changed: List[EmployeeChange] = Field(default_factory=list, description="Employees that changed")
+
+class ActiveLaborDelta(BaseModel):
+    oprseq: int = Field(description="Operation sequence")
+    since: int = Field(description="The version the changes are from")
+    version: int = Field(description="The current version, send it as since next time")
+    full: bool = Field(description="True if since was too old to diff against. Everything current is in added, start over from it")
+    active_labor: LaborDelta = Field(default_factory=LaborDelta, description="Active labor changes")
+    empsnotclocked: EmployeeNotClockedDelta = Field(default_factory=EmployeeNotClockedDelta, description="Employees not clocked changes")
+    timestamp: Optional[datetime] = Field(default=None, description="Timestamp of the data retrieval")
+    executiontime: Optional[float] = Field(default=None, description="Time taken for the scheduled task to run (NOT this query)")
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import logging
+from app.internal import settings
+from app.internal.snapshot import labor_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """
+    One push client (WebSocket or SSE) for one OprSeq.
+
+    Holds at most one message: the newest pre-rendered response for its OprSeq. If a new snapshot lands before
+    the client took the last one, the old one is replaced (conflated), so a slow client never builds a backlog,
+    it just skips to the latest data.
+    """
+
+    def __init__(self, oprseq, kind, last_etag=None):
+        self.oprseq = oprseq
+        self.kind = kind
+        self.last_etag = last_etag  # last version sent, or the one the client says it has
+        self._pending = None  # (body, etag)
+        self._event = asyncio.Event()
+        self.sent = 0
+        self.conflated = 0
+
+    def offer(self, snapshot):
+        """
+        Queue the snapshot's response for this OprSeq if it changed. Call on the event loop.
+        """
+        response = snapshot.responses.get(self.oprseq) if snapshot is not None else None
+        if response is None or response[1] == self.last_etag:
+            return
+        if self._pending is not None and self._pending[1] != response[1]:
+            self.conflated += 1
+        self._pending = response
+        self._event.set()
+
+    async def get(self, timeout=None):
+        """
+        Wait for the next message. Cancelling or timing out never loses a message, it stays pending.
+        :param timeout: seconds, None to wait for good
+        :return: (body bytes, etag), or None on timeout
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        message, self._pending = self._pending, None
+        self.last_etag = message[1]
+        return message
+
+
+class LaborBroadcaster:
+    """
+    Pushes new labor snapshots to subscribed shop screens.
+
+    The labor run publishes on a worker thread. The broadcaster hands the snapshot to the event loop once, and the
+    loop offers it to every subscriber of each OprSeq. Bodies are the snapshot's pre-rendered responses, so a
+    snapshot is serialized once no matter how many screens are listening, and screens whose OprSeq didn't change
+    get nothing.
+    """
+
+    def __init__(self, store):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._subscribers = {}  # oprseq -> set of Subscriber
+        self._stats = {'published': 0, 'sent': 0, 'conflated': 0, 'slow_disconnects': 0, 'rejected': 0}
+        store.add_listener(self.on_publish)
+        self._store = store
+
+    def subscribe(self, oprseq, kind, last_etag=None):
+        """
+        Add a subscriber and offer it the current snapshot. Call from the event loop.
+        :return: Subscriber, or None if there are already settings.PUSH_MAX_SUBSCRIBERS
+        """
+        self._loop = asyncio.get_running_loop()
+        with self._lock:
+            if sum(len(subs) for subs in self._subscribers.values()) >= settings.PUSH_MAX_SUBSCRIBERS:
+                self._stats['rejected'] += 1
+                return None
+            subscriber = Subscriber(oprseq, kind, last_etag)
+            self._subscribers.setdefault(oprseq, set()).add(subscriber)
+        subscriber.offer(self._store.current())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subs = self._subscribers.get(subscriber.oprseq)
+            if subs is not None:
+                subs.discard(subscriber)
+                if not subs:
+                    del self._subscribers[subscriber.oprseq]
+            self._stats['sent'] += subscriber.sent
+            self._stats['conflated'] += subscriber.conflated
+
+    def slow_disconnect(self, subscriber):
+        logger.warning(f'Disconnecting slow {subscriber.kind} subscriber for OprSeq {subscriber.oprseq}.')
+        with self._lock:
+            self._stats['slow_disconnects'] += 1
+
+    def on_publish(self, snapshot):
+        """
+        Snapshot store listener, runs on the publishing thread.
+        """
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(self._fan_out, snapshot)
+        except RuntimeError:
+            # the loop's gone (shutting down).
+            pass
+
+    def _fan_out(self, snapshot):
+        with self._lock:
+            self._stats['published'] += 1
+            groups = [list(subs) for subs in self._subscribers.values()]
+        for subs in groups:
+            for subscriber in subs:
+                subscriber.offer(snapshot)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            subscribers = [sub for subs in self._subscribers.values() for sub in subs]
+            stats['subscribers'] = len(subscribers)
+            stats['by_oprseq'] = {oprseq: len(subs) for oprseq, subs in self._subscribers.items()}
+            stats['by_kind'] = {}
+            for sub in subscribers:
+                stats['by_kind'][sub.kind] = stats['by_kind'].get(sub.kind, 0) + 1
+                stats['sent'] += sub.sent
+                stats['conflated'] += sub.conflated
+        return stats
+
+
+labor_broadcaster = LaborBroadcaster(labor_snapshots)
@@ -0,0 +1,254 @@
+import time
+import threading
+import logging
+from app.internal import settings
+from app.internal.utils import InsightUtils
+from app.internal.queryCache import query_cache
+from app.internal.stats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class NamedQuery:
+    """
+    One registered Epicor query.
+
+    The SQL uses T-SQL parameters (@Date etc.) and runs through sp_executesql, so the statement text is the same on
+    every run and SQL Server reuses one plan for it. pymssql fills in the parameter values on the EXEC line only.
+    """
+    __slots__ = ('name', 'sql', 'params', 'cache', 'statement', 'histogram', 'calls', 'errors', 'rows',
+                 'last_rows', 'max_time')
+
+    def __init__(self, name, sql, params=(), cache=None):
+        """
+        :param name: query name, also the cache and stats key
+        :param sql: the SQL, using @Name parameters
+        :param params: tuple of (name, sql type, placeholder), e.g. ('Date', 'DATE', '%s'), in call order
+        :param cache: None, 'short' (settings.QUERY_CACHE_TTL) or 'long' (settings.QUERY_LONG_CACHE_TTL)
+        """
+        self.name = name
+        self.sql = sql
+        self.params = tuple(params)
+        self.cache = cache
+        self.statement = self._statement()
+        self.histogram = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.last_rows = None
+        self.max_time = 0.0
+
+    def _statement(self):
+        if not self.params:
+            return self.sql
+        body = self.sql.replace("'", "''")
+        declare = ', '.join(f'@{name} {sqltype}' for name, sqltype, _ in self.params)
+        values = ', '.join(f'@{name} = {placeholder}' for name, _, placeholder in self.params)
+        return f"EXEC sp_executesql N'{body}', N'{declare}', {values}"
+
+
+class QueryRegistry:
+    """
+    Every hot Epicor query in one place, by name. Run them with run(name, *params).
+    Keeps latency (DB executions only, not cache hits) and row counts per query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries = {}
+
+    def register(self, name, sql, params=(), cache=None):
+        query = NamedQuery(name, sql, params, cache)
+        self._queries[name] = query
+        return query
+
+    def get(self, name):
+        return self._queries[name]
+
+    def run(self, name, *params):
+        """
+        Run a registered query.
+        :param name: query name
+        :param params: parameter values, in the order the query declares them
+        :return: rows (list of dicts). Cached rows are shared, don't change them.
+        """
+        query = self._queries[name]
+        if len(params) != len(query.params):
+            raise ValueError(f'Query {name} takes {len(query.params)} parameters, got {len(params)}')
+        params = params or None
+
+        def execute():
+            starttime = time.time()
+            try:
+                data = InsightUtils.QueryWrapper(query.statement, name=name, params=params)
+            except Exception:
+                with self._lock:
+                    query.errors += 1
+                raise
+            self._record(query, time.time() - starttime, len(data))
+            return data
+
+        if query.cache is None:
+            return execute()
+
+        soft_ttl, hard_ttl = settings.QUERY_LONG_CACHE_TTL if query.cache == 'long' else settings.QUERY_CACHE_TTL
+        return query_cache.get(name, params, execute, soft_ttl, hard_ttl)
+
+    def stream(self, name, *params, batch_size=None):
+        """
+        Stream a registered query in batches, see InsightUtils.QueryStream. Never cached.
+        :return: generator of row batches
+        """
+        query = self._queries[name]
+        if len(params) != len(query.params):
+            raise ValueError(f'Query {name} takes {len(query.params)} parameters, got {len(params)}')
+
+        starttime = time.time()
+        rows = 0
+        try:
+            for batch in InsightUtils.QueryStream(query.statement, name=name, params=params or None,
+                                                  batch_size=batch_size):
+                rows += len(batch)
+                yield batch
+        except Exception:
+            with self._lock:
+                query.errors += 1
+            raise
+        self._record(query, time.time() - starttime, rows)
+
+    def stats(self):
+        """
+        :return: per query executions, errors, rows and latency percentiles (seconds, 3 decimal places)
+        """
+        with self._lock:
+            report = {}
+            for name, query in self._queries.items():
+                entry = {
+                    'calls': query.calls,
+                    'errors': query.errors,
+                    'rows': query.rows,
+                    'last_rows': query.last_rows,
+                    'max_time': round(query.max_time, 3),
+                    'cache': query.cache,
+                }
+                for q in (50, 95, 99):
+                    value = query.histogram.percentile(q)
+                    entry[f'p{q}'] = round(value, 3) if value is not None else None
+                report[name] = entry
+            return report
+
+    def _record(self, query, seconds, rows):
+        with self._lock:
+            query.calls += 1
+            query.rows += rows
+            query.last_rows = rows
+            query.max_time = max(query.max_time, seconds)
+            query.histogram.observe(seconds)
+
+
+queries = QueryRegistry()
+
+
+queries.register('ShiftData', """
+        SELECT
+            EmpBasic.Empid,
+            EmpBasic.Name,
+            EmpBasic.FirstName,
+            EmpBasic.LastName,
+            EmpBasic.JCDept,
+            JCShift.Shift,
+            JCShift.StartTime,
+            JCShift.EndTime,
+            JCShift.LunchStart,
+            JCShift.LunchEnd,
+            ShiftBrk.BreakStart,
+            ShiftBrk.BreakEnd
+        FROM Erp.Empbasic
+            INNER JOIN Erp.JCShift ON Empbasic.Shift = JCShift.Shift
+            LEFT OUTER JOIN Erp.Shiftbrk ON JCShift.Shift = ShiftBrk.Shift
+        WHERE EmpBasic.EmpStatus = 'A'
+    """, cache='long')
+
+# today's labor. LaborDtlDelta is the incremental version, rows changed since the SysRevID watermark plus anything
+# still active.
+queries.register('LaborDtl', """
+        SELECT LaborDtlSeq, EmployeeNum, JobNum, OprSeq, ClockInDate, ClockInTime, ClockOutTime, ActiveTrans,
+            CAST(SysRevID AS BIGINT) AS SysRevID
+        FROM erp.LaborDtl
+        WHERE ClockInDate = @Date
+    """, params=[('Date', 'DATE', '%s')])
+
+queries.register('LaborDtlDelta', """
+        SELECT LaborDtlSeq, EmployeeNum, JobNum, OprSeq, ClockInDate, ClockInTime, ClockOutTime, ActiveTrans,
+            CAST(SysRevID AS BIGINT) AS SysRevID
+        FROM erp.LaborDtl
+        WHERE ClockInDate = @Date
+            AND (CAST(SysRevID AS BIGINT) > @Watermark OR ActiveTrans = 1)
+    """, params=[('Date', 'DATE', '%s'), ('Watermark', 'BIGINT', '%d')])
+
+# every job/operation with labor on a day, with the labor booked on it before that day. For laborHistory.
+queries.register('LaborHistoryJobs', """
+    SELECT
+	DayOps.OprSeq,
+	DayOps.JobNum,
+	JobHead.PartNum,
+	JobOper.EstProdHours as Standard,
+	(SELECT ISNULL(SUM(Prior.LaborHrs), 0) FROM Erp.LaborDtl Prior
+	    WHERE Prior.Company = DayOps.Company AND Prior.JobNum = DayOps.JobNum AND Prior.OprSeq = DayOps.OprSeq
+	    AND Prior.ClockInDate < @Date) as PrevHrs
+FROM (SELECT DISTINCT Company, JobNum, OprSeq FROM Erp.LaborDtl WHERE ClockInDate = @Date) DayOps
+	INNER JOIN Erp.JobHead ON DayOps.Company = JobHead.Company AND DayOps.JobNum = JobHead.JobNum
+	INNER JOIN Erp.JobOper ON DayOps.JobNum = JobOper.JobNum AND DayOps.OprSeq = JobOper.OprSeq
+    """, params=[('Date', 'DATE', '%s')])
+
+queries.register('LaborHistoryEmps', """
+    SELECT DISTINCT EmployeeNum, JobNum as Jobnum
+    FROM Erp.LaborDtl WHERE ClockInDate = @Date
+    """, params=[('Date', 'DATE', '%s')])
+
+# raw LaborDtl for a day, for exports.
+queries.register('LaborDtlExport', """
+        SELECT LaborDtlSeq, EmployeeNum, JobNum, OprSeq, ClockInDate, ClockInTime, ClockOutTime, LaborHrs, ActiveTrans
+        FROM erp.LaborDtl
+        WHERE ClockInDate = @Date
+        ORDER BY LaborDtlSeq
+    """, params=[('Date', 'DATE', '%s')])
+
+# emps clocked in (LaborHed) without any labor on a job.
+queries.register('EmpsNotClocked', """
+        select
+         laborhed.employeenum,
+         empbasic.FirstName,
+         empbasic.LastName,
+         empbasic.jcdept,
+         count(labordtl.labordtlseq) as Laborcount
+
+        from erp.laborhed
+         left outer join erp.labordtl on labordtl.laborhedseq = laborhed.laborhedseq
+         inner join erp.empbasic on laborhed.EmployeeNum = empbasic.empid
+
+         where
+         laborhed.activetrans = 1
+          group by laborhed.employeenum, empbasic.FirstName, empbasic.LastName, empbasic.jcdept
+         having count(labordtl.labordtlseq) = 0
+    """)
+
+# active labor with the JobOper standard/actual hours.
+queries.register('ActiveLabor', """
+    SELECT DISTINCT
+	LaborDtl.OprSeq,
+	LaborDtl.JobNum,
+	Jobhead.PartNum,
+	JobOper.EstProdHours as Standard,
+	JobOper.ActProdHours
+FROM Erp.LaborDtl
+	INNER JOIN Erp.JobHead ON LaborDtl.Company = JobHead.Company AND LaborDtl.JobNum = JobHead.JobNum
+	INNER JOIN Erp.JobOper ON LaborDtl.JobNum = JobOper.JobNum AND LaborDtl.OprSeq = JobOper.OprSeq
+WHERE LaborDtl.ActiveTrans = 1
+    """)
+
+# emps and what they're working on.
+queries.register('ActiveEmps', """
+    SELECT EmployeeNum, Jobnum
+    FROM Erp.LaborDtl WHERE ActiveTrans = 1
+    """)
@@ -0,0 +1,193 @@
+import sys
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.internal import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    __slots__ = ('value', 'loaded', 'soft_ttl', 'hard_ttl', 'rows', 'nbytes', 'refreshing')
+
+    def __init__(self, value, soft_ttl, hard_ttl):
+        self.value = value
+        self.loaded = time.time()
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.rows = len(value) if hasattr(value, '__len__') else 1
+        self.nbytes = estimate_bytes(value)
+        self.refreshing = False
+
+
+def estimate_bytes(value, sample=20):
+    """
+    Rough size of a query result (list of row dicts), from a sample of rows. Good enough to bound the cache,
+    without walking every row.
+    """
+    if not isinstance(value, list):
+        return sys.getsizeof(value)
+    if not value:
+        return sys.getsizeof(value)
+    rows = value[:sample]
+    per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values()) if isinstance(row, dict)
+                  else sys.getsizeof(row) for row in rows) / len(rows)
+    return int(sys.getsizeof(value) + per_row * len(value))
+
+
+class QueryCache:
+    """
+    Query result cache, keyed by query name + bound parameters.
+
+    Each entry has a soft and a hard TTL. Past the soft TTL the cached rows are still served, and one background
+    refresh reloads them. Past the hard TTL (or on a miss) the caller loads them itself, and callers asking for the
+    same key at the same time wait on that one load. The cache is bounded by total rows and estimated bytes,
+    least recently used entries go first. Hits, stale hits, misses and refreshes are counted per query name.
+
+    Cached rows are shared between callers, don't change them.
+    """
+
+    def __init__(self, max_rows=None, max_bytes=None, refresh_workers=None):
+        # bounds default to settings, read on use (settings may still be loading when this module is imported).
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self._refresh_workers = refresh_workers
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> CacheEntry, least recently used first
+        self._loading = {}  # key -> Event, loads in flight
+        self._rows = 0
+        self._bytes = 0
+        self._stats = {}
+        self._executor = None
+
+    @property
+    def max_rows(self):
+        return self._max_rows if self._max_rows is not None else settings.QUERY_CACHE_MAX_ROWS
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes if self._max_bytes is not None else settings.QUERY_CACHE_MAX_BYTES
+
+    def get(self, name, params, loader, soft_ttl, hard_ttl):
+        """
+        Cached result for (name, params), loading it with loader() when needed.
+        :param name: query name, one name = one SQL text
+        :param params: bound parameters (hashable, usually a tuple)
+        :param loader: callable returning the rows
+        :param soft_ttl: seconds before a background refresh
+        :param hard_ttl: seconds before the rows are no longer served
+        :return: rows
+        """
+        key = (name, params)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                age = time.time() - entry.loaded if entry is not None else None
+                if entry is not None and age < entry.hard_ttl:
+                    self._entries.move_to_end(key)
+                    if age < entry.soft_ttl:
+                        self._count(name, 'hits')
+                    else:
+                        self._count(name, 'stale_hits')
+                        if not entry.refreshing:
+                            entry.refreshing = True
+                            self._count(name, 'refreshes')
+                            self._get_executor().submit(self._refresh, key, loader, soft_ttl, hard_ttl)
+                    return entry.value
+
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    self._count(name, 'misses')
+                    break
+
+            # someone else is loading it, wait for them and look again.
+            loading.wait()
+
+        try:
+            value = loader()
+            self._store(key, value, soft_ttl, hard_ttl)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            loading.set()
+
+    def invalidate(self, name=None):
+        """
+        Drop cached results for a query name, or everything.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if name is None or k[0] == name]:
+                self._drop(key)
+
+    def stats(self):
+        """
+        :return: per query name counters, plus the current entries/rows/bytes held for it.
+        """
+        with self._lock:
+            stats = {name: dict(counts, entries=0, rows=0, bytes=0) for name, counts in self._stats.items()}
+            for (name, _), entry in self._entries.items():
+                held = stats.setdefault(name, {'entries': 0, 'rows': 0, 'bytes': 0})
+                held['entries'] += 1
+                held['rows'] += entry.rows
+                held['bytes'] += entry.nbytes
+            return {
+                'rows': self._rows,
+                'bytes': self._bytes,
+                'max_rows': self.max_rows,
+                'max_bytes': self.max_bytes,
+                'queries': stats,
+            }
+
+    def _refresh(self, key, loader, soft_ttl, hard_ttl):
+        try:
+            value = loader()
+        except Exception as e:
+            logger.error(f'Error refreshing cached query {key[0]}: {e}')
+            with self._lock:
+                self._count(key[0], 'refresh_errors')
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False  # try again on the next stale hit.
+            return
+        self._store(key, value, soft_ttl, hard_ttl)
+
+    def _store(self, key, value, soft_ttl, hard_ttl):
+        entry = CacheEntry(value, soft_ttl, hard_ttl)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if entry.rows > self.max_rows or entry.nbytes > self.max_bytes:
+                self._count(key[0], 'too_large')
+                return
+            self._entries[key] = entry
+            self._rows += entry.rows
+            self._bytes += entry.nbytes
+            while self._rows > self.max_rows or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._count(oldest[0], 'evictions')
+                self._drop(oldest)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._rows -= entry.rows
+        self._bytes -= entry.nbytes
+
+    def _count(self, name, counter):
+        counts = self._stats.get(name)
+        if counts is None:
+            counts = self._stats[name] = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0,
+                                          'refresh_errors': 0, 'evictions': 0, 'too_large': 0}
+        counts[counter] += 1
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._refresh_workers or settings.QUERY_CACHE_REFRESH_WORKERS,
+                                                thread_name_prefix='query-refresh')
+        return self._executor
+
+
+query_cache = QueryCache()
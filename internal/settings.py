@@ -9,16 +9,94 @@ BASE_PATH = utils.get_project_root()
 DATA_PATH = os.path.join(BASE_PATH, "data")
 STATS_PATH = DATA_PATH
 STATS_FILENAME = "api_stats.json"
+STATS_FLUSH_INTERVAL = 30  # seconds between stats writes
+METRICS_KEEP_RUNS = 20  # labor runs kept for /actfast/pipeline/runs
 
 
 
 LABOR_REFRESH_INTERVAL = 5 * 60  # 5 minutes
+# At startup serve the last persisted snapshot right away, then warm the shift cache and refresh in the background.
+LABOR_WARM_START = True
+
+# Labor engine for GetLaborDtlData. 'vectorized' (laborEngine, LABOR_SLOT_SECONDS slots), 'exact' (laborEngine sweep,
+# no slots, no rounding to slot edges) or 'legacy' (the original per-slot loop).
+# python -m app.benchmarks.engines compares them.
+LABOR_ENGINE = 'vectorized'
+LABOR_SLOT_SECONDS = 5 * 60
+
+# Keep today's labor between runs and only refetch LaborDtl rows that changed (SysRevID watermark) or are still active.
+# A full recompute still runs at day rollover, on demand, and on this interval.
+LABOR_INCREMENTAL = True
+LABOR_FULL_RECOMPUTE_INTERVAL = 60 * 60  # 1 hour
+
+# Memory budget for the labor run, resident MB (docker-compose limits the container to 200m). Checked after every
+# pipeline stage and before the slot matrix is allocated, going over logs a warning (see memoryBudget.py). 0 = off.
+LABOR_MEMORY_BUDGET_MB = 160
+
+# Labor history. Closed days are cached here as Parquet, one file per day.
+HISTORY_PATH = os.path.join(DATA_PATH, 'history')
+HISTORY_MAX_DAYS = 93  # longest range the history endpoint will compute
+# Backfill (laborBackfill). Epicor fetches run on BACKFILL_FETCH_WORKERS threads, the slot computation in
+# BACKFILL_PROCESSES processes. The container is limited to 1 cpu / 200m, raise the processes where there's room.
+BACKFILL_FETCH_WORKERS = 2
+BACKFILL_PROCESSES = 1
+BACKFILL_START_METHOD = 'spawn'  # don't fork the API process and its threads.
+BACKFILL_MAX_DAYS = 366
+
+# Exports stream rows in batches of this many, so memory stays flat however big the export is.
+EXPORT_BATCH_SIZE = 1000
+# Exports reading from Epicor hold a pooled connection until the client has read everything. At most this many run
+# at once (keep it below EPICORSQL_POOL_SIZE so the labor run always gets connections), past that they get a 503.
+EXPORT_MAX_CONCURRENT = 2
+
+# Labor snapshot versions kept in memory for /Epicor/Labor/ActiveLaborEfficiency/Delta. A client further behind
+# than this gets the full data back.
+SNAPSHOT_HISTORY = 50
+
+# Push (WebSocket/SSE) subscribers to new labor snapshots. Slow clients only ever get the latest snapshot, one that
+# can't take a message within PUSH_SEND_TIMEOUT seconds is disconnected. SSE sends a keepalive every PUSH_HEARTBEAT.
+PUSH_HEARTBEAT = 15
+PUSH_SEND_TIMEOUT = 10
+PUSH_MAX_SUBSCRIBERS = 500
+
+# Multi-worker mode: set this to uvicorn's --workers. With more than one, the worker holding SCHEDULER_LOCK_PATH runs
+# the labor job and shares each new snapshot through SHARED_SNAPSHOT_PATH (memory mapped), the others serve from it
+# (see workers.py). Every worker checks for a new snapshot, and for the lock (failover), every WORKER_POLL seconds.
+WORKERS = 1
+WORKER_POLL = 1.0
+WORKER_SCHEDULER_TIMEOUT = 30  # a worker reports unhealthy when the scheduler's heartbeat is older than this
+SCHEDULER_LOCK_PATH = os.path.join(DATA_PATH, 'scheduler.lock')
+SHARED_SNAPSHOT_PATH = os.path.join(DATA_PATH, 'labordata.mmap')
+
+# Where the queries run (see dataSource.py): 'epicor' (SQL Server, below) or 'sqlite' (a local file with the same
+# erp tables, for running without Epicor. Fill it with python -m app.benchmarks.synthetic --sqlite <path>).
+DATA_SOURCE = 'epicor'
+SQLITE_PATH = os.path.join(DATA_PATH, 'epicor.sqlite')
 
 EPICORSQL_SERVER = '<DBSERVER>'
 EPICORSQL_USER = '<DBUSER>
 EPICORSQL_PW = '<PASSWORD>'
 EPICORSQL_DB = '<DBNAME>'
 
+# Epicor connection pool
+EPICORSQL_POOL_SIZE = 5
+EPICORSQL_POOL_MAX_AGE = 30 * 60  # recycle connections after 30 minutes
+EPICORSQL_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+
+# The labor run's Epicor queries run side by side on this many threads, each with this timeout (seconds).
+QUERY_FANOUT_WORKERS = 5
+QUERY_TIMEOUT = 120
+
+# Query cache (see queryCache.QueryCache). Past the soft TTL cached rows are still served while they refresh in the
+# background, past the hard TTL the caller waits for a fresh load. (soft, hard) seconds per cache policy.
+QUERY_CACHE_TTL = (5 * 60, 15 * 60)  # QueryWrapper(cacheOn=True)
+QUERY_LONG_CACHE_TTL = (60 * 60, 4 * 60 * 60)  # QueryWrapper(longCache=True), shift data etc.
+# The cache lives in the API process, so it counts towards LABOR_MEMORY_BUDGET_MB (and the container's 200m). Keep
+# QUERY_CACHE_MAX_BYTES well under the budget, it's the bound that matters, the row limit is a backstop.
+QUERY_CACHE_MAX_ROWS = 500000
+QUERY_CACHE_MAX_BYTES = 24 * 1024 * 1024
+QUERY_CACHE_REFRESH_WORKERS = 2
+
 # Translate DeptCodes to OprSeq
 DEPT_TRANSLATE = {
     175: ['COR'],
@@ -0,0 +1,133 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+def slot_dectimes(grid):
+    """
+    Slot grid (seconds past midnight) as decimal hours. Same arithmetic as the legacy per-slot dectime,
+    so break boundaries compare identically.
+    """
+    return grid // 3600 + (grid % 3600 // 60) / 60 + (grid % 60) / 3600
+
+
+class ShiftCalendar:
+    """
+    Working masks per shift, built from JCShift + ShiftBrk rows.
+
+    Each Shift code gets one boolean mask over the slot grid, True while the shift is working and False
+    during lunch or a shift break (windows are inclusive on both ends, like isEmpOnBreak). Shift start/end
+    are not applied, labor outside the shift still counts.
+
+    Windows are rebuilt only when the shift data changes, masks are cached per slot grid.
+    """
+
+    # a handful of grids per shift data version is plenty, the grid only changes once per labor run.
+    MAX_GRIDS = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._shifts = pd.Index([])
+        self._emp_shift = pd.Series(dtype=object)
+        self._windows = (np.empty(0, dtype=np.intp), np.empty(0), np.empty(0))
+        self._masks = {}
+
+    def load(self, shiftdata):
+        """
+        Rebuild the shift windows if the shift data changed since the last load.
+        :param shiftdata: dataframe of shiftdata (see laborMagic.GetShiftData)
+        """
+        fingerprint = self.fingerprint(shiftdata)
+        if fingerprint == self._fingerprint:
+            return
+
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return
+
+            if shiftdata is None or shiftdata.empty:
+                shifts = pd.Index([])
+                emp_shift = pd.Series(dtype=object)
+                windows = (np.empty(0, dtype=np.intp), np.empty(0), np.empty(0))
+            else:
+                emp_shift = shiftdata.drop_duplicates(subset=['Empid']).set_index('Empid')['Shift']
+                shifts = pd.Index(shiftdata['Shift'].unique())
+
+                # one window per lunch and per shift break. None/NULL windows become NaN and never match.
+                rows = shiftdata.drop_duplicates(subset=['Shift', 'LunchStart', 'LunchEnd', 'BreakStart', 'BreakEnd'])
+                codes = shifts.get_indexer(rows['Shift'])
+                starts = np.concatenate([pd.to_numeric(rows['LunchStart'], errors='coerce').to_numpy(dtype=float),
+                                         pd.to_numeric(rows['BreakStart'], errors='coerce').to_numpy(dtype=float)])
+                ends = np.concatenate([pd.to_numeric(rows['LunchEnd'], errors='coerce').to_numpy(dtype=float),
+                                       pd.to_numeric(rows['BreakEnd'], errors='coerce').to_numpy(dtype=float)])
+                windows = (np.concatenate([codes, codes]), starts, ends)
+
+            self._shifts = shifts
+            self._emp_shift = emp_shift
+            self._windows = windows
+            self._masks = {}
+            self._fingerprint = fingerprint
+
+    def shift_masks(self, grid):
+        """
+        Working masks for every shift over a slot grid.
+        :param grid: slot grid, seconds past midnight
+        :return: bool array, one row per shift plus a trailing all-True row for emps without a shift.
+        """
+        key = (int(grid[0]), int(grid[-1]), len(grid)) if len(grid) else (0, 0, 0)
+        masks = self._masks.get(key)
+        if masks is not None:
+            return masks
+
+        codes, starts, ends = self._windows
+        dectimes = slot_dectimes(grid)
+        on_break = np.zeros((len(self._shifts) + 1, len(grid)), dtype=bool)
+        in_window = (starts[:, None] <= dectimes[None, :]) & (dectimes[None, :] <= ends[:, None])
+        np.logical_or.at(on_break, codes, in_window)
+        masks = ~on_break
+
+        with self._lock:
+            if len(self._masks) >= self.MAX_GRIDS:
+                self._masks.clear()
+            self._masks[key] = masks
+        return masks
+
+    def working_mask(self, shiftdata, emps, grid):
+        """
+        Working mask for a set of employees, one row per employee.
+        :param shiftdata: dataframe of shiftdata
+        :param emps: employee numbers
+        :param grid: slot grid, seconds past midnight
+        :return: bool array, shape (len(emps), len(grid)), False where the emp is on break or lunch.
+        """
+        self.load(shiftdata)
+        masks = self.shift_masks(grid)
+        # -1 (no shift on file) picks the trailing all-True row.
+        shift_codes = self._shifts.get_indexer(self._emp_shift.reindex(emps))
+        return masks[shift_codes]
+
+    def break_windows(self, shiftdata, emps):
+        """
+        Lunch and break windows for a set of employees, for the exact engine.
+        :param shiftdata: dataframe of shiftdata
+        :param emps: employee numbers
+        :return: (emp positions, starts, ends), one entry per window, times in decimal hours. Emps without a shift
+            on file have no windows.
+        """
+        self.load(shiftdata)
+        codes, starts, ends = self._windows
+        shift_codes = self._shifts.get_indexer(self._emp_shift.reindex(emps))
+        valid = ~(np.isnan(starts) | np.isnan(ends))
+        emp_pos, window = np.nonzero((shift_codes[:, None] == codes[None, :]) & valid[None, :])
+        return emp_pos, starts[window], ends[window]
+
+    @staticmethod
+    def fingerprint(shiftdata):
+        if shiftdata is None or shiftdata.empty:
+            return 0
+        cols = [c for c in ('Empid', 'Shift', 'LunchStart', 'LunchEnd', 'BreakStart', 'BreakEnd') if c in shiftdata]
+        return (len(shiftdata), int(pd.util.hash_pandas_object(shiftdata[cols], index=False).sum()))
+
+
+shift_calendar = ShiftCalendar()
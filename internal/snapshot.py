@@ -0,0 +1,408 @@
+import os
+import json
+import hashlib
+import pickle
+import tempfile
+import threading
+import time
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping
+from pydantic import ValidationError
+from app.internal import settings
+from app.internal.models import ActiveLaborData
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_pickle(path, obj):
+    """
+    Pickle obj to path without ever leaving a half written file behind.
+    Writes a temp file in the same dir, fsyncs it, then renames it over the old file.
+    :param path: file path
+    :param obj: object to pickle
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmppath, path)
+    except BaseException:
+        try:
+            os.remove(tmppath)
+        except OSError:
+            pass
+        raise
+
+    # make the rename itself durable.
+    try:
+        dirfd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+    except OSError:
+        pass
+
+
+def get_emps_not_clocked():
+    """
+    Emps not clocked into a job as of the last labor run, see laborMagic.labormagic.
+    :return: list of dicts, or None if there's no data yet
+    """
+    try:
+        with open(emps_not_clocked_file, 'rb') as f:
+            data = pickle.load(f)
+        return data
+    except:
+        return None
+
+
+class Record(Mapping):
+    """
+    A read only snapshot row with __slots__ instead of a __dict__. Reads like the dict it replaces (record['JobNum'],
+    record.get('OprSeq'), dict(record)) so the routers, diffs and models take either. Subclasses list the fields
+    in __slots__.
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return (name for name in self.__slots__ if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{type(self).__name__} is read only')
+
+    def __delattr__(self, key):
+        raise AttributeError(f'{type(self).__name__} is read only')
+
+    def __reduce__(self):
+        return _make_record, (type(self), dict(self))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+def _make_record(cls, fields):
+    return cls(**fields)
+
+
+class ActiveLaborRecord(Record):
+    """
+    One active labor row of a snapshot, see laborMagic.assembleActiveLabor.
+    """
+    __slots__ = ('OprSeq', 'JobNum', 'PartNum', 'Standard', 'PrevHrs', 'ActiveLabor', 'Efficiency', 'Emps')
+
+
+def _json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    return str(value)
+
+
+LABOR_KEY = ('OprSeq', 'JobNum')
+EMPS_KEY = ('employeenum',)
+
+
+def split_partitions(data):
+    """
+    Split labor data by OprSeq. Covers every OprSeq in settings.DEPT_TRANSLATE plus any other OprSeq in the data.
+    :param data: labor data dict
+    :return: dict of oprseq -> (active_labor records, empsnotclocked records)
+    """
+    if not data or 'active_labor' not in data:
+        return {}
+
+    partitions = {oprseq: ([], []) for oprseq in settings.DEPT_TRANSLATE}
+    for record in data['active_labor']:
+        partitions.setdefault(record.get('OprSeq'), ([], []))[0].append(record)
+    for item in data.get('empsnotclocked', []):
+        partitions.setdefault(item.get('OprSeq'), ([], []))[1].append(item)
+    partitions.pop(None, None)
+    return partitions
+
+
+def content_hash(partition):
+    """
+    Hash of a partition's records. Leaves out the run's timestamp and execution time, so it only changes when the
+    labor itself does.
+    """
+    return hashlib.blake2b(json.dumps(partition, sort_keys=True, default=_json_default).encode(), digest_size=16).hexdigest()
+
+
+def render_partition(oprseq, partition, data):
+    """
+    Pre-render the ActiveLaborEfficiency response for one OprSeq, so requests can send the bytes as is.
+    :return: (json bytes, etag), or None if the data doesn't validate
+    """
+    active_labor, empsnotclocked = partition
+    try:
+        body = ActiveLaborData.model_validate({
+            "active_labor": active_labor,
+            "empsnotclocked": empsnotclocked,
+            "oprseq": oprseq,
+            "timestamp": data.get('timestamp'),
+            "executiontime": data.get('executiontime'),
+        }).model_dump_json().encode()
+    except ValidationError as e:
+        logger.error(f'Error rendering labor data for OprSeq {oprseq}: {e}')
+        return None
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return body, etag
+
+
+def diff_records(old, new, key):
+    """
+    Record level diff, records are matched on their key fields.
+    :return: dict of added (records), removed (keys) and changed (keys + the fields that changed, new values)
+    """
+    old = {tuple(record.get(field) for field in key): record for record in old}
+    new = {tuple(record.get(field) for field in key): record for record in new}
+    added = [record for k, record in new.items() if k not in old]
+    removed = [dict(zip(key, k)) for k in old if k not in new]
+    changed = []
+    for k, record in new.items():
+        before = old.get(k)
+        if before is None or before == record:
+            continue
+        fields = {field: value for field, value in record.items() if before.get(field) != value}
+        changed.append({**dict(zip(key, k)), 'fields': fields})
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def diff_partition(old, new):
+    """
+    :param old: (active_labor, empsnotclocked), or None
+    :param new: (active_labor, empsnotclocked), or None
+    :return: dict of active_labor and empsnotclocked diffs, see diff_records
+    """
+    old = old or ([], [])
+    new = new or ([], [])
+    return {
+        'active_labor': diff_records(old[0], new[0], LABOR_KEY),
+        'empsnotclocked': diff_records(old[1], new[1], EMPS_KEY),
+    }
+
+
+class LaborSnapshot:
+    """
+    One published set of labor data. Never changed after it's published, a new run publishes a new snapshot.
+
+    partitions is the data split by OprSeq and hashes their content hashes. responses holds the pre-rendered
+    ActiveLaborEfficiency response per OprSeq, a partition whose hash matches the previous snapshot reuses the
+    previous response instead of rendering it again (so its timestamp is the run that last changed it). changes is
+    the record level diff against the previous snapshot for the OprSeqs that changed.
+
+    version is the content version, it only moves when some partition changed.
+    """
+    __slots__ = ('data', 'version', 'published', 'partitions', 'hashes', 'responses', 'changes')
+
+    def __init__(self, data, version, published=None, previous=None):
+        object.__setattr__(self, 'data', data)
+        object.__setattr__(self, 'published', published if published is not None else time.time())
+
+        partitions = split_partitions(data)
+        hashes = {oprseq: content_hash(partition) for oprseq, partition in partitions.items()}
+        previous_hashes = previous.hashes if previous is not None else {}
+        responses = {}
+        changes = {}
+        for oprseq, partition in partitions.items():
+            if previous is not None and previous_hashes.get(oprseq) == hashes[oprseq] and oprseq in previous.responses:
+                responses[oprseq] = previous.responses[oprseq]
+                continue
+            rendered = render_partition(oprseq, partition, data)
+            if rendered is not None:
+                responses[oprseq] = rendered
+            if previous is not None:
+                changes[oprseq] = diff_partition(previous.partitions.get(oprseq), partition)
+        if previous is not None:
+            for oprseq in previous_hashes.keys() - hashes.keys():
+                changes[oprseq] = diff_partition(previous.partitions.get(oprseq), None)
+            if not changes:
+                version = previous.version
+
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'partitions', partitions)
+        object.__setattr__(self, 'hashes', hashes)
+        object.__setattr__(self, 'responses', responses)
+        object.__setattr__(self, 'changes', changes)
+
+    def state(self):
+        """
+        :return: dict of everything in the snapshot, for handing it to another process (see workers.SharedSnapshot)
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild a snapshot from state(), as is. Nothing is rendered or diffed again.
+        """
+        snapshot = object.__new__(cls)
+        for name in cls.__slots__:
+            object.__setattr__(snapshot, name, state[name])
+        return snapshot
+
+    def __setattr__(self, key, value):
+        raise AttributeError('LaborSnapshot is read only')
+
+    def __delattr__(self, key):
+        raise AttributeError('LaborSnapshot is read only')
+
+
+class SnapshotStore:
+    """
+    Holds the current labor snapshot in memory.
+
+    The labor job publishes by swapping the reference to a new snapshot, readers just grab the current one, so a
+    reader never sees a half built snapshot and never touches disk. The snapshot is also persisted (atomically) so
+    it survives a restart, unless nothing in it changed. The last settings.SNAPSHOT_HISTORY versions are kept for
+    deltas.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._snapshot = None
+        self._restored = False
+        self._lock = threading.Lock()  # publishers only, readers don't lock.
+        self._listeners = []
+        self._history = OrderedDict()  # version -> snapshot
+
+    def add_listener(self, listener):
+        """
+        Call listener(snapshot) after every publish, on the publishing thread. Keep it quick, it holds up the run.
+        Restoring from disk doesn't notify.
+        """
+        self._listeners.append(listener)
+
+    def current(self):
+        """
+        :return: current LaborSnapshot, or None if nothing's been published yet.
+        """
+        snapshot = self._snapshot
+        if snapshot is None and not self._restored:
+            # first read after a restart, pick up whatever was persisted last.
+            snapshot = self.restore()
+        return snapshot
+
+    def publish(self, data, persist=True):
+        """
+        Publish new labor data.
+        :param data: labor data dict. Don't change it after publishing.
+        :param persist: also write it to disk, skipped when nothing changed since the last snapshot
+        :return: the new snapshot
+        """
+        with self._lock:
+            current = self._snapshot
+            snapshot = LaborSnapshot(data, current.version + 1 if current is not None else 1, previous=current)
+            self._snapshot = snapshot
+            self._remember(snapshot)
+
+            if persist and (current is None or snapshot.version != current.version):
+                try:
+                    atomic_pickle(self.path, {'version': snapshot.version, 'data': data})
+                except Exception as e:
+                    logger.error(f'Error persisting labor snapshot: {e}')
+
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f'Error notifying labor snapshot listener: {e}')
+
+        return snapshot
+
+    def adopt(self, snapshot):
+        """
+        Make a snapshot published by another process the current one (multi-worker mode, see workers.py). Listeners
+        are notified, it's not persisted again.
+        :param snapshot: LaborSnapshot
+        """
+        with self._lock:
+            self._snapshot = snapshot
+            self._restored = True
+            self._remember(snapshot)
+
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f'Error notifying labor snapshot listener: {e}')
+
+    def delta(self, oprseq, since):
+        """
+        What changed for an OprSeq since a version.
+        :param oprseq: operation sequence
+        :param since: content version the client has
+        :return: (snapshot, diff, full), or (None, None, None) if there's no data. full is True when since is too old
+            (or unknown) to diff against, the diff then adds every current record and the client should start over.
+        """
+        snapshot = self.current()
+        if snapshot is None:
+            return None, None, None
+        partition = snapshot.partitions.get(oprseq)
+        if since == snapshot.version:
+            return snapshot, diff_partition(partition, partition), False
+
+        base = self._history.get(since)
+        if base is None:
+            return snapshot, diff_partition(None, partition), True
+        if since == snapshot.version - 1 and oprseq in snapshot.changes:
+            return snapshot, snapshot.changes[oprseq], False
+        if base.hashes.get(oprseq) == snapshot.hashes.get(oprseq):
+            return snapshot, diff_partition(partition, partition), False
+        return snapshot, diff_partition(base.partitions.get(oprseq), partition), False
+
+    def _remember(self, snapshot):
+        self._history[snapshot.version] = snapshot
+        self._history.move_to_end(snapshot.version)
+        while len(self._history) > settings.SNAPSHOT_HISTORY:
+            self._history.popitem(last=False)
+
+    def restore(self):
+        """
+        Load the last persisted snapshot from disk, if there is one.
+        :return: the restored snapshot or None
+        """
+        self._restored = True
+        try:
+            with open(self.path, 'rb') as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f'Error restoring labor snapshot: {e}')
+            return None
+
+        # older files are just the data dict.
+        if isinstance(saved, dict) and 'version' in saved and 'data' in saved:
+            version, data = saved['version'], saved['data']
+        else:
+            version, data = 0, saved
+
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = LaborSnapshot(data, version)
+                self._remember(self._snapshot)
+            return self._snapshot
+
+
+labor_snapshots = SnapshotStore(os.path.join(settings.DATA_PATH, 'labordata.pkl'))
+emps_not_clocked_file = os.path.join(settings.DATA_PATH, 'empsnotclocked.pkl')
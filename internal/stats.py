@@ -1,64 +1,316 @@
 import os
 import time
+import tempfile
+import atexit
+import threading
+import logging
 from datetime import datetime
 import inspect
 import json
 
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from functools import wraps
+from app.internal import settings
 
+logger = logging.getLogger(__name__)
 
 
+class LatencyHistogram:
+    """
+    Fixed bucket latency histogram. Cheap to update, good enough for p50/p95/p99.
+    """
+
+    # bucket upper bounds, in seconds. The last bucket catches everything else.
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, float('inf'))
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts and len(counts) == len(self.BUCKETS) else [0] * len(self.BUCKETS)
+        self.total = sum(self.counts)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+
+    def merge(self, other):
+        """
+        Add another histogram's counts to this one.
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def percentile(self, q):
+        """
+        Estimate a percentile, interpolating inside the bucket it lands in.
+        :param q: percentile, 0-100
+        :return: seconds, or None if nothing's been observed
+        """
+        if self.total == 0:
+            return None
+        rank = q / 100 * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                upper = self.BUCKETS[i]
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.BUCKETS[-2]
+
+
+class StatsRegistry:
+    """
+    In-memory stats for every tracked endpoint, shared by everything that writes the same stats file.
+
+    Tracked calls only touch memory. The stats are flushed to disk in the background every
+    settings.STATS_FLUSH_INTERVAL seconds (and at exit) when something changed.
+
+    In multi-worker mode (settings.WORKERS > 1) each worker flushes to its own file, see claim_worker_file, and
+    report adds up every worker's stats.
+    """
+
+    def __init__(self, filepath, flush_interval=None):
+        self.basepath = filepath
+        self._slot_lock = None
+        if settings.WORKERS > 1:
+            filepath, self._slot_lock = claim_worker_file(filepath)
+        self.filepath = filepath
+        self.flush_interval = flush_interval if flush_interval is not None else settings.STATS_FLUSH_INTERVAL
+        self.start_date = datetime.now()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flusher = None
+        self.stats = {}
+        self.histograms = {}
+        self.load()
+        atexit.register(self.flush)
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.error(f'Error loading stats: {e}')
+            return
+
+        with self._lock:
+            for endpoint, entry in saved.items():
+                counts = entry.pop('histogram', None)
+                self.stats[endpoint] = entry
+                self.histograms[endpoint] = LatencyHistogram(counts)
+
+    def update(self, endpoint_name, execution_time):
+        with self._lock:
+            entry = self.stats.get(endpoint_name)
+            if entry is None:
+                entry = self.stats[endpoint_name] = {
+                    'count': 0,
+                    'min_time': float('inf'),
+                    'max_time': 0,
+                    'last_time': None
+                }
+                self.histograms[endpoint_name] = LatencyHistogram()
+            entry['count'] += 1
+            entry['last_time'] = execution_time
+            entry['min_time'] = min(entry['min_time'], execution_time)
+            entry['max_time'] = max(entry['max_time'], execution_time)
+            self.histograms[endpoint_name].observe(execution_time)
+            self._dirty = True
+
+        if self._flusher is None:
+            self._start_flusher()
+
+    def report(self):
+        """
+        :return: stats per endpoint with p50/p95/p99, times rounded to 3 decimal places. In multi-worker mode, every
+            worker's stats added up (the others as of their last flush), last_time is this worker's.
+        """
+        with self._lock:
+            combined = {endpoint: (dict(entry), LatencyHistogram(self.histograms[endpoint].counts))
+                        for endpoint, entry in self.stats.items()}
+
+        for saved in self._other_workers():
+            for endpoint, entry in saved.items():
+                histogram = LatencyHistogram(entry.pop('histogram', None))
+                if endpoint not in combined:
+                    combined[endpoint] = (entry, histogram)
+                    continue
+                merged, merged_histogram = combined[endpoint]
+                merged['count'] += entry['count']
+                merged['min_time'] = min(merged['min_time'], entry['min_time'])
+                merged['max_time'] = max(merged['max_time'], entry['max_time'])
+                if merged['last_time'] is None:
+                    merged['last_time'] = entry['last_time']
+                merged_histogram.merge(histogram)
+
+        report = {}
+        for endpoint, (entry, histogram) in combined.items():
+            for q in (50, 95, 99):
+                entry[f'p{q}'] = histogram.percentile(q)
+            for key in ('min_time', 'max_time', 'last_time', 'p50', 'p95', 'p99'):
+                if entry[key] is not None:
+                    entry[key] = round(entry[key], 3)
+            report[endpoint] = entry
+        return report
+
+    def _other_workers(self):
+        """
+        :return: the saved stats of the other workers, multi-worker mode only
+        """
+        if self.filepath == self.basepath:
+            return []
+        directory = os.path.dirname(self.basepath) or '.'
+        root, ext = os.path.splitext(os.path.basename(self.basepath))
+        others = []
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        for name in names:
+            path = os.path.join(directory, name)
+            if not name.startswith(root + '.worker') or not name.endswith(ext) or path == self.filepath:
+                continue
+            try:
+                with open(path, 'r') as f:
+                    others.append(json.load(f))
+            except Exception as e:
+                logger.debug(f'Error reading worker stats {name}: {e}')
+        return others
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.histograms = {}
+            self._dirty = True
+        self.flush()
+
+    def flush(self):
+        """
+        Write the stats to disk if anything changed. Temp file (uniquely named, see snapshot.atomic_pickle) + rename
+        so readers never see a partial file.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            saved = {endpoint: dict(entry, histogram=list(self.histograms[endpoint].counts))
+                     for endpoint, entry in self.stats.items()}
+            self._dirty = False
+
+        tmppath = None
+        try:
+            directory = os.path.dirname(self.filepath) or '.'
+            fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.filepath) + '.',
+                                           suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmppath, self.filepath)
+        except Exception as e:
+            logger.error(f'Error saving stats: {e}')
+            if tmppath is not None:
+                try:
+                    os.remove(tmppath)
+                except OSError:
+                    pass
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='stats-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+def claim_worker_file(filepath):
+    """
+    Multi-worker mode: each worker keeps its stats in its own file, <name>.worker<slot><ext>, so no worker writes over
+    another's counts. A worker claims the first slot whose lock file it can lock, the OS frees it when the worker
+    exits. A restarted worker carries on from its slot's counts and there are never more than settings.WORKERS files.
+    :param filepath: the stats file
+    :return: (this worker's stats file, the slot's lock, or None when every slot was taken)
+    """
+    from app.internal.workers import SchedulerLock
+
+    root, ext = os.path.splitext(filepath)
+    for slot in range(settings.WORKERS):
+        lock = SchedulerLock(f'{root}.worker{slot}.lock')
+        try:
+            if lock.acquire():
+                return f'{root}.worker{slot}{ext}', lock
+        except OSError as e:
+            logger.error(f'Error claiming stats slot {slot}: {e}')
+            break
+    # a worker from before a restart still holds its slot, use a file of our own.
+    return f'{root}.worker-{os.getpid()}{ext}', None
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(filepath):
+    """
+    The shared stats registry for a stats file.
+    """
+    filepath = os.path.abspath(filepath)
+    with _registries_lock:
+        registry = _registries.get(filepath)
+        if registry is None:
+            registry = _registries[filepath] = StatsRegistry(filepath)
+        return registry
 
 
 class StatsManager:
     def __init__(self, filepath):
         self.filepath = filepath
-        self.stats = self.load_stats()
-        self.start_date = datetime.now()
+        self.registry = get_registry(filepath)
+        self.start_date = self.registry.start_date
 
-    def get_stats(self):
-        self.stats = self.load_stats()
-        # round all the stats to 3 decimal places
-        for endpoint in self.stats:
-            self.stats[endpoint]['min_time'] = round(self.stats[endpoint]['min_time'], 3)
-            self.stats[endpoint]['max_time'] = round(self.stats[endpoint]['max_time'], 3)
-            self.stats[endpoint]['last_time'] = round(self.stats[endpoint]['last_time'], 3)
+    @property
+    def stats(self):
+        return self.registry.stats
 
+    def get_stats(self):
         return {
             'start_date': self.start_date,
-            'stats': self.stats
+            'stats': self.registry.report()
         }
 
     def reset_stats(self):
-        self.stats = {}
-        self.save_stats()
+        self.registry.reset()
 
     def get_start_date(self):
         return self.start_date
 
     def load_stats(self):
-        if os.path.exists(self.filepath):
-            with open(self.filepath, 'r') as f:
-                return json.load(f)
-        return {}
+        return self.registry.report()
 
     def save_stats(self):
-        # if the file doesn't exist, create it
-        if not os.path.exists(self.filepath):
-            with open(self.filepath, 'w') as f:
-                f.write('{}')
-        with open(self.filepath, 'w') as f:
-            json.dump(self.stats, f)
+        self.registry.flush()
 
 
     def track_stats(self, endpoint_name):
+        # a streamed response (exports) is timed until its body has been sent, not just until it's built.
         def decorator(func):
             if inspect.iscoroutinefunction(func):
                 @wraps(func)
                 async def async_wrapper(*args, **kwargs):
                     start_time = time.time()
                     response = await func(*args, **kwargs)
+                    if isinstance(response, StreamingResponse):
+                        return self._track_stream(response, endpoint_name, start_time)
                     execution_time = time.time() - start_time
                     self.update_stats(endpoint_name, execution_time)
                     return response
@@ -68,28 +320,26 @@ class StatsManager:
                 def sync_wrapper(*args, **kwargs):
                     start_time = time.time()
                     response = func(*args, **kwargs)
+                    if isinstance(response, StreamingResponse):
+                        return self._track_stream(response, endpoint_name, start_time)
                     execution_time = time.time() - start_time
                     self.update_stats(endpoint_name, execution_time)
                     return response
                 return sync_wrapper
         return decorator
 
-    def update_stats(self, endpoint_name, execution_time):
-        self.stats = self.load_stats()
-        if endpoint_name not in self.stats:
-            self.stats[endpoint_name] = {
-                'count': 0,
-                'min_time': float('inf'),
-                'max_time': 0,
-                'last_time': None
-            }
-        self.stats[endpoint_name]['count'] += 1
-        self.stats[endpoint_name]['last_time'] = execution_time
-        self.stats[endpoint_name]['min_time'] = min(self.stats[endpoint_name]['min_time'], execution_time)
-        self.stats[endpoint_name]['max_time'] = max(self.stats[endpoint_name]['max_time'], execution_time)
-        self.save_stats()
-
-
+    def _track_stream(self, response, endpoint_name, start_time):
+        body = response.body_iterator
 
+        async def timed_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                self.update_stats(endpoint_name, time.time() - start_time)
 
+        response.body_iterator = timed_body()
+        return response
 
+    def update_stats(self, endpoint_name, execution_time):
+        self.registry.update(endpoint_name, execution_time)
@@ -1,82 +1,333 @@
 
-import pymssql
 import time
-import cachetools
+import threading
+import logging
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from app.internal import settings
+from app.internal.dataSource import get_data_source
+from app.internal.metrics import pipeline_metrics
+from app.internal.queryCache import query_cache
 
-UtilCache = cachetools.TTLCache(maxsize=100, ttl=300)
-LongCache = cachetools.TTLCache(maxsize=100, ttl=3600)
+logger = logging.getLogger(__name__)
 
 
 from pathlib import Path
 def get_project_root() -> Path:
     return Path(__file__).parent.parent
 
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe DB connection pool.
+
+    Connections are validated on checkout, recycled once they're older than max_age, and discarded if a query
+    on them fails. When all connections are in use, checkout waits up to timeout seconds.
+    """
+
+    def __init__(self, factory, maxsize=5, max_age=30 * 60, timeout=30, validate=None):
+        """
+        :param factory: callable returning a new connection
+        :param maxsize: max open connections
+        :param max_age: seconds before a connection is recycled
+        :param timeout: seconds to wait for a free connection
+        :param validate: callable(conn) -> bool, defaults to running SELECT 1
+        """
+        self.factory = factory
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.timeout = timeout
+        self.validate = validate or self._ping
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created)
+        self._created = {}  # id(conn) -> created, for connections that are checked out
+        self._size = 0
+        self._closed = False
+        self._stats = {'checkouts': 0, 'waits': 0, 'created': 0, 'discarded': 0, 'timeouts': 0}
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a with block. It's discarded if the block raises.
+        """
+        conn = self.checkout()
+        try:
+            yield conn
+        except Exception:
+            self.checkin(conn, discard=True)
+            raise
+        else:
+            self.checkin(conn)
+
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError('Connection pool is closed')
+                conn, created = None, None
+                if self._idle:
+                    conn, created = self._idle.pop()
+                elif self._size < self.maxsize:
+                    self._size += 1
+                else:
+                    self._stats['waits'] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        self._stats['timeouts'] += 1
+                        raise TimeoutError(f'No DB connection available after {self.timeout}s')
+                    continue
+
+            if conn is None:
+                # new connection, made outside the lock.
+                try:
+                    conn = self.factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created = time.monotonic()
+                with self._cond:
+                    self._stats['created'] += 1
+            elif time.monotonic() - created > self.max_age or not self.validate(conn):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+                self._created[id(conn)] = created
+            return conn
+
+    def checkin(self, conn, discard=False):
+        with self._cond:
+            created = self._created.pop(id(conn), None)
+            closed = self._closed
+        if created is None:
+            # not checked out from this pool, or already checked in. It was never counted, so leave the size alone.
+            logger.warning('Checkin of a connection the pool did not hand out, closing it.')
+            self._close(conn)
+            return
+        if discard or closed or time.monotonic() - created > self.max_age:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created))
+            self._cond.notify()
+
+    def metrics(self):
+        with self._cond:
+            return dict(self._stats, size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle),
+                        maxsize=self.maxsize)
+
+    def close(self):
+        """
+        Close the idle connections. Checked out connections are closed when they come back, and checkout raises from
+        now on.
+        """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._stats['discarded'] += len(idle)
+            self._cond.notify_all()  # waiting checkouts fail now instead of at their timeout.
+        for conn, created in idle:
+            self._close(conn)
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f'Error closing DB connection: {e}')
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+
+_data_source = None
+_epicor_pool = None
+_epicor_pool_lock = threading.Lock()
+_fanout_executor = None
+
+
+def get_source():
+    """
+    The data source queries run against (settings.DATA_SOURCE, see dataSource.py). Picked on first use.
+    """
+    global _data_source
+    if _data_source is None:
+        with _epicor_pool_lock:
+            if _data_source is None:
+                _data_source = get_data_source()
+                logger.info(f'Data source: {_data_source.name}')
+    return _data_source
+
+
+def get_epicor_pool():
+    """
+    Shared Epicor connection pool, connections come from the data source. Created on first use, settings imports
+    this module so it can't be built at import.
+    """
+    global _epicor_pool
+    if _epicor_pool is None:
+        source = get_source()
+        with _epicor_pool_lock:
+            if _epicor_pool is None:
+                _epicor_pool = ConnectionPool(source.connect,
+                                              maxsize=settings.EPICORSQL_POOL_SIZE,
+                                              max_age=settings.EPICORSQL_POOL_MAX_AGE,
+                                              timeout=settings.EPICORSQL_POOL_TIMEOUT)
+    return _epicor_pool
+
+
+def get_fanout_executor():
+    """
+    Shared thread pool for running independent queries side by side.
+    """
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _epicor_pool_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(max_workers=settings.QUERY_FANOUT_WORKERS,
+                                                      thread_name_prefix='query-fanout')
+    return _fanout_executor
+
+
 class InsightUtils:
     @staticmethod
-    def QueryWrapper(query, name='', cacheOn=False, longCache=False):
+    def FanOut(tasks, timeout=None):
+        """
+        Run independent tasks (usually queries) at the same time.
+        :param tasks: dict of name -> callable
+        :param timeout: seconds to wait for each task. They all start together, so this is measured from the start.
+        :return: (results, timings), dicts of name -> result and name -> seconds
         """
-        Wrapper for querying Epicor SQL Server
+        timings = {}
+
+        def timed(name, func):
+            starttime = time.time()
+            try:
+                return func()
+            finally:
+                timings[name] = time.time() - starttime
+
+        starttime = time.time()
+        executor = get_fanout_executor()
+        # each task runs in a copy of the caller's context, so its spans count towards the caller's labor run.
+        futures = {name: executor.submit(contextvars.copy_context().run, timed, name, func)
+                   for name, func in tasks.items()}
+
+        results = {}
+        try:
+            for name, future in futures.items():
+                remaining = None if timeout is None else max(0.0, starttime + timeout - time.time())
+                try:
+                    results[name] = future.result(timeout=remaining)
+                except FutureTimeoutError:
+                    raise TimeoutError(f'Query {name} timed out after {timeout}s')
+        finally:
+            # don't leave anything queued behind a failed task.
+            for future in futures.values():
+                future.cancel()
+
+        logger.debug('Fan out: ' + ', '.join(f'{name} {secs:.2f}s' for name, secs in timings.items()))
+        return results, timings
+
+    @staticmethod
+    def QueryStream(query, name='', params=None, batch_size=None):
+        """
+        Stream a query's rows in batches with fetchmany, for results too big to hold in memory at once.
+        Holds a pooled connection until the rows are all read. If the caller stops early (client went away, etc.)
+        the connection still has results pending, so it's discarded instead of going back to the pool.
         :param query: query string
         :param name: name the query for logging
-        :param cacheOn: regular cache, default ttl 300s
-        :param longCache: long cache, default ttl 3600s (1hr)
-        :return: data
+        :param params: bound parameters for the query
+        :param batch_size: rows per batch, default settings.EXPORT_BATCH_SIZE
+        :return: generator of row batches (lists of dicts)
         """
+        batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+        source = get_source()
+        query, params = source.prepare(query, params)
+        pool = get_epicor_pool()
+        conn = pool.checkout()
+        finished = False
+        try:
+            with pipeline_metrics.span(f'query.{name or "unnamed"}.stream') as span:
+                span.rows = 0
+                cursor = source.cursor(conn)
+                try:
+                    if params is None:
+                        cursor.execute(query)
+                    else:
+                        cursor.execute(query, params)
+                    while True:
+                        batch = cursor.fetchmany(batch_size)
+                        if not batch:
+                            break
+                        span.rows += len(batch)
+                        yield batch
+                    finished = True
+                finally:
+                    try:
+                        cursor.close()
+                    except Exception as e:
+                        logger.debug(f'Error closing cursor: {e}')
+        finally:
+            pool.checkin(conn, discard=not finished)
 
-        @cachetools.cached(LongCache)
-        def longcachefetch(fquery, name):
-            """
-            Fetch data from Epicor SQL Server, using cache
-            :return:
-            """
-            conn = pymssql.connect(
-                settings.EPICORSQL_SERVER,
-                user=settings.EPICORSQL_USER,
-                password=settings.EPICORSQL_PW,
-                database=settings.EPICORSQL_DB
-            )
-            cursor = conn.cursor(as_dict=True)
-            cursor.execute(fquery)
-            data = cursor.fetchall()
-            return data
-
-        @cachetools.cached(UtilCache)
-        def cachefetch(fquery, name):
-            """
-            Fetch data from Epicor SQL Server, using cache
-            :return:
-            """
-            conn = pymssql.connect(
-                settings.EPICORSQL_SERVER,
-                user=settings.EPICORSQL_USER,
-                password=settings.EPICORSQL_PW,
-                database=settings.EPICORSQL_DB
-            )
-            cursor = conn.cursor(as_dict=True)
-            cursor.execute(fquery)
-            data = cursor.fetchall()
-            return data
+    @staticmethod
+    def QueryWrapper(query, name='', cacheOn=False, longCache=False, params=None):
+        """
+        Wrapper for querying Epicor SQL Server (or whichever data source settings.DATA_SOURCE picks)
+        :param query: query string
+        :param name: name the query for logging and caching. A named query should always be the same SQL text.
+        :param cacheOn: regular cache, served fresh for settings.QUERY_CACHE_TTL[0] seconds, stale (while it refreshes) up to [1]
+        :param longCache: long cache, settings.QUERY_LONG_CACHE_TTL, for data that rarely changes
+        :param params: bound parameters for the query (%s / %d placeholders), part of the cache key
+        :return: data
+        """
 
-        def fetch(fquery, name):
-            conn = pymssql.connect(
-                settings.EPICORSQL_SERVER,
-                user=settings.EPICORSQL_USER,
-                password=settings.EPICORSQL_PW,
-                database=settings.EPICORSQL_DB
-            )
-            cursor = conn.cursor(as_dict=True)
-            cursor.execute(fquery)
-            data = cursor.fetchall()
+        def fetch():
+            source = get_source()
+            statement, bound = source.prepare(query, params)
+            with pipeline_metrics.span(f'query.{name or "unnamed"}') as span:
+                with get_epicor_pool().connection() as conn:
+                    cursor = source.cursor(conn)
+                    try:
+                        if bound is None:
+                            cursor.execute(statement)
+                        else:
+                            cursor.execute(statement, bound)
+                        data = cursor.fetchall()
+                    finally:
+                        cursor.close()
+                span.rows = len(data)
             return data
 
-        if cacheOn:
-            data = cachefetch(query,name)
-        elif longCache:
-            data = longcachefetch(query,name)
+        if cacheOn or longCache:
+            soft_ttl, hard_ttl = settings.QUERY_CACHE_TTL if cacheOn else settings.QUERY_LONG_CACHE_TTL
+            # unnamed queries are keyed on their SQL text.
+            data = query_cache.get(name or query, params, fetch, soft_ttl, hard_ttl)
         else:
-            data = fetch(query,name)
+            data = fetch()
 
         return data
-
-
@@ -0,0 +1,371 @@
+import os
+import mmap
+import json
+import time
+import uuid
+import pickle
+import struct
+import threading
+import logging
+from app.internal import settings
+from app.internal.snapshot import LaborSnapshot, labor_snapshots
+
+try:
+    import fcntl
+except ImportError:  # Windows, no flock. Run one worker there, every worker would take the scheduler role.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SharedSnapshot:
+    """
+    The current labor snapshot in a memory mapped file, written by the scheduler worker and read by the others.
+
+    The file is a fixed header and a pickled LaborSnapshot.state(). The header holds a sequence number that's odd
+    while the payload is being written (a seqlock), the snapshot version, the payload length, and the scheduler's
+    pid and heartbeat. Readers check the version in the header, which is just a read from the mapping, and only
+    unpickle the payload when it moved. A read that overlaps a write sees the sequence change and tries again.
+
+    The file only grows, so a reader's mapping never points past the end of it.
+    """
+
+    MAGIC = b'ACTFSNAP'
+    HEADER = struct.Struct('<8sQQQqdd')  # magic, sequence, version, length, pid, heartbeat, published
+    HEADER_SIZE = 64
+    READ_ATTEMPTS = 50
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._map = None  # reader mapping
+        self._file = None  # writer file + mapping
+        self._write_map = None
+
+    # --- writer ---
+
+    def write(self, snapshot):
+        """
+        Publish a snapshot to the other workers.
+        """
+        payload = pickle.dumps(snapshot.state(), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            mm = self._writable(self.HEADER_SIZE + len(payload))
+            sequence = self._header(mm)[1]
+            sequence += 1 if sequence % 2 == 0 else 0  # odd: writing. A writer that died mid write left it odd.
+            self._set_header(mm, sequence, snapshot.version, len(payload), os.getpid(), time.time(),
+                             snapshot.published)
+            mm[self.HEADER_SIZE:self.HEADER_SIZE + len(payload)] = payload
+            self._set_header(mm, sequence + 1, snapshot.version, len(payload), os.getpid(), time.time(),
+                             snapshot.published)
+
+    def heartbeat(self):
+        """
+        Stamp the scheduler's pid and the time, so the other workers can tell it's alive.
+        """
+        with self._lock:
+            mm = self._writable(self.HEADER_SIZE)
+            _, sequence, version, length, _, _, published = self._header(mm)
+            self._set_header(mm, sequence, version, length, os.getpid(), time.time(), published)
+
+    def _writable(self, size):
+        if self._file is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file = os.fdopen(fd, 'r+b')
+        current = os.fstat(self._file.fileno()).st_size
+        if current < size:
+            # room to grow, so the next few snapshots don't resize it again.
+            os.ftruncate(self._file.fileno(), max(size + size // 2, mmap.PAGESIZE))
+            if self._write_map is not None:
+                self._write_map.close()
+                self._write_map = None
+        if self._write_map is None:
+            self._write_map = mmap.mmap(self._file.fileno(), 0)
+            if current == 0:
+                self._set_header(self._write_map, 0, 0, 0, 0, 0.0, 0.0)
+        return self._write_map
+
+    def _set_header(self, mm, sequence, version, length, pid, heartbeat, published):
+        self.HEADER.pack_into(mm, 0, self.MAGIC, sequence, version, length, pid, heartbeat, published)
+
+    # --- reader ---
+
+    def info(self):
+        """
+        :return: dict of version, pid and heartbeat from the header, or None if nothing's been written yet
+        """
+        with self._lock:
+            mm = self._readable()
+            if mm is None:
+                return None
+            magic, _, version, length, pid, heartbeat, published = self._header(mm)
+        if magic != self.MAGIC:
+            return None
+        return {'version': version if length else None, 'pid': pid, 'heartbeat': heartbeat, 'published': published}
+
+    def read(self):
+        """
+        :return: the LaborSnapshot in the file, or None if there isn't one (or it couldn't be read consistently)
+        """
+        for _ in range(self.READ_ATTEMPTS):
+            with self._lock:
+                mm = self._readable()
+                if mm is None:
+                    return None
+                magic, before, version, length, _, _, _ = self._header(mm)
+                if magic != self.MAGIC or not length:
+                    return None
+                if self.HEADER_SIZE + length > len(mm):
+                    self._remap()  # the file grew.
+                    continue
+                payload = mm[self.HEADER_SIZE:self.HEADER_SIZE + length] if before % 2 == 0 else None
+                after = self._header(mm)[1]
+            if payload is not None and before == after:
+                return LaborSnapshot.from_state(pickle.loads(payload))
+            time.sleep(0.01)  # mid write.
+        logger.warning(f'Could not read a consistent labor snapshot from {self.path}.')
+        return None
+
+    def _readable(self):
+        if self._map is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size < self.HEADER_SIZE:
+                        return None
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+        return self._map
+
+    def _remap(self):
+        self._map.close()
+        self._map = None
+        self._readable()
+
+    def _header(self, mm):
+        return self.HEADER.unpack_from(mm, 0)
+
+    def close(self):
+        with self._lock:
+            for mm in (self._map, self._write_map):
+                if mm is not None:
+                    mm.close()
+            if self._file is not None:
+                self._file.close()
+            self._map = self._write_map = self._file = None
+
+
+class SchedulerLock:
+    """
+    Exclusive, non-blocking file lock (flock) naming the scheduler worker. The OS drops it when the holder exits,
+    however it exits, so another worker can take it over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def acquire(self):
+        """
+        :return: True if this process holds the lock now
+        """
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class WorkerCoordinator:
+    """
+    Multi-worker mode (settings.WORKERS > 1, uvicorn --workers).
+
+    Every worker runs a coordination thread. The one that gets the scheduler lock is the scheduler worker: it runs
+    on_elected (schedules the labor job, warm starts), writes every new snapshot to the shared snapshot file (a run
+    that changed nothing too, for its retrieval time) and runs forced updates the other workers forward to it. The
+    others serve requests only: each poll they check the shared snapshot's version and publish time and adopt the
+    new snapshot when either moved (push subscribers only get changed data), and try the
+    lock, so when the scheduler worker dies one of them takes over within settings.WORKER_POLL seconds.
+
+    With one worker nothing runs here, that worker is the scheduler.
+    """
+
+    def __init__(self, store, lock_path, shared_path, requests_path):
+        self.store = store
+        self.lock = SchedulerLock(lock_path)
+        self.shared = SharedSnapshot(shared_path)
+        self.requests_path = requests_path
+        self._on_elected = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'elected': None, 'adopted': 0, 'written': 0, 'forwarded': 0, 'received': 0}
+        store.add_listener(self._on_publish)
+
+    @property
+    def enabled(self):
+        return settings.WORKERS > 1
+
+    def is_scheduler(self):
+        """
+        :return: True if this worker runs the labor job (always, with one worker)
+        """
+        return not self.enabled or self.lock.held
+
+    def start(self, on_elected):
+        """
+        Start coordinating.
+        :param on_elected: called (on the coordination thread) when this worker becomes the scheduler
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        os.makedirs(self.requests_path, exist_ok=True)
+        self._on_elected = on_elected
+        self._thread = threading.Thread(target=self._loop, name='worker-coordinator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop, and give up the scheduler role so another worker takes it right away.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=settings.WORKER_POLL * 2)
+            self._thread = None
+        self.lock.release()
+        self.shared.close()
+
+    def request_run(self, full=False, source='api'):
+        """
+        Forward a forced labor update to the scheduler worker.
+        """
+        request = {'full': full, 'source': source, 'pid': os.getpid(), 'requested': time.time()}
+        name = os.path.join(self.requests_path, f'{uuid.uuid4().hex}.json')
+        with open(name + '.tmp', 'w') as f:
+            json.dump(request, f)
+        os.replace(name + '.tmp', name)
+        self._stats['forwarded'] += 1
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.lock.held and self.lock.acquire():
+                    self._elected()
+                if self.lock.held:
+                    self.shared.heartbeat()
+                    self._run_requests()
+                else:
+                    self._sync()
+            except Exception as e:
+                logger.error(f'Worker coordination error: {e}')
+            self._stop.wait(settings.WORKER_POLL)
+
+    def _elected(self):
+        logger.info(f'Worker {os.getpid()} is the scheduler worker.')
+        self._stats['elected'] = time.time()
+        # pick up what the last scheduler published before taking over from it.
+        self._sync()
+        snapshot = self.store.current()
+        if snapshot is not None and (self.shared.info() or {}).get('version') != snapshot.version:
+            self._write(snapshot)
+        self._on_elected()
+
+    def _sync(self):
+        info = self.shared.info()
+        if info is None or info['version'] is None:
+            return
+        current = self.store.current()
+        if current is not None and current.version == info['version'] and current.published == info['published']:
+            return
+        snapshot = self.shared.read()
+        if snapshot is not None:
+            self.store.adopt(snapshot)
+            self._stats['adopted'] += 1
+            logger.debug(f'Adopted labor snapshot {snapshot.version} from worker {info["pid"]}.')
+
+    def _on_publish(self, snapshot):
+        if not self.enabled or not self.lock.held:
+            return
+        # a run that changed nothing still moves the retrieval time (X-Labor-Retrieved), so it's shared too.
+        info = self.shared.info()
+        if info is None or info['version'] != snapshot.version or info['published'] != snapshot.published:
+            self._write(snapshot)
+
+    def _write(self, snapshot):
+        try:
+            self.shared.write(snapshot)
+            self._stats['written'] += 1
+        except Exception as e:
+            logger.error(f'Error writing the shared labor snapshot: {e}')
+
+    def _run_requests(self):
+        from app.internal.laborRunner import labor_runner
+
+        try:
+            names = sorted(name for name in os.listdir(self.requests_path) if name.endswith('.json'))
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.requests_path, name)
+            try:
+                with open(path) as f:
+                    request = json.load(f)
+                os.remove(path)
+            except (OSError, ValueError) as e:
+                logger.error(f'Error reading forwarded labor update {name}: {e}')
+                continue
+            run, merged = labor_runner.trigger(full=request.get('full', False), source=request.get('source', 'api'))
+            self._stats['received'] += 1
+            logger.info(f'Forwarded labor update from worker {request.get("pid")} '
+                        f'{"merged into" if merged else "started"} run {run.id}.')
+
+    def status(self):
+        """
+        :return: this worker's role, the scheduler worker's pid and heartbeat age, and the snapshot versions
+        """
+        info = self.shared.info() if self.enabled else None
+        snapshot = self.store.current()
+        heartbeat_age = time.time() - info['heartbeat'] if info and info['heartbeat'] else None
+        return {
+            'workers': settings.WORKERS,
+            'pid': os.getpid(),
+            'role': 'scheduler' if self.is_scheduler() else 'reader',
+            'scheduler_pid': os.getpid() if self.is_scheduler() else (info or {}).get('pid'),
+            'scheduler_heartbeat_age': round(heartbeat_age, 3) if heartbeat_age is not None else None,
+            'scheduler_alive': self.scheduler_alive(info),
+            'version': snapshot.version if snapshot is not None else None,
+            'shared_version': (info or {}).get('version'),
+            **self._stats,
+        }
+
+    def scheduler_alive(self, info=None):
+        """
+        :return: True if this worker is the scheduler, or the scheduler worker's heartbeat is recent
+        """
+        if self.is_scheduler():
+            return True
+        info = info or self.shared.info()
+        return bool(info and info['heartbeat'] and time.time() - info['heartbeat'] < settings.WORKER_SCHEDULER_TIMEOUT)
+
+
+labor_workers = WorkerCoordinator(labor_snapshots, settings.SCHEDULER_LOCK_PATH, settings.SHARED_SNAPSHOT_PATH,
+                                  os.path.join(settings.DATA_PATH, 'labor-requests'))
@@ -0,0 +1,98 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Query, HTTPException
+from app.internal import settings
+from app.internal.stats import StatsManager
+from app.internal.queries import queries
+from app.internal.snapshot import labor_snapshots
+from app.internal.export import export_response, batched, prime, limited, MEDIA_TYPES
+
+ExportRouter = APIRouter()
+
+stats_manager = StatsManager(os.path.join(settings.STATS_PATH, settings.STATS_FILENAME))
+
+# Streamed exports, meant for linking Excel (Data > From Web) to the API. Rows go out in batches of
+# settings.EXPORT_BATCH_SIZE, nothing builds the whole export in memory.
+
+FORMAT_QUERY = Query(default="csv", enum=["csv", "ndjson"], description="csv for Excel, ndjson (one JSON object per line) for everything else")
+
+JOB_TOTAL_COLUMNS = ['Date', 'OprSeq', 'JobNum', 'PartNum', 'Standard', 'PrevHrs', 'DayLabor', 'Efficiency', 'Emps']
+EFFICIENCY_COLUMNS = ['OprSeq', 'JobNum', 'PartNum', 'Standard', 'PrevHrs', 'ActiveLabor', 'Efficiency', 'Emps']
+
+
+def _check_format(fmt):
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {', '.join(MEDIA_TYPES)}.")
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD.")
+
+
+@ExportRouter.get("/Epicor/Labor/Export/LaborDtl", tags=["Retrieval"])
+@stats_manager.track_stats("Export_LaborDtl")
+def export_labordtl(Date: str = Query(description="Labor date, YYYY-MM-DD"), Format: str = FORMAT_QUERY):
+    """
+    Raw LaborDtl rows for a day, streamed straight from the cursor (fetchmany).
+    :return: CSV or NDJSON
+    """
+    _check_format(Format)
+    date = _parse_date(Date)
+    datestr = date.strftime('%Y-%m-%d')
+    return export_response(prime(limited(queries.stream('LaborDtlExport', datestr))), Format, f'labordtl_{datestr}')
+
+
+@ExportRouter.get("/Epicor/Labor/Export/JobTotals", tags=["Retrieval"])
+@stats_manager.track_stats("Export_JobTotals")
+def export_job_totals(Date: str = Query(description="Labor date, YYYY-MM-DD. The first day when EndDate is set."),
+                      EndDate: Optional[str] = Query(default=None, description="Last day of a range, YYYY-MM-DD"),
+                      Format: str = FORMAT_QUERY):
+    """
+    Job labor totals and efficiency per day, same as /Epicor/Labor/History. Days go out one at a time, closed days
+    come from the history cache.
+    :return: CSV or NDJSON
+    """
+    # laborHistory brings pandas along, only load it when an export needs it.
+    from app.internal.laborHistory import labor_history, labor_today
+
+    _check_format(Format)
+    start = _parse_date(Date)
+    end = _parse_date(EndDate) if EndDate is not None else start
+    if end < start:
+        raise HTTPException(status_code=400, detail="EndDate is before Date.")
+    if end > labor_today():
+        raise HTTPException(status_code=400, detail="Dates can't be in the future.")
+    if (end - start).days + 1 > settings.HISTORY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Ranges are limited to {settings.HISTORY_MAX_DAYS} days.")
+
+    def days():
+        date = start
+        while date <= end:
+            records, _ = labor_history.day(date)
+            yield from batched(records, settings.EXPORT_BATCH_SIZE)
+            date += timedelta(days=1)
+
+    filename = f'jobtotals_{start}' if start == end else f'jobtotals_{start}_{end}'
+    return export_response(prime(limited(days())), Format, filename, columns=JOB_TOTAL_COLUMNS)
+
+
+@ExportRouter.get("/Epicor/Labor/Export/Efficiency", tags=["Retrieval"])
+@stats_manager.track_stats("Export_Efficiency")
+async def export_efficiency(OprSeq: Optional[int] = Query(default=None, description="Operation sequence to filter by, all by default"),
+                            Format: str = FORMAT_QUERY):
+    """
+    The current active labor efficiency snapshot, the same data as /Epicor/Labor/ActiveLaborEfficiency.
+    :return: CSV or NDJSON
+    """
+    _check_format(Format)
+    snapshot = labor_snapshots.current()
+    records = snapshot.data.get('active_labor', []) if snapshot is not None and snapshot.data else []
+    if OprSeq is not None:
+        records = (record for record in records if record.get('OprSeq') == OprSeq)
+
+    filename = 'efficiency' if OprSeq is None else f'efficiency_{OprSeq}'
+    return export_response(batched(records, settings.EXPORT_BATCH_SIZE), Format, filename, columns=EFFICIENCY_COLUMNS)
@@ -1,47 +1,25 @@
+import asyncio
 import logging
 import os
 import pickle
 import time
 from datetime import datetime
-from fastapi import APIRouter, Depends, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Query, Header, Response, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from app.internal import settings
-from app.internal import laborMagic
+from app.internal.snapshot import labor_snapshots, get_emps_not_clocked
+from app.internal.laborRunner import labor_runner
+from app.internal.laborBackfill import backfills
+from app.internal.push import labor_broadcaster
+from app.internal.workers import labor_workers
 from app.internal.stats import StatsManager
 
 LaborRouter = APIRouter()
 
 stats_manager = StatsManager(os.path.join(settings.STATS_PATH, settings.STATS_FILENAME))
 
-from pydantic import BaseModel, Field
 from typing import List, Optional
-
-
-class EmployeeNotClocked(BaseModel):
-    employeenum: str = Field(description="The employee's number")
-    FirstName: str = Field(description="First name of the employee")
-    LastName: str = Field(description="Last name of the employee")
-    jcdept: str = Field(description="Department code")
-    Laborcount: int = Field(default=0, description="Count of labor entries")
-    #OprSeq: int = Field(description="Operation sequence number")
-    Name: str = Field(description="Formatted name of the employee")
-
-class LaborData(BaseModel):
-    OprSeq: int = Field(description="Operation sequence number")
-    JobNum: str = Field(description="Job number")
-    PartNum: str = Field(description="Part number")
-    Standard: float = Field(description="Standard number of hours expected")
-    PrevHrs: float = Field(default=0, description="Previous hours worked")
-    ActiveLabor: float = Field(description="Hours of active labor")
-    Efficiency: float = Field(description="Efficiency rating")
-    Emps: str = Field(description="Employee names involved")
-
-class ActiveLaborData(BaseModel):
-    active_labor: List[LaborData] = Field(default=[], description="List of active labor entries")
-    empsnotclocked: List[EmployeeNotClocked] = Field(default_factory=list, description="List of employees who are not clocked")
-    oprseq: int = Field(description="Operation sequence")
-    timestamp: datetime = Field(description="Timestamp of the data retrieval")
-    executiontime: float = Field(description="Time taken for the scheduled task to run (NOT this query)")
+from app.internal.models import EmployeeNotClocked, LaborData, ActiveLaborData, ActiveLaborDelta, LaborHistoryData
 
 
 
@@ -133,19 +111,45 @@ async def load_exec_times():
 
 
 
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag.
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
 @LaborRouter.get("/Epicor/Labor/ActiveLaborEfficiency", tags=["Retrieval"],
                  response_model=ActiveLaborData,
                  responses={200: ActiveLaborEfficiency200Response})
 @stats_manager.track_stats("Get_Labor_Efficiency")
-async def Get_Labor_Efficiency(OprSeq: int = Query(default=220, description="The operation sequence to query, i.e. 220, 300, 440, 520, etc",)):
+async def Get_Labor_Efficiency(OprSeq: int = Query(default=220, description="The operation sequence to query, i.e. 220, 300, 440, 520, etc",),
+                               if_none_match: Optional[str] = Header(default=None)):
     """
     Get the active labor efficiency data for a specific oprseq.
+    Responses carry an ETag, send it back in If-None-Match to get a 304 when the data hasn't changed. The timestamp is
+    the run that last changed this oprseq's data, X-Labor-Retrieved is the last run (the data's as of then, changed
+    or not). X-Labor-Version is the version to pass to /Epicor/Labor/ActiveLaborEfficiency/Delta for what changed
+    after it.
     :param oprseq: Operation Sequence i.e. 220, 300, 440, etc.
     :return:
     """
 
     oprseq = int(OprSeq)
-    data = laborMagic.retrieve_pickles()
+    snapshot = labor_snapshots.current()
+    data = snapshot.data if snapshot is not None else None
+
+    # the response is rendered once when the data is published, just send the bytes.
+    rendered = snapshot.responses.get(oprseq) if snapshot is not None else None
+    if rendered is not None:
+        body, etag = rendered
+        headers = {"ETag": etag, "X-Labor-Version": str(snapshot.version),
+                   "X-Labor-Retrieved": str(data.get('timestamp', ''))}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
 
     try:
         if data is None or 'active_labor' not in data:
@@ -189,6 +193,102 @@ async def Get_Labor_Efficiency(OprSeq: int = Query(default=220, description="The
             "executiontime": executiontime}
 
 
+@LaborRouter.get("/Epicor/Labor/ActiveLaborEfficiency/Delta", tags=["Retrieval"], response_model=ActiveLaborDelta)
+@stats_manager.track_stats("Get_Labor_Efficiency_Delta")
+async def Get_Labor_Efficiency_Delta(OprSeq: int = Query(default=220, description="The operation sequence to query"),
+                                     since: int = Query(description="The version the client has, from X-Labor-Version or the last delta")):
+    """
+    What changed in the active labor efficiency data for an oprseq since a version: jobs and employees added,
+    removed (by key), and changed (just the fields that changed). Jobs are keyed by OprSeq + JobNum, employees by
+    employeenum. If since is older than the versions kept (settings.SNAPSHOT_HISTORY), full is true and added has
+    everything.
+    :return:
+    """
+    oprseq = int(OprSeq)
+    snapshot, diff, full = labor_snapshots.delta(oprseq, since)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No Labor Data Yet.")
+
+    return {"oprseq": oprseq, "since": since, "version": snapshot.version, "full": full, **diff,
+            "timestamp": snapshot.data.get('timestamp'), "executiontime": snapshot.data.get('executiontime')}
+
+
+@LaborRouter.websocket("/Epicor/Labor/ActiveLaborEfficiency/ws")
+async def Push_Labor_Efficiency(websocket: WebSocket,
+                                OprSeq: int = Query(default=220, description="The operation sequence to subscribe to")):
+    """
+    Push the active labor efficiency data for an oprseq over a WebSocket. Sends the current data on connect, then
+    the same JSON as /Epicor/Labor/ActiveLaborEfficiency every time a labor run changes it. Anything the client
+    sends is ignored.
+    A client that falls behind skips straight to the newest data, one that can't take a message within
+    settings.PUSH_SEND_TIMEOUT seconds is closed with 1013 (try again later).
+    """
+    await websocket.accept()
+    subscriber = labor_broadcaster.subscribe(int(OprSeq), 'websocket')
+    if subscriber is None:
+        await websocket.close(code=1013)
+        return
+
+    # keep a receive going, it's how a disconnect shows up.
+    receiver = asyncio.ensure_future(websocket.receive())
+    try:
+        while True:
+            getter = asyncio.ensure_future(subscriber.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+            if receiver in done:
+                if receiver.result()['type'] == 'websocket.disconnect':
+                    return
+                receiver = asyncio.ensure_future(websocket.receive())
+            if getter not in done:
+                continue
+
+            body, etag = getter.result()
+            try:
+                await asyncio.wait_for(websocket.send_text(body.decode()), settings.PUSH_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                labor_broadcaster.slow_disconnect(subscriber)
+                await websocket.close(code=1013)
+                return
+            subscriber.sent += 1
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        labor_broadcaster.unsubscribe(subscriber)
+
+
+@LaborRouter.get("/Epicor/Labor/ActiveLaborEfficiency/stream", tags=["Retrieval"])
+async def Stream_Labor_Efficiency(OprSeq: int = Query(default=220, description="The operation sequence to subscribe to"),
+                                  last_event_id: Optional[str] = Header(default=None)):
+    """
+    Server-Sent Events fallback for /Epicor/Labor/ActiveLaborEfficiency/ws, for clients that can't do WebSockets
+    (EventSource in the browser). Each update is a "labor" event with the JSON as data and the ETag as the id, so a
+    reconnecting EventSource (Last-Event-ID) doesn't get data it already has. A comment line goes out every
+    settings.PUSH_HEARTBEAT seconds to keep proxies from closing the stream.
+    """
+    subscriber = labor_broadcaster.subscribe(int(OprSeq), 'sse', last_etag=last_event_id)
+    if subscriber is None:
+        raise HTTPException(status_code=503, detail="Too Many Subscribers.")
+
+    async def events():
+        try:
+            while True:
+                message = await subscriber.get(timeout=settings.PUSH_HEARTBEAT)
+                if message is None:
+                    yield b': keepalive\n\n'
+                    continue
+                body, etag = message
+                subscriber.sent += 1
+                yield b'id: ' + etag.encode() + b'\nevent: labor\ndata: ' + body + b'\n\n'
+        finally:
+            labor_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @LaborRouter.get("/Epicor/Labor/EmployeesNotClockedIntoJobs", tags=["Retrieval"],
                  response_model=List[EmployeeNotClocked],
                  responses={200: EmpsNotClocked200Response})
@@ -202,7 +302,7 @@ async def emps_not_clocked(oprseq: Optional[int] = Query(default=None, descripti
     """
 
     if oprseq is not None:
-        data = laborMagic.get_emps_not_clocked()
+        data = get_emps_not_clocked()
 
         # translate the department codes to department names
         for item in data:
@@ -215,7 +315,7 @@ async def emps_not_clocked(oprseq: Optional[int] = Query(default=None, descripti
 
         return data
     else:
-        data = laborMagic.get_emps_not_clocked()
+        data = get_emps_not_clocked()
 
     return data
 
@@ -233,18 +333,115 @@ async def emp_master():
     return None
 
 
+@LaborRouter.get("/Epicor/Labor/History", tags=["Retrieval"], response_model=LaborHistoryData)
+@stats_manager.track_stats("Get_Labor_History")
+def Get_Labor_History(Date: Optional[str] = Query(default=None, description="Single day, YYYY-MM-DD"),
+                      StartDate: Optional[str] = Query(default=None, description="First day of a range, YYYY-MM-DD"),
+                      EndDate: Optional[str] = Query(default=None, description="Last day of a range, YYYY-MM-DD. Defaults to StartDate")):
+    """
+    Job labor totals and efficiency for a past day or a range of days, plus totals per job over the range.
+    Closed days are computed once and then served from the history cache. Today is always computed fresh.
+    Not an async def on purpose, computing days that aren't cached yet can take a while and runs in the threadpool.
+    :return:
+    """
+    # pandas & the labor code, kept off the startup path.
+    from app.internal.laborHistory import labor_history, job_totals, parse_date, labor_today
+
+    try:
+        if Date is not None:
+            start = end = parse_date(Date)
+        elif StartDate is not None:
+            start = parse_date(StartDate)
+            end = parse_date(EndDate) if EndDate is not None else start
+        else:
+            raise HTTPException(status_code=400, detail="Date or StartDate is required.")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD.")
+
+    if end < start:
+        raise HTTPException(status_code=400, detail="EndDate is before StartDate.")
+    if end > labor_today():
+        raise HTTPException(status_code=400, detail="Dates can't be in the future.")
+    if (end - start).days + 1 > settings.HISTORY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Ranges are limited to {settings.HISTORY_MAX_DAYS} days.")
+
+    days = labor_history.days(start, end)
+    return {
+        "start": start.strftime('%Y-%m-%d'),
+        "end": end.strftime('%Y-%m-%d'),
+        "days": [{"date": date.strftime('%Y-%m-%d'), "cached": cached, "jobs": records} for date, records, cached in days],
+        "totals": job_totals([record for _, records, _ in days for record in records]),
+    }
+
+
+@LaborRouter.get("/Epicor/Labor/History/Backfill", tags=["Execution"])
+def Exec_History_Backfill(StartDate: str = Query(description="First day, YYYY-MM-DD"),
+                                EndDate: str = Query(description="Last day, YYYY-MM-DD")):
+    """
+    Fill the history cache for a range of closed days in the background. Days already cached are skipped, so running
+    the same range again resumes a backfill that stopped. Only one backfill runs at a time, asking again while one
+    is running returns the running one. Follow it with /Epicor/Labor/History/Backfill/Status.
+    Same as running python -m app.internal.laborBackfill StartDate EndDate.
+    Not an async def, the first backfill imports the labor code.
+    :return: backfill id and status
+    """
+    from app.internal.laborHistory import parse_date
+
+    try:
+        start, end = parse_date(StartDate), parse_date(EndDate)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD.")
+    if end < start:
+        raise HTTPException(status_code=400, detail="EndDate is before StartDate.")
+    if (end - start).days + 1 > settings.BACKFILL_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Backfills are limited to {settings.BACKFILL_MAX_DAYS} days.")
+
+    backfill, started = backfills.start(start, end)
+    return {"message": "Backfill Started" if started else "Backfill Already Running", **backfill.describe()}
+
+
+@LaborRouter.get("/Epicor/Labor/History/Backfill/Status", tags=["Execution"])
+async def Get_History_Backfill_Status(BackfillId: Optional[str] = Query(default=None, description="Backfill id. Defaults to the latest backfill.")):
+    """
+    Backfill progress: days done, skipped (already cached), failed, in flight, and an ETA.
+    :return:
+    """
+    status = backfills.status(BackfillId)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Backfill Not Found.")
+    return status
+
+
 @LaborRouter.get("/Epicor/Labor/ForceActiveLaborUpdate", tags=["Execution"])
-async def Exec_Force_Update():
+async def Exec_Force_Update(Full: bool = Query(default=False, description="Recompute the whole day instead of just what changed since the last run.")):
     """
     Force update the labor data. This data normally updates on the interval set in settings.py, but this can be used to force an update.
-    :return: None
+    The update runs in the background, use the run_id with /Epicor/Labor/ForceActiveLaborUpdate/Status to follow it.
+    If an update is already queued or running, this joins it instead of starting another one.
+    In multi-worker mode a worker that isn't the scheduler forwards the update to it, there's no run id to follow then.
+    :return: run id and status
     """
-    starttime = time.time()
-    totaltime = time.time() - starttime
+    if not labor_workers.is_scheduler():
+        labor_workers.request_run(full=Full)
+        return {"message": "Forwarded Labor Update To The Scheduler Worker", "run_id": None, "merged": False,
+                "status": "forwarded"}
 
-    msg = laborMagic.process_live_labor()
+    run, merged = labor_runner.trigger(full=Full, source='api')
 
-    return {"message": "Forced Labor Update", "executiontime": totaltime, "status": msg}
+    return {"message": "Joined Labor Update In Progress" if merged else "Forced Labor Update",
+            "run_id": run.id, "merged": merged, "status": run.state}
+
+
+@LaborRouter.get("/Epicor/Labor/ForceActiveLaborUpdate/Status", tags=["Execution"])
+async def Get_Force_Update_Status(RunId: Optional[str] = Query(default=None, description="Run id from ForceActiveLaborUpdate. Defaults to the latest run.")):
+    """
+    Status of a labor update: queued, running (with the stages done so far), done or error.
+    :return:
+    """
+    status = labor_runner.status(RunId)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Labor Update Not Found.")
+    return status
 
 
 @LaborRouter.get("/Epicor/Labor/ExecutionTimes", tags=["Retrieval"])
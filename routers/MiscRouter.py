@@ -4,6 +4,7 @@ from fastapi import APIRouter
 from fastapi import Query, Response, HTTPException
 from app.internal import settings
 from app.internal.ACTFastScheduler import scheduler
+from app.internal.workers import labor_workers
 from app.internal.stats import StatsManager
 import app.internal.logging
 
@@ -55,12 +56,20 @@ async def get_scheduler_status():
     Get the status of the scheduler jobs.
 
     (OK/ERROR) status is based on the 'process_live_labor' job. If the job is NOT scheduled to run, or the next runtime is not within the next 5 minutes, the status will be "ERROR".
+    In multi-worker mode only the scheduler worker has the job, the others are OK while its heartbeat is recent.
 
     :return: List of jobs and their next run time.
     """
     scheduler_info = []
     labor_magic_status = "ERROR"
 
+    if not labor_workers.is_scheduler():
+        return {
+            "status": "OK" if labor_workers.scheduler_alive() else "ERROR",
+            "jobs": scheduler_info,
+            "workers": labor_workers.status(),
+        }
+
     try:
         for job in scheduler.get_jobs():
             scheduler_info.append({
@@ -107,6 +116,11 @@ async def health_check():
     Simple health check endpoint for docker.
     :return:
     """
+    if not labor_workers.is_scheduler():
+        if labor_workers.scheduler_alive():
+            return {"status": "OK"}
+        raise HTTPException(status_code=500, detail="No Scheduler Worker.")
+
     try:
         for job in scheduler.get_jobs():
             if job.name == "process_live_labor":
@@ -1,7 +1,15 @@
 import app.internal.settings as settings
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 import os
 from app.internal.stats import StatsManager
+from app.internal.utils import get_epicor_pool
+from app.internal.metrics import pipeline_metrics
+from app.internal.queryCache import query_cache
+from app.internal.queries import queries
+from app.internal.push import labor_broadcaster
+from app.internal.workers import labor_workers
+from app.internal.memoryBudget import memory_budget
 import app.internal.settings as settings
 
 StatsRouter = APIRouter()
@@ -13,7 +21,8 @@ stats_manager = StatsManager(os.path.join(settings.STATS_PATH, settings.STATS_FI
 @stats_manager.track_stats("Get_ACTFast_Stats")
 async def get_stats():
     """
-    ACTFast uses a custom stats manager to track execution times and hit counts. This endpoint returns the current stats.
+    ACTFast uses a custom stats manager to track execution times and hit counts. This endpoint returns the current stats,
+    including p50/p95/p99 latencies estimated from a histogram.
     Note that these stats do not persist across updates or restarts of the container.
     No point in adding persistant storage just for this data.
 
@@ -22,3 +31,82 @@ async def get_stats():
 
 
     return stats_manager.get_stats()
+
+
+@StatsRouter.get("/actfast/stats/dbpool", tags=["Stats & Misc"])
+async def get_db_pool_stats():
+    """
+    Epicor connection pool metrics: checkouts, waits, connections created/discarded, and current pool size.
+    :return:
+    """
+    return get_epicor_pool().metrics()
+
+
+@StatsRouter.get("/actfast/stats/querycache", tags=["Stats & Misc"])
+async def get_query_cache_stats():
+    """
+    Query cache stats per named query: hits, stale hits (served while refreshing), misses, background refreshes,
+    evictions, and the rows/bytes currently held.
+    :return:
+    """
+    return query_cache.stats()
+
+
+@StatsRouter.get("/actfast/stats/queries", tags=["Stats & Misc"])
+async def get_query_stats():
+    """
+    Registered Epicor queries: executions, errors, rows returned and latency percentiles. Cache hits aren't counted.
+    :return:
+    """
+    return queries.stats()
+
+
+@StatsRouter.get("/actfast/stats/push", tags=["Stats & Misc"])
+async def get_push_stats():
+    """
+    Labor push subscribers (WebSocket and SSE) per OprSeq, snapshots fanned out, messages sent, updates skipped for
+    slow clients (conflated), and slow clients disconnected.
+    :return:
+    """
+    return labor_broadcaster.stats()
+
+
+@StatsRouter.get("/actfast/stats/workers", tags=["Stats & Misc"])
+async def get_worker_stats():
+    """
+    Multi-worker mode: this worker's role (scheduler or reader), the scheduler worker's pid and heartbeat, the labor
+    snapshot version here and in the shared snapshot, snapshots adopted/written and forced updates forwarded.
+    :return:
+    """
+    return labor_workers.status()
+
+
+@StatsRouter.get("/actfast/stats/memory", tags=["Stats & Misc"])
+async def get_memory_stats():
+    """
+    Resident memory now and as of the labor run's last check, the highest seen at a check, and the labor run's
+    memory budget (settings.LABOR_MEMORY_BUDGET_MB) with how many checks went over it.
+    :return:
+    """
+    return memory_budget.stats()
+
+
+@StatsRouter.get("/metrics", tags=["Stats & Misc"], response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Labor pipeline stage metrics (queries, slot matrix, break masks, pruning, assembly) in Prometheus text format.
+    :return:
+    """
+    return PlainTextResponse(pipeline_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@StatsRouter.get("/actfast/pipeline/runs", tags=["Stats & Misc"])
+async def get_pipeline_runs():
+    """
+    Stage by stage breakdown of the last labor runs, newest first, plus the run in flight if there is one.
+    :return:
+    """
+    return {
+        "current": pipeline_metrics.current_run(),
+        "runs": pipeline_metrics.runs()
+    }
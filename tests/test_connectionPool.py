@@ -0,0 +1,179 @@
+import time
+import threading
+import unittest
+from app.internal import settings  # before utils, settings imports utils.
+from app.internal.utils import ConnectionPool
+
+# Run from the parent directory of the app: python -m unittest discover -s app/tests -t .
+
+
+class FakeConnection:
+    """
+    Stands in for a pymssql connection. Set healthy = False to make validation fail.
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeFactory:
+
+    def __init__(self):
+        self.made = []
+
+    def __call__(self):
+        conn = FakeConnection(len(self.made))
+        self.made.append(conn)
+        return conn
+
+
+def validate(conn):
+    return conn.healthy and not conn.closed
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def pool(self, **kwargs):
+        self.factory = FakeFactory()
+        kwargs.setdefault('maxsize', 2)
+        kwargs.setdefault('timeout', 0.2)
+        return ConnectionPool(self.factory, validate=validate, **kwargs)
+
+    def test_reuses_idle_connection(self):
+        pool = self.pool()
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.factory.made), 1)
+
+    def test_validates_on_checkout(self):
+        pool = self.pool()
+        with pool.connection() as conn:
+            pass
+        conn.healthy = False
+
+        with pool.connection() as replacement:
+            self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.metrics()['discarded'], 1)
+
+    def test_recycles_after_max_age(self):
+        pool = self.pool(max_age=0.05)
+        with pool.connection() as conn:
+            pass
+        time.sleep(0.1)
+
+        with pool.connection() as replacement:
+            self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+
+    def test_discards_connection_when_query_raises(self):
+        pool = self.pool()
+        with self.assertRaises(RuntimeError):
+            with pool.connection() as conn:
+                raise RuntimeError('query failed')
+
+        self.assertTrue(conn.closed)
+        metrics = pool.metrics()
+        self.assertEqual((metrics['size'], metrics['idle'], metrics['discarded']), (0, 0, 1))
+
+    def test_times_out_when_all_connections_in_use(self):
+        pool = self.pool(maxsize=1, timeout=0.1)
+        conn = pool.checkout()
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            pool.checkout()
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        pool.checkin(conn)
+
+        metrics = pool.metrics()
+        self.assertEqual(metrics['timeouts'], 1)
+        self.assertGreaterEqual(metrics['waits'], 1)
+
+    def test_waits_for_a_connection_to_come_back(self):
+        pool = self.pool(maxsize=1, timeout=2)
+        conn = pool.checkout()
+        timer = threading.Timer(0.05, pool.checkin, args=(conn,))
+        timer.start()
+        try:
+            self.assertIs(pool.checkout(), conn)
+        finally:
+            timer.join()
+        self.assertEqual(pool.metrics()['timeouts'], 0)
+
+    def test_stats(self):
+        pool = self.pool(maxsize=3)
+        conns = [pool.checkout() for _ in range(3)]
+        pool.checkin(conns[0])
+        pool.checkin(conns[1], discard=True)
+
+        metrics = pool.metrics()
+        self.assertEqual(metrics['checkouts'], 3)
+        self.assertEqual(metrics['created'], 3)
+        self.assertEqual(metrics['discarded'], 1)
+        self.assertEqual((metrics['size'], metrics['idle'], metrics['in_use'], metrics['maxsize']), (2, 1, 1, 3))
+
+    def test_factory_error_frees_the_slot(self):
+        pool = ConnectionPool(lambda: 1 / 0, maxsize=1, timeout=0.1, validate=validate)
+        with self.assertRaises(ZeroDivisionError):
+            pool.checkout()
+        self.assertEqual(pool.metrics()['size'], 0)
+
+    def test_close(self):
+        pool = self.pool()
+        idle = pool.checkout()
+        busy = pool.checkout()
+        pool.checkin(idle)
+
+        pool.close()
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+
+        # checked out connections are closed when they come back, not put back in the pool.
+        pool.checkin(busy)
+        self.assertTrue(busy.closed)
+        metrics = pool.metrics()
+        self.assertEqual((metrics['size'], metrics['idle']), (0, 0))
+
+    def test_checkout_after_close_raises(self):
+        pool = self.pool()
+        pool.close()
+        with self.assertRaises(RuntimeError):
+            pool.checkout()
+        self.assertEqual(pool.metrics()['size'], 0)
+        self.assertEqual(self.factory.made, [])
+
+    def test_foreign_checkin_keeps_maxsize(self):
+        pool = self.pool(maxsize=1)
+        held = pool.checkout()
+        foreign = FakeConnection(99)
+        with self.assertLogs('app.internal.utils', level='WARNING'):
+            pool.checkin(foreign)
+        self.assertTrue(foreign.closed)
+        self.assertEqual(pool.metrics()['size'], 1)
+        with self.assertRaises(TimeoutError):
+            pool.checkout()
+        pool.checkin(held)
+
+    def test_double_checkin_keeps_maxsize(self):
+        pool = self.pool(maxsize=1)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        with self.assertLogs('app.internal.utils', level='WARNING'):
+            pool.checkin(conn)
+        self.assertEqual(pool.metrics()['size'], 1)
+        first = pool.checkout()
+        with self.assertRaises(TimeoutError):
+            pool.checkout()
+        pool.checkin(first)
+
+
+if __name__ == '__main__':
+    unittest.main()
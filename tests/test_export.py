@@ -0,0 +1,55 @@
+import unittest
+from fastapi import HTTPException
+from app.internal import settings  # before utils, settings imports utils.
+from app.internal import export
+from app.internal.export import limited, prime, encode_batches
+
+# Run from the parent directory of the app: python -m unittest discover -s app/tests -t .
+
+
+class ExportLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = settings.EXPORT_MAX_CONCURRENT
+        settings.EXPORT_MAX_CONCURRENT = 2
+        export._export_slots = None
+
+    def tearDown(self):
+        settings.EXPORT_MAX_CONCURRENT = self.saved
+        export._export_slots = None
+
+    @staticmethod
+    def rows():
+        yield [{'a': 1}]
+        yield [{'a': 2}]
+
+    def test_busy_when_every_slot_is_taken(self):
+        first = prime(limited(self.rows()))
+        second = prime(limited(self.rows()))
+        with self.assertRaises(HTTPException) as raised:
+            prime(limited(self.rows()))
+        self.assertEqual(raised.exception.status_code, 503)
+
+        # a finished export gives its slot back.
+        self.assertEqual(len(list(first)), 2)
+        third = prime(limited(self.rows()))
+        second.close()
+        third.close()
+
+    def test_dropped_export_gives_its_slot_back(self):
+        for _ in range(5):
+            stream = prime(limited(self.rows()))
+            del stream  # client went away before reading it all.
+        self.assertEqual(len(list(prime(limited(self.rows())))), 2)
+
+    def test_empty_export(self):
+        for _ in range(3):
+            self.assertEqual(list(prime(limited(iter(())))), [])
+
+    def test_encodes_csv(self):
+        chunks = b''.join(encode_batches(prime(limited(self.rows())), 'csv'))
+        self.assertEqual(chunks.decode().split(), ['a', '1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
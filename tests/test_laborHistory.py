@@ -0,0 +1,78 @@
+import unittest
+from datetime import date
+from unittest import mock
+import pandas as pd
+from app.internal import settings  # before utils, settings imports utils.
+from app.internal import laborMagic
+from app.internal.laborHistory import labor_history, job_totals
+from app.internal.queries import queries
+
+# Run from the parent directory of the app: python -m unittest discover -s app/tests -t .
+
+DATE = date(2024, 3, 4)
+
+
+def labor(seq, emp, job, oprseq, clock_in, clock_out):
+    return dict(LaborDtlSeq=seq, EmployeeNum=emp, JobNum=job, OprSeq=oprseq, ClockInDate=DATE.strftime('%Y-%m-%d'),
+                ClockInTime=clock_in, ClockOutTime=clock_out, ActiveTrans=0, SysRevID=seq)
+
+
+def shift(emp, first, last):
+    # lunch and break after the labor below, so they don't take anything off.
+    return dict(Empid=emp, Name=f'{first} {last}', FirstName=first, LastName=last, JCDept='ASSY', Shift=1,
+                StartTime=6.0, EndTime=16.0, LunchStart=13.0, LunchEnd=13.5, BreakStart=14.0, BreakEnd=14.25)
+
+
+class ComputeDayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = settings.LABOR_ENGINE
+        settings.LABOR_ENGINE = 'vectorized'
+        # one job worked at two operations, one after the other, and a second job alongside the second one. Slots
+        # count both ends, so each record stops in the last 5 minutes of the hour to come out in whole hours.
+        labordtl = [labor(1, 'E1', 'J1', 10, 7.0, 9.92),
+                    labor(2, 'E1', 'J1', 20, 10.0, 10.92),
+                    labor(3, 'E2', 'J2', 10, 9.0, 11.92)]
+        rows = {
+            'LaborHistoryJobs': [dict(OprSeq=10, JobNum='J1', PartNum='P1', Standard=4.0, PrevHrs=1.0),
+                                 dict(OprSeq=20, JobNum='J1', PartNum='P1', Standard=2.0, PrevHrs=0.0),
+                                 dict(OprSeq=10, JobNum='J2', PartNum='P2', Standard=0.0, PrevHrs=0.0)],
+            'LaborHistoryEmps': [dict(EmployeeNum='E1', Jobnum='J1'), dict(EmployeeNum='E2', Jobnum='J2')],
+        }
+        shiftdata = pd.DataFrame([shift('E1', 'Ann', 'Smith'), shift('E2', 'Bob', 'Jones')])
+        for patch in (mock.patch.object(laborMagic, 'GetShiftData', return_value=shiftdata),
+                      mock.patch.object(laborMagic, '_fetch_labordtl', return_value=labordtl),
+                      mock.patch.object(queries, 'run', side_effect=lambda name, *params: rows[name])):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        settings.LABOR_ENGINE = self.saved
+
+    def records(self):
+        return {(record['JobNum'], record['OprSeq']): record for record in labor_history.compute(DATE)}
+
+    def test_hours_per_operation(self):
+        records = self.records()
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[('J1', 10)]['DayLabor'], 3.0)
+        self.assertEqual(records[('J1', 20)]['DayLabor'], 1.0)
+        self.assertEqual(records[('J2', 10)]['DayLabor'], 3.0)
+        self.assertEqual(records[('J1', 10)]['Efficiency'], 1.0)  # (1 + 3) / 4
+        self.assertEqual(records[('J1', 20)]['Efficiency'], 0.5)
+        self.assertEqual(records[('J1', 10)]['Date'], '2024-03-04')
+
+    def test_legacy_engine_setting(self):
+        # the legacy engine only keys by JobNum, history falls back to the vectorized one.
+        expected = self.records()
+        settings.LABOR_ENGINE = 'legacy'
+        self.assertEqual(self.records(), expected)
+
+    def test_job_totals(self):
+        totals = {(total['JobNum'], total['OprSeq']): total['DayLabor']
+                  for total in job_totals(list(self.records().values()))}
+        self.assertEqual(totals, {('J1', 10): 3.0, ('J1', 20): 1.0, ('J2', 10): 3.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
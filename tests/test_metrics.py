@@ -0,0 +1,76 @@
+import threading
+import unittest
+from app.internal import settings  # before utils, settings imports utils.
+from app.internal.utils import InsightUtils
+from app.internal.metrics import PipelineMetrics, pipeline_metrics
+
+# Run from the parent directory of the app: python -m unittest discover -s app/tests -t .
+
+
+def span_names(run):
+    return [span['name'] for span in run['spans']]
+
+
+class PipelineMetricsTest(unittest.TestCase):
+
+    def test_spans_belong_to_the_run(self):
+        metrics = PipelineMetrics(keep_runs=5)
+        with metrics.run('labor'):
+            with metrics.span('stage', rows=3):
+                pass
+        with metrics.span('outside'):
+            pass
+
+        run, = metrics.runs()
+        self.assertEqual(run['status'], 'ok')
+        self.assertEqual(span_names(run), ['stage', 'labor'])
+        self.assertEqual(run['spans'][0]['rows'], 3)
+        self.assertIsNone(metrics.current_run())
+
+    def test_other_threads_stay_out_of_the_run(self):
+        metrics = PipelineMetrics(keep_runs=5)
+
+        def request():
+            with metrics.span('request'):
+                pass
+
+        with metrics.run('labor'):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+
+        run, = metrics.runs()
+        self.assertEqual(span_names(run), ['labor'])
+        # still timed, just not part of the run.
+        self.assertIn('stage="request"', metrics.render_prometheus())
+
+    def test_fan_out_tasks_join_the_run(self):
+        def query():
+            with pipeline_metrics.span('query'):
+                return 1
+
+        with pipeline_metrics.run('labor'):
+            results, _ = InsightUtils.FanOut({'a': query, 'b': query}, timeout=5)
+
+        self.assertEqual(results, {'a': 1, 'b': 1})
+        self.assertEqual(sorted(span_names(pipeline_metrics.runs()[0])), ['labor', 'query', 'query'])
+
+    def test_runs_dont_nest(self):
+        metrics = PipelineMetrics(keep_runs=5)
+        with metrics.run('outer'):
+            with metrics.run('inner'):
+                pass
+
+        run, = metrics.runs()
+        self.assertEqual(span_names(run), ['inner', 'outer'])
+
+    def test_failed_run(self):
+        metrics = PipelineMetrics(keep_runs=5)
+        with self.assertRaises(ValueError):
+            with metrics.run('labor'):
+                raise ValueError()
+        self.assertEqual(metrics.runs()[0]['status'], 'error')
+
+
+if __name__ == '__main__':
+    unittest.main()